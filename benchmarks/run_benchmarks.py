@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# Benchmarks of the offline hot paths of preprocessing, on synthetic data
+# (see synthetic_data.py):
+#   - A3mMutator.read_msa / apply_mutation / save_msa, and mutate_directory
+#   - A3MtoYAMLConverter.extract_msa_query_info / batch_convert
+#   - a3m line gathering of MMseqs2 results (read_a3m_lines) and the ticket
+#     client, against the local MockColabFoldServer
+#   - the dataset loaders (in-memory and streaming)
+# Every benchmark is timed `repeat` times (best and mean wall time reported,
+# with throughput in items/s and MiB/s), then run once more under tracemalloc
+# for the peak Python/NumPy allocation. Results can be saved as JSON and
+# compared against an earlier run with --baseline.
+#
+#   python benchmarks/run_benchmarks.py --depth 2000 --output after.json --baseline before.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / "src" / "ddg_predictor" / "data_prep"))
+import stage_paths  # noqa: E402,F401
+
+# The mock MMseqs2 server is a test fixture
+sys.path.insert(0, str(REPO_DIR / "tests"))
+
+from load_dataset import process_and_save  # noqa: E402
+from sequence_resolver import SequenceResolver  # noqa: E402
+from mmseq2_boltz import read_a3m_lines  # noqa: E402
+from mmseqs2_client import run_mmseqs2_batches  # noqa: E402
+from mock_colabfold_server import MockColabFoldServer  # noqa: E402
+from mut_msa import A3mMutator  # noqa: E402
+from mutation_table import group_mutations  # noqa: E402
+from m3a_to_yaml import A3MtoYAMLConverter  # noqa: E402
+from profiling import PROFILER  # noqa: E402
+from synthetic_data import write_dataset  # noqa: E402
+
+TEMPLATE_FILE = REPO_DIR / "config" / "boltz_query_template.yaml"
+
+
+def measure(name: str, run, setup=None, items: int = 0, nbytes: int = 0, repeat: int = 3) -> dict:
+    """
+    Time `run(setup())` `repeat` times, then once more under tracemalloc.
+    `setup` is not timed; it gives every run fresh state (e.g. an empty output directory).
+    Output printed by the benchmarked code is discarded.
+    """
+    times = []
+    for _ in range(repeat + 1):
+        state = setup() if setup is not None else None
+        traced = len(times) == repeat
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run(state)
+        elapsed = time.perf_counter() - start
+        if traced:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            times.append(elapsed)
+
+    best = min(times)
+    result = {
+        "name": name,
+        "items": items,
+        "best_s": best,
+        "mean_s": sum(times) / len(times),
+        "items_per_s": items / best if items and best > 0 else None,
+        "mib_per_s": nbytes / best / 2 ** 20 if nbytes and best > 0 else None,
+        "peak_alloc_mib": peak / 2 ** 20,
+    }
+    print(format_result(result))
+    return result
+
+
+def format_result(result: dict, baseline: dict | None = None) -> str:
+    line = f"{result['name']:<40} {result['best_s'] * 1000:>10.1f} ms"
+    line += f" {result['items_per_s']:>12.1f} it/s" if result["items_per_s"] else " " * 17
+    line += f" {result['mib_per_s']:>9.1f} MiB/s" if result["mib_per_s"] else " " * 15
+    line += f" {result['peak_alloc_mib']:>9.1f} MiB peak"
+    if baseline is not None:
+        line += f"  x{baseline['best_s'] / result['best_s']:.2f} vs baseline"
+    return line
+
+
+class Workload:
+    """Synthetic dataset on disk, plus the derived inputs shared by the benchmarks."""
+
+    def __init__(self, root: str, n_proteins: int, length: int, depth: int, mutations_per_protein: int,
+                 seed: int):
+        self.root = root
+        self.sequences = write_dataset(root, n_proteins, length, depth, mutations_per_protein, seed)
+        self.depth = depth
+        self.msa_dir = os.path.join(root, "msas")
+        self.msa_paths = sorted(os.path.join(self.msa_dir, f"{seq_id}.a3m") for seq_id in self.sequences)
+        self.msa_bytes = sum(os.path.getsize(path) for path in self.msa_paths)
+        self.mutations_df = pd.read_csv(os.path.join(root, "mut_data.csv"))
+        self.mutations_by_id = group_mutations(self.mutations_df)
+
+    def scratch(self, name: str) -> str:
+        """Empty directory under the workload root."""
+        path = os.path.join(self.root, "scratch", name)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+    def fresh_msa_dir(self, name: str) -> str:
+        """Copy of the WT MSAs, for benchmarks that write next to them."""
+        path = self.scratch(name)
+        for src in self.msa_paths:
+            shutil.copy(src, path)
+        return path
+
+
+def bench_mutator(work: Workload, repeat: int, workers: int) -> list[dict]:
+    mutator = A3mMutator(work.msa_dir, work.mutations_df)
+    n_mutations = len(work.mutations_df)
+    results = [measure("mutator.read_msa", lambda _: [mutator.read_msa(p) for p in work.msa_paths],
+                       items=len(work.msa_paths), nbytes=work.msa_bytes, repeat=repeat)]
+
+    def read_all(_=None):
+        # Fresh alignments, so memoized column patches do not carry over between runs
+        return {seq_id: mutator.read_msa(os.path.join(work.msa_dir, f"{seq_id}.a3m")) for seq_id in work.sequences}
+
+    def apply_all(alignments):
+        return [
+            mutator.apply_mutation(alignments[seq_id], {seq_id: mutation})
+            for seq_id, mutations in work.mutations_by_id.items()
+            for mutation in mutations
+        ]
+
+    results.append(measure("mutator.apply_mutation", apply_all, setup=read_all, items=n_mutations, repeat=repeat))
+
+    mutants = apply_all(read_all())
+    out_dir = work.scratch("save_msa")
+    mutant_bytes = sum(len(mutant.buffer) for mutant in mutants)
+
+    def save_all(_):
+        for i, mutant in enumerate(mutants):
+            mutator.save_msa(mutant, os.path.join(out_dir, f"{i}.a3m"))
+
+    results.append(measure("mutator.save_msa", save_all, items=len(mutants), nbytes=mutant_bytes, repeat=repeat))
+    del mutants
+
+    for storage, n_workers in dict.fromkeys([("full", 1), ("full", workers), ("delta", 1)]):
+        def mutate(msa_dir, storage=storage, n_workers=n_workers):
+            A3mMutator(msa_dir, work.mutations_df, storage=storage).mutate_directory(max_workers=n_workers)
+
+        results.append(measure(f"mutate_directory[{storage},workers={n_workers}]", mutate,
+                               setup=lambda: work.fresh_msa_dir("mutate_directory"),
+                               items=n_mutations, nbytes=work.msa_bytes, repeat=repeat))
+    return results
+
+
+def bench_converter(work: Workload, repeat: int, workers: int) -> list[dict]:
+    # Inputs: the WT MSAs and their full-storage mutants
+    msa_dir = work.fresh_msa_dir("converter_input")
+    with contextlib.redirect_stdout(io.StringIO()):
+        A3mMutator(msa_dir, work.mutations_df).mutate_directory()
+    paths = sorted(os.path.join(msa_dir, f) for f in os.listdir(msa_dir) if f.endswith(".a3m"))
+
+    converter = A3MtoYAMLConverter(msa_dir, work.scratch("converter_output"), str(TEMPLATE_FILE))
+    results = [measure("converter.extract_msa_query_info",
+                       lambda _: [converter.extract_msa_query_info(p) for p in paths],
+                       items=len(paths), repeat=repeat)]
+
+    for n_workers in sorted({1, workers}):
+        def convert(out_dir, n_workers=n_workers):
+            A3MtoYAMLConverter(msa_dir, out_dir, str(TEMPLATE_FILE), max_workers=n_workers).batch_convert()
+
+        results.append(measure(f"converter.batch_convert[workers={n_workers}]", convert,
+                               setup=lambda: work.scratch("converter_output"), items=len(paths), repeat=repeat))
+    return results
+
+
+def bench_mmseqs2(work: Workload, repeat: int, workers: int) -> list[dict]:
+    seqs = list(work.sequences.values())
+    results = []
+    with MockColabFoldServer(hits_per_query=work.depth - 1, polls_until_complete=0) as server:
+        # One ticket's result tarball, as the client downloads it
+        ticket = requests.post(f"{server.url}/ticket/msa",
+                               data={"q": "".join(f">{101 + i}\n{s}\n" for i, s in enumerate(seqs)), "mode": "env"},
+                               timeout=30).json()
+        content = requests.get(f"{server.url}/result/download/{ticket['id']}", timeout=300).content
+
+        results.append(measure("mmseqs2.read_a3m_lines", lambda _: read_a3m_lines(content, True, False),
+                               items=len(seqs), nbytes=len(content), repeat=repeat))
+
+        batch_size = max(1, len(seqs) // max(workers, 1))
+        batches = [seqs[i:i + batch_size] for i in range(0, len(seqs), batch_size)]
+        results.append(measure(
+            f"mmseqs2.client[tickets={len(batches)}]",
+            lambda _: run_mmseqs2_batches(batches, max_in_flight=workers, host_url=server.url,
+                                          poll_interval=(0.0, 0.0)),
+            items=len(seqs), repeat=repeat,
+        ))
+    return results
+
+
+def bench_loaders(work: Workload, repeat: int, workers: int) -> list[dict]:
+    raw_csv = os.path.join(work.root, "raw_type2.csv")
+    n_rows = len(work.mutations_df)
+    results = []
+    for chunksize in (None, max(1, n_rows // 10)):
+        label = "in-memory" if chunksize is None else f"chunksize={chunksize}"
+        results.append(measure(
+            f"loader2[{label}]",
+            lambda out_dir, chunksize=chunksize: process_and_save("2", raw_csv, out_dir, chunksize=chunksize),
+            setup=lambda: work.scratch("loader2"), items=n_rows, nbytes=os.path.getsize(raw_csv), repeat=repeat,
+        ))
+
+    # Loader1 reads Excel and resolves sequences; a pre-filled sequence cache keeps it offline
+    raw_xlsx = os.path.join(work.root, "raw_type1.xlsx")
+    work.mutations_df.rename(columns={"sequence_id": "uniprot", "mutation": "mut"}).to_excel(raw_xlsx, index=False)
+    sequence_cache = os.path.join(work.root, "sequences.sqlite")
+    SequenceResolver(cache_path=sequence_cache)._cache_store(work.sequences)
+
+    for chunksize in (None, max(1, n_rows // 10)):
+        label = "in-memory" if chunksize is None else f"chunksize={chunksize}"
+        results.append(measure(
+            f"loader1[{label}]",
+            lambda out_dir, chunksize=chunksize: process_and_save("1", raw_xlsx, out_dir, chunksize=chunksize,
+                                                                  sequence_cache=sequence_cache),
+            setup=lambda: work.scratch("loader1"), items=n_rows, repeat=repeat,
+        ))
+    return results
+
+
+BENCHMARKS = {
+    "mutator": bench_mutator,
+    "converter": bench_converter,
+    "mmseqs2": bench_mmseqs2,
+    "loaders": bench_loaders,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing hot paths on synthetic data")
+    parser.add_argument("--n_proteins", type=int, default=20, help="Number of WT proteins")
+    parser.add_argument("--length", type=int, default=300, help="Query length")
+    parser.add_argument("--depth", type=int, default=1000, help="Rows per MSA, query included")
+    parser.add_argument("--mutations_per_protein", type=int, default=20, help="Point mutants per protein")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic data")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes/tickets of the parallel variants")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="Benchmark groups to run")
+    parser.add_argument("--work_dir", default=None, help="Keep the synthetic data here (default: a temp dir)")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    root = args.work_dir or tempfile.mkdtemp(prefix="ddg_bench_")
+    try:
+        start = time.perf_counter()
+        work = Workload(root, args.n_proteins, args.length, args.depth, args.mutations_per_protein, args.seed)
+        print(f"Synthetic data: {args.n_proteins} MSAs of {args.depth} x {args.length}, "
+              f"{len(work.mutations_df)} mutations, {work.msa_bytes / 2 ** 20:.1f} MiB "
+              f"({time.perf_counter() - start:.1f}s)")
+
+        results = []
+        for name in args.only or BENCHMARKS:
+            results += BENCHMARKS[name](work, args.repeat, args.workers)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    config = {key: getattr(args, key) for key in ("n_proteins", "length", "depth", "mutations_per_protein",
+                                                  "seed", "repeat", "workers")}
+    report = {"config": config, "peak_rss_mib": PROFILER.max_rss_mb(), "results": results}
+    print(f"Peak RSS: {report['peak_rss_mib']:.1f} MiB")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print(f"Warning: baseline was run with {baseline['config']}")
+        previous = {result["name"]: result for result in baseline["results"]}
+        print("\nCompared to baseline:")
+        for result in results:
+            print(format_result(result, previous.get(result["name"])))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
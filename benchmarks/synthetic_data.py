@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# Synthetic inputs for the benchmarks: random WT sequences, A3M files of a
+# given depth and length shaped like MMseqs2 output (substitutions, gaps and
+# lowercase insertions relative to the query), mutation tables, and a raw
+# dataset in the dataset type '2' layout (see parse_dataset/loaders.py).
+# Everything is derived from one seed, so runs are comparable.
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+AA_BYTES = np.frombuffer(AMINO_ACIDS.encode("ascii"), dtype=np.uint8)
+LOWER_AA_BYTES = np.frombuffer(AMINO_ACIDS.lower().encode("ascii"), dtype=np.uint8)
+
+
+def random_sequence(length: int, rng: np.random.Generator) -> str:
+    return rng.choice(AA_BYTES, length).tobytes().decode("ascii")
+
+
+def homolog_row(query: np.ndarray, rng: np.random.Generator, identity: float,
+                gap_rate: float, insertion_rate: float) -> bytes:
+    """One aligned homolog of `query`: substitutions, gaps and insertions after match columns."""
+    row = query.copy()
+    substituted = rng.random(len(row)) > identity
+    row[substituted] = rng.choice(AA_BYTES, substituted.sum())
+    row[rng.random(len(row)) < gap_rate] = ord("-")
+
+    inserted = np.flatnonzero(rng.random(len(row)) < insertion_rate)
+    if not len(inserted):
+        return row.tobytes()
+    insertions = rng.choice(LOWER_AA_BYTES, len(inserted))
+    return np.insert(row, inserted + 1, insertions).tobytes()
+
+
+def synthetic_a3m(query: str, depth: int, rng: np.random.Generator, gap_rate: float = 0.1,
+                  insertion_rate: float = 0.02, name: str = "101") -> str:
+    """
+    A3M text with the query and `depth - 1` homologs whose identity to the
+    query is spread uniformly between 0.2 and 1.
+    """
+    query_bytes = np.frombuffer(query.encode("ascii"), dtype=np.uint8)
+    parts = [f">{name}\n{query}\n".encode("ascii")]
+    for i in range(depth - 1):
+        row = homolog_row(query_bytes, rng, rng.uniform(0.2, 1.0), gap_rate, insertion_rate)
+        parts.append(f">UniRef100_{i:07d}\t{rng.integers(50, 500)}\t0.{rng.integers(100, 999)}\n".encode("ascii"))
+        parts += [row, b"\n"]
+    return b"".join(parts).decode("ascii")
+
+
+def random_mutations(sequence: str, n: int, rng: np.random.Generator, max_sites: int = 1) -> list[str]:
+    """`n` distinct variants of `sequence`, like 'A23T' or 'A23T:G45V' with up to `max_sites` sites."""
+    mutations = set()
+    while len(mutations) < min(n, 19 * len(sequence)):
+        n_sites = int(rng.integers(1, max_sites + 1))
+        positions = sorted(rng.choice(len(sequence), n_sites, replace=False))
+        sites = []
+        for pos in positions:
+            new_res = rng.choice([aa for aa in AMINO_ACIDS if aa != sequence[pos]])
+            sites.append(f"{sequence[pos]}{pos + 1}{new_res}")
+        mutations.add(":".join(sites))
+    return sorted(mutations)
+
+
+def write_dataset(out_dir: str, n_proteins: int = 20, length: int = 300, depth: int = 1000,
+                  mutations_per_protein: int = 20, seed: int = 0) -> dict[str, str]:
+    """
+    Write a synthetic preprocessing workload to `out_dir`:
+        msas/<sequence_id>.a3m   WT MSAs
+        mut_data.csv             sequence_id, mutation, ddg
+        wt_sequences.fasta       WT sequences
+        raw_type2.csv            the same mutations as a dataset type '2' table
+
+    Returns:
+        dict[str, str]: Sequences by ID.
+    """
+    rng = np.random.default_rng(seed)
+    msa_dir = os.path.join(out_dir, "msas")
+    os.makedirs(msa_dir, exist_ok=True)
+
+    sequences = {f"SYN{i:05d}": random_sequence(length, rng) for i in range(n_proteins)}
+    rows, raw_rows = [], []
+    for seq_id, sequence in sequences.items():
+        a3m = synthetic_a3m(sequence, depth, rng, name=seq_id)
+        with open(os.path.join(msa_dir, f"{seq_id}.a3m"), "w") as f:
+            f.write(a3m)
+
+        for mutation in random_mutations(sequence, mutations_per_protein, rng):
+            ddg = round(float(rng.normal(0.0, 1.5)), 3)
+            rows.append((seq_id, mutation, ddg))
+            wt_res, index, mut_res = mutation[0], int(mutation[1:-1]) - 1, mutation[-1]
+            mut_seq = sequence[:index] + mut_res + sequence[index + 1:]
+            raw_rows.append((seq_id, wt_res, index + 1, index, mut_res, mut_seq, sequence, ddg, 0))
+
+    pd.DataFrame(rows, columns=["sequence_id", "mutation", "ddg"]).to_csv(
+        os.path.join(out_dir, "mut_data.csv"), index=False)
+    pd.DataFrame(raw_rows, columns=["pdb", "wildtype", "pdb_resseq", "seq_index", "mutation",
+                                    "mut_seq", "wt_seq", "ddG", "group"]).to_csv(
+        os.path.join(out_dir, "raw_type2.csv"), index=False)
+    with open(os.path.join(out_dir, "wt_sequences.fasta"), "w") as f:
+        f.writelines(f">{seq_id}\n{sequence}\n" for seq_id, sequence in sequences.items())
+    return sequences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic MSAs and mutation tables")
+    parser.add_argument("out_dir", help="Output directory")
+    parser.add_argument("--n_proteins", type=int, default=20, help="Number of WT proteins")
+    parser.add_argument("--length", type=int, default=300, help="Query length")
+    parser.add_argument("--depth", type=int, default=1000, help="Rows per MSA, query included")
+    parser.add_argument("--mutations_per_protein", type=int, default=20, help="Point mutants per protein")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    write_dataset(args.out_dir, args.n_proteins, args.length, args.depth, args.mutations_per_protein, args.seed)
+    print(f"Synthetic dataset written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+#!/bin/bash
+
+set -e 
+
+cd "$(dirname "$0")/.."
+
+RAW_DB_PATH="$1"
+WORKERS="${2:-1}"
+
+DATASET_NAME="$(basename "$RAW_DB_PATH" | sed 's/\.[^.]*$//')"
+PROCESSED_DIR="data/processed/$DATASET_NAME"
+PREDICTIONS_DIR="data/predictions/$DATASET_NAME/"
+
+# Sharded queries (preprocess.py --query_shard_size) take precedence over single YAML files
+QUERY_DIR="$PROCESSED_DIR/boltz_query_shards"
+if [ ! -d "$QUERY_DIR" ]; then
+    QUERY_DIR="$PROCESSED_DIR/boltz_queries"
+fi
+
+# Finished queries are recorded in $PREDICTIONS_DIR/results.jsonl and skipped on rerun.
+# Arguments after the second one are passed on to `boltz predict`.
+python src/ddg_predictor/inference/boltz_scheduler.py \
+    --query_dir "$QUERY_DIR" \
+    --out_dir "$PREDICTIONS_DIR" \
+    --workers "$WORKERS" \
+    "${@:3}"
@@ -9,30 +9,27 @@ RAW_DB_PATH="$2"
 
 DATASET_NAME="$(basename "$RAW_DB_PATH" | sed 's/\.[^.]*$//')"
 OUTPUT_DIR="data/processed/$DATASET_NAME/"
-
-echo "Cleaning previous outputs..."
-python clean.py
-
-
-echo "Loading dataset..."
-python src/ddg_predictor/data_prep/parse_dataset/load_dataset.py \
+# Lives outside data/processed so clean.py never wipes it
+MSA_CACHE_DIR="data/cache/msas"
+# Least recently used MSAs are evicted beyond these limits (override from the environment)
+MSA_CACHE_MAX_SIZE_MB="${MSA_CACHE_MAX_SIZE_MB:-51200}"
+MSA_CACHE_MAX_AGE_DAYS="${MSA_CACHE_MAX_AGE_DAYS:-180}"
+SEQUENCE_CACHE="data/cache/sequences.sqlite"
+mkdir -p data/cache
+
+# Runs are incremental: finished items are recorded in $OUTPUT_DIR/manifest.jsonl
+# and skipped next time. Pass --clean as third argument to start from scratch.
+if [ "$3" == "--clean" ]; then
+    echo "Cleaning previous outputs..."
+    python clean.py
+fi
+
+python src/ddg_predictor/data_prep/preprocess.py \
     --dataset_type "$DATASET_TYPE" \
     --raw_path "$RAW_DB_PATH" \
-    --output_dir "$OUTPUT_DIR" 
-
-OUTPUT_FASTA="$OUTPUT_DIR/wt_sequences.fasta"
-OUTPUT_MUT_DATA="$OUTPUT_DIR/mut_data.csv"
-
-echo "Generating MSAs..."
-python src/ddg_predictor/data_prep/get_msas/msa_stack.py \
-    --input_fasta "$OUTPUT_FASTA" \
-    --output_dir "$OUTPUT_DIR"\
-    --mutations_csv "$OUTPUT_MUT_DATA"
-
-MSAS_DIR="${OUTPUT_DIR}msas/"
-
-python src/ddg_predictor/data_prep/to_boltz_query/m3a_to_yaml.py \
-    "$MSAS_DIR" \
-    "$OUTPUT_DIR" \
-    "config/boltz_query_template.yaml"
-
+    --output_dir "$OUTPUT_DIR" \
+    --template "config/boltz_query_template.yaml" \
+    --sequence_cache "$SEQUENCE_CACHE" \
+    --msa_cache_dir "$MSA_CACHE_DIR" \
+    --msa_cache_max_size_mb "$MSA_CACHE_MAX_SIZE_MB" \
+    --msa_cache_max_age_days "$MSA_CACHE_MAX_AGE_DAYS"
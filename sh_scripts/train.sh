@@ -0,0 +1,30 @@
+#!/bin/bash
+
+set -e 
+
+cd "$(dirname "$0")/.."
+
+RAW_DB_PATH="$1"
+
+DATASET_NAME="$(basename "$RAW_DB_PATH" | sed 's/\.[^.]*$//')"
+PROCESSED_DIR="data/processed/$DATASET_NAME"
+MODEL_OUT="data/models/$DATASET_NAME/ddg_ridge.npz"
+
+# Mutation table written by preprocess.sh (Parquet if it was run with --output_format parquet)
+MUTATIONS="$PROCESSED_DIR/mut_data.parquet"
+if [ ! -f "$MUTATIONS" ]; then
+    MUTATIONS="$PROCESSED_DIR/mut_data.csv"
+fi
+
+# Per-residue embeddings can be given as a second argument; otherwise the
+# WT MSA features (built on first use) stand in for them
+if [ -n "$2" ]; then
+    EMBEDDING_ARGS=(--embedding_dir "$2")
+else
+    EMBEDDING_ARGS=(--msa_dir "$PROCESSED_DIR/msas" --feature_cache_dir "data/cache/features/$DATASET_NAME")
+fi
+
+python src/ddg_predictor/training/ddg_regressor.py \
+    --mutations "$MUTATIONS" \
+    "${EMBEDDING_ARGS[@]}" \
+    --model_out "$MODEL_OUT"
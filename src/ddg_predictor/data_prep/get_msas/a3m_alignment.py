@@ -0,0 +1,300 @@
+import mmap
+import operator
+import os
+
+import numpy as np
+
+GAP = ord("-")
+NEWLINE = ord("\n")
+HEADER_START = ord(">")
+# Bytes scanned per step when indexing, bounds the temporary newline mask
+INDEX_BLOCK_SIZE = 1 << 24
+
+
+class A3mAlignment:
+    """
+    A3M alignment held as a single flat uint8 buffer laid out exactly like the
+    file on disk (">header\\nSEQUENCE\\n" per record), plus the offset of every
+    header and sequence in it. Columns are match columns (uppercase residues
+    and gaps, insertions excluded), the same space as match_matrix and the
+    MSA features: the buffer index of every match column of every row is
+    computed once (match_positions), so a substitution is one vectorized
+    write over all rows and serialization is a plain buffer write.
+    """
+
+    def __init__(self, buffer: np.ndarray, header_offsets: np.ndarray,
+                 seq_offsets: np.ndarray, seq_lengths: np.ndarray):
+        """
+        Args:
+            buffer (np.ndarray): uint8 file content, one line per header and per sequence.
+            header_offsets (np.ndarray): Offset of each record's '>' in `buffer`.
+            seq_offsets (np.ndarray): Offset of each record's first residue in `buffer`.
+            seq_lengths (np.ndarray): Length of each record's aligned sequence.
+        """
+        self.buffer = buffer
+        self.header_offsets = header_offsets
+        self.seq_offsets = seq_offsets
+        self.seq_lengths = seq_lengths
+        self._query_columns: np.ndarray | None = None
+        self._match_positions: np.ndarray | None = None
+        # (column, residue) -> residue_patch result, shared by variants hitting the same site
+        self._patches: dict[tuple[int, str], tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_file(cls, path: str, memory_map: bool = True) -> "A3mAlignment":
+        """
+        Load an A3M file. By default the file is memory-mapped read-only and
+        only the record offsets are built, in one scan: residues are paged in
+        when a row is read, and copies (mutants, row selections) are taken
+        straight from the mapping. Files that need normalizing are read into
+        memory (see from_bytes).
+        The mapping stays valid if the file is replaced (os.replace), but the
+        file must not be truncated or rewritten in place while it is in use.
+        """
+        with open(path, "rb") as f:
+            if not memory_map or os.fstat(f.fileno()).st_size == 0:
+                return cls.from_bytes(f.read())
+            # The mapping outlives the file object, it is released with the last array using it
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mapped[-1] == NEWLINE and mapped.find(b"\r") < 0:
+            alignment = cls._index(np.frombuffer(mapped, dtype=np.uint8))
+            if alignment is not None:
+                return alignment
+        return cls.from_bytes(mapped[:])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "A3mAlignment":
+        """
+        Build the alignment from raw A3M content. Files with one line per header
+        and per sequence (as written by this pipeline) are indexed in place;
+        anything else (wrapped sequences, blank lines, CRLF) is normalized first.
+        """
+        if not data.endswith(b"\n"):
+            data += b"\n"
+        alignment = None
+        if b"\r" not in data:
+            alignment = cls._index(np.frombuffer(data, dtype=np.uint8))
+        if alignment is None:
+            return cls.from_records(cls._parse_records(data.decode("utf-8")))
+        return alignment
+
+    @classmethod
+    def _index(cls, buffer: np.ndarray) -> "A3mAlignment | None":
+        """
+        Index a newline-terminated buffer with one line per header and per
+        sequence, None if it is laid out differently.
+        """
+        blocks = [np.flatnonzero(buffer[start:start + INDEX_BLOCK_SIZE] == NEWLINE) + start
+                  for start in range(0, len(buffer), INDEX_BLOCK_SIZE)]
+        newlines = np.concatenate(blocks)
+        if len(newlines) % 2:
+            return None
+
+        line_starts = np.concatenate(([0], newlines[:-1] + 1))
+        header_offsets, seq_offsets = line_starts[0::2], line_starts[1::2]
+        if not (buffer[header_offsets] == HEADER_START).all() or (buffer[seq_offsets] == HEADER_START).any():
+            return None
+        return cls(buffer, header_offsets, seq_offsets, newlines[1::2] - seq_offsets)
+
+    @classmethod
+    def from_records(cls, records: list[tuple[str, str]]) -> "A3mAlignment":
+        """Build the alignment from (header, sequence) tuples, headers including '>'."""
+        parts = []
+        header_offsets, seq_offsets, seq_lengths = [], [], []
+        pos = 0
+        for header, seq in records:
+            header_bytes, seq_bytes = header.encode("utf-8"), seq.encode("utf-8")
+            header_offsets.append(pos)
+            pos += len(header_bytes) + 1
+            seq_offsets.append(pos)
+            seq_lengths.append(len(seq_bytes))
+            pos += len(seq_bytes) + 1
+            parts += [header_bytes, b"\n", seq_bytes, b"\n"]
+
+        buffer = np.frombuffer(b"".join(parts), dtype=np.uint8)
+        return cls(buffer, np.array(header_offsets, dtype=np.int64),
+                   np.array(seq_offsets, dtype=np.int64), np.array(seq_lengths, dtype=np.int64))
+
+    @staticmethod
+    def _parse_records(text: str) -> list[tuple[str, str]]:
+        records = []
+        header = None
+        seq_parts = []
+        for line in text.splitlines():
+            line = line.rstrip()
+            if line.startswith(">"):
+                if header is not None:
+                    records.append((header, "".join(seq_parts)))
+                header = line
+                seq_parts = []
+            elif header is not None:
+                seq_parts.append(line.strip())
+        if header is not None:
+            records.append((header, "".join(seq_parts)))
+        return records
+
+    def __len__(self) -> int:
+        return len(self.seq_offsets)
+
+    def __getitem__(self, key):
+        """
+        Record i as a (header, sequence) tuple, or the records of a slice as a
+        new alignment. Contiguous slices share this alignment's buffer (and
+        file mapping), other slices are copied.
+        """
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self.select(np.arange(start, stop, step))
+            return self._view(start, max(stop, start))
+
+        i = operator.index(key)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Record {key} out of range for {len(self)} records")
+        return self.header(i), self.sequence(i)
+
+    def _view(self, start: int, stop: int) -> "A3mAlignment":
+        """Records start..stop-1 over a slice of the buffer, without copying."""
+        if start == stop:
+            empty = np.empty(0, dtype=np.int64)
+            return A3mAlignment(self.buffer[:0], empty, empty, empty)
+        base = int(self.header_offsets[start])
+        end = int(self.seq_offsets[stop - 1] + self.seq_lengths[stop - 1]) + 1
+        view = A3mAlignment(self.buffer[base:end], self.header_offsets[start:stop] - base,
+                            self.seq_offsets[start:stop] - base, self.seq_lengths[start:stop])
+        if start == 0:
+            view._query_columns = self._query_columns
+        return view
+
+    def header(self, i: int) -> str:
+        """Header line of record i, including the leading '>'."""
+        return self.buffer[self.header_offsets[i]:self.seq_offsets[i] - 1].tobytes().decode("utf-8")
+
+    def sequence(self, i: int) -> str:
+        """Aligned sequence of record i."""
+        start = self.seq_offsets[i]
+        return self.buffer[start:start + self.seq_lengths[i]].tobytes().decode("utf-8")
+
+    def records(self):
+        """Iterate over (header, sequence) tuples."""
+        for i in range(len(self)):
+            yield self.header(i), self.sequence(i)
+
+    @property
+    def query_columns(self) -> np.ndarray:
+        """0-based alignment column of every ungapped query position (uppercase query residues)."""
+        if self._query_columns is None:
+            query = self.buffer[self.seq_offsets[0]:self.seq_offsets[0] + self.seq_lengths[0]]
+            self._query_columns = np.flatnonzero((query >= ord("A")) & (query <= ord("Z")))
+        return self._query_columns
+
+    @property
+    def ungapped_query(self) -> str:
+        """Query sequence without gaps or insertions."""
+        return self.buffer[self.seq_offsets[0] + self.query_columns].tobytes().decode("utf-8")
+
+    def query_residue(self, query_pos: int) -> str:
+        """Residue at a 1-based ungapped query position."""
+        if not 1 <= query_pos <= len(self.query_columns):
+            raise ValueError(f"Query position {query_pos} exceeds sequence length.")
+        return chr(self.buffer[self.seq_offsets[0] + self.query_columns[query_pos - 1]])
+
+    def column_index(self, query_pos: int) -> int:
+        """Map a 1-based ungapped query position to its 0-based match column."""
+        if not 1 <= query_pos <= len(self.query_columns):
+            raise ValueError(f"Query position {query_pos} exceeds sequence length.")
+        query = self.buffer[self.seq_offsets[0]:self.seq_offsets[0] + self.query_columns[query_pos - 1]]
+        # Match columns before it: everything but the query's own insertions
+        return int(np.count_nonzero((query < ord("a")) | (query > ord("z"))))
+
+    def match_positions(self) -> np.ndarray:
+        """
+        (N, L) buffer index of every match column (uppercase residue or gap)
+        of every row, L being the query length. Computed once per alignment.
+        """
+        if self._match_positions is None:
+            lengths = self.seq_lengths
+            starts = np.repeat(self.seq_offsets - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+            positions = starts + np.arange(lengths.sum())
+            residues = self.buffer[positions]
+            positions = positions[(residues < ord("a")) | (residues > ord("z"))]
+            width = len(self.query_columns)
+            if len(positions) != len(self) * width:
+                raise ValueError("Rows do not all have as many match columns as the query")
+            self._match_positions = positions.reshape(len(self), width)
+        return self._match_positions
+
+    def match_matrix(self) -> np.ndarray:
+        """(N, L) uint8 matrix of the match columns of every row, insertions dropped."""
+        return self.buffer[self.match_positions()]
+
+    def select(self, rows: np.ndarray) -> "A3mAlignment":
+        """Return a new alignment made of the given records, in the given order."""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.header_offsets[rows]
+        # Each record spans its header line and its sequence line, newlines included
+        sizes = self.seq_offsets[rows] + self.seq_lengths[rows] + 1 - starts
+        new_starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        buffer = self.buffer[np.repeat(starts - new_starts, sizes) + np.arange(sizes.sum())]
+
+        selected = A3mAlignment(buffer, new_starts, new_starts + self.seq_offsets[rows] - starts,
+                                self.seq_lengths[rows])
+        if len(rows) and rows[0] == 0:
+            selected._query_columns = self._query_columns
+        return selected
+
+    def residue_patch(self, column: int, residue: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the buffer writes that set match column `column` to `residue`
+        in every row, skipping gaps. Insertions are never touched.
+        Results are memoized per (column, residue).
+        Case needs no lowercase mask: lowercase residues are insertions, which
+        are never at a match column, so every written residue is uppercase
+        (a row that covers the site with an insertion keeps it unchanged).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Buffer indices and the uint8 values to write there.
+        """
+        key = (column, residue)
+        if key not in self._patches:
+            self._patches[key] = self._compute_patch(column, residue)
+        return self._patches[key]
+
+    def _compute_patch(self, column: int, residue: str) -> tuple[np.ndarray, np.ndarray]:
+        indices = self.match_positions()[:, column]
+        indices = indices[self.buffer[indices] != GAP]
+        return indices, np.full(len(indices), ord(residue.upper()), dtype=np.uint8)
+
+    def with_patches(self, patches: list[tuple[np.ndarray, np.ndarray]],
+                     query_header: str | None = None) -> "A3mAlignment":
+        """
+        Return a copy with the given residue patches applied, optionally
+        renaming the query record. Patch indices refer to this alignment's buffer.
+        """
+        if query_header is None:
+            buffer = self.buffer.copy()
+            shift = 0
+        else:
+            header_bytes = np.frombuffer(query_header.encode("utf-8") + b"\n", dtype=np.uint8)
+            buffer = np.concatenate((header_bytes, self.buffer[self.seq_offsets[0]:]))
+            shift = len(header_bytes) - int(self.seq_offsets[0])
+
+        for indices, values in patches:
+            buffer[indices + shift] = values
+
+        header_offsets = self.header_offsets + shift
+        header_offsets[0] = 0
+        mutated = A3mAlignment(buffer, header_offsets, self.seq_offsets + shift, self.seq_lengths)
+        mutated._query_columns = self._query_columns
+        return mutated
+
+    def to_bytes(self) -> bytes:
+        return self.buffer.tobytes()
+
+    def write(self, path: str) -> None:
+        """Write the alignment to an A3M file."""
+        with open(path, "wb") as f:
+            f.write(memoryview(self.buffer))
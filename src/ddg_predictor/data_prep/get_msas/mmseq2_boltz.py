@@ -1,19 +1,22 @@
-# Modified MMseqs2 wrapper to delete temporary files after use
+# Modified MMseqs2 wrapper that reads results in memory instead of using temporary files
 
 # From https://github.com/sokrypton/ColabFold/blob/main/colabfold/colabfold.py
 
+import io
 import logging
-import os
 import random
 import tarfile
 import time
+import warnings
 from typing import Optional, Union, Dict
-import shutil
 
 import requests
 from requests.auth import HTTPBasicAuth
 from tqdm import tqdm
 
+from msa_cache import MsaCache, server_backend
+from profiling import PROFILER
+
 logger = logging.getLogger(__name__)
 
 TQDM_BAR_FORMAT = (
@@ -21,9 +24,73 @@ TQDM_BAR_FORMAT = (
 )
 
 
+def get_mode(use_env: bool, use_filter: bool, use_pairing: bool, pairing_strategy: str) -> str:
+    """Return the MMseqs2 server mode string for the given search options."""
+    if use_filter:
+        mode = "env" if use_env else "all"
+    else:
+        mode = "env-nofilter" if use_env else "nofilter"
+
+    if use_pairing:
+        mode = ""
+        # greedy is default, complete was the previous behavior
+        if pairing_strategy == "greedy":
+            mode = "pairgreedy"
+        elif pairing_strategy == "complete":
+            mode = "paircomplete"
+        if use_env:
+            mode = mode + "-env"
+    return mode
+
+
+def get_a3m_filenames(use_env: bool, use_pairing: bool) -> list[str]:
+    """Return the names of the a3m files in the server result tarball."""
+    if use_pairing:
+        return ["pair.a3m"]
+    a3m_files = ["uniref.a3m"]
+    if use_env:
+        a3m_files.append("bfd.mgnify30.metaeuk30.smag30.a3m")
+    return a3m_files
+
+
+def gather_a3m_lines(lines, a3m_lines: dict[int, list[str]]) -> dict[int, list[str]]:
+    """
+    Split the lines of one result a3m file by query number (>101, >102, ...).
+    Queries are separated by a NUL byte in the server output.
+    """
+    update_M, M = True, None
+    for line in lines:
+        if len(line) > 0:
+            if "\x00" in line:
+                line = line.replace("\x00", "")
+                update_M = True
+            if line.startswith(">") and update_M:
+                M = int(line[1:].rstrip())
+                update_M = False
+                if M not in a3m_lines:
+                    a3m_lines[M] = []
+            a3m_lines[M].append(line)
+    return a3m_lines
+
+
+def read_a3m_lines(content: bytes, use_env: bool, use_pairing: bool) -> dict[int, list[str]]:
+    """
+    Split the a3m files of a server result tarball by query number, reading
+    the needed members straight from the downloaded bytes in a single pass.
+    """
+    a3m_names = set(get_a3m_filenames(use_env, use_pairing))
+    a3m_lines = {}
+    with tarfile.open(fileobj=io.BytesIO(content), mode="r|gz") as tar_gz:
+        for member in tar_gz:
+            if member.isfile() and member.name.split("/")[-1] in a3m_names:
+                member_file = tar_gz.extractfile(member)
+                gather_a3m_lines((line.decode("utf-8") for line in member_file), a3m_lines)
+    return a3m_lines
+
+
 def run_mmseqs2(  # noqa: PLR0912, D103, C901, PLR0915
     x: Union[str, list[str]],
-    prefix: str = "tmp",
+    prefix: Optional[str] = None,
     use_env: bool = True,
     use_filter: bool = True,
     use_pairing: bool = False,
@@ -32,7 +99,11 @@ def run_mmseqs2(  # noqa: PLR0912, D103, C901, PLR0915
     msa_server_username: Optional[str] = None,
     msa_server_password: Optional[str] = None,
     auth_headers: Optional[Dict[str, str]] = None,
+    cache: Optional[MsaCache] = None,
 ) -> tuple[list[str], list[str]]:
+    if prefix is not None:
+        # Results are extracted in memory since the tarball is no longer written to disk
+        warnings.warn("run_mmseqs2(prefix=...) is deprecated and ignored", DeprecationWarning, stacklevel=2)
     submission_endpoint = "ticket/pair" if use_pairing else "ticket/msa"
 
     # Validate mutually exclusive authentication methods
@@ -135,7 +206,7 @@ def run_mmseqs2(  # noqa: PLR0912, D103, C901, PLR0915
             out = {"status": "ERROR"}
         return out
 
-    def download(ID, path):
+    def download(ID):
         error_count = 0
         while True:
             try:
@@ -157,50 +228,44 @@ def run_mmseqs2(  # noqa: PLR0912, D103, C901, PLR0915
                 time.sleep(5)
             else:
                 break
-        with open(path, "wb") as out:
-            out.write(res.content)
+        return res.content
 
     # process input x
     seqs = [x] if isinstance(x, str) else x
 
     # setup mode
-    if use_filter:
-        mode = "env" if use_env else "all"
-    else:
-        mode = "env-nofilter" if use_env else "nofilter"
-
-    if use_pairing:
-        mode = ""
-        # greedy is default, complete was the previous behavior
-        if pairing_strategy == "greedy":
-            mode = "pairgreedy"
-        elif pairing_strategy == "complete":
-            mode = "paircomplete"
-        if use_env:
-            mode = mode + "-env"
-
-    # define path
-    path = f"{prefix}_{mode}"
-    if not os.path.isdir(path):
-        os.mkdir(path)
+    mode = get_mode(use_env, use_filter, use_pairing, pairing_strategy)
+    backend = server_backend(host_url)
 
-    # call mmseqs2 api
-    tar_gz_file = f"{path}/out.tar.gz"
     N, REDO = 101, True
 
     # deduplicate and keep track of order
     seqs_unique = []
     # TODO this might be slow for large sets
     [seqs_unique.append(x) for x in seqs if x not in seqs_unique]
-    Ms = [N + seqs_unique.index(seq) for seq in seqs]
-    # lets do it!
-    if not os.path.isfile(tar_gz_file):
-        TIME_ESTIMATE = 150 * len(seqs_unique)
-        with tqdm(total=TIME_ESTIMATE, bar_format=TQDM_BAR_FORMAT) as pbar:
-            while REDO:
-                pbar.set_description("SUBMIT")
-
-                # Resubmit job until it goes through
+
+    # serve previously computed MSAs from the persistent cache
+    # (paired MSAs depend on the whole query set, so they are never cached)
+    cached_blocks = {}
+    if cache is not None and not use_pairing:
+        for seq in seqs_unique:
+            block = cache.get(MsaCache.make_key(seq, mode, use_env, use_filter, pairing_strategy, backend))
+            if block is not None:
+                cached_blocks[seq] = block
+        logger.debug(f"MSA cache hits: {len(cached_blocks)}/{len(seqs_unique)}")
+        if len(cached_blocks) == len(seqs_unique):
+            cache.flush()
+            return [cached_blocks[seq] for seq in seqs]
+        seqs_unique = [seq for seq in seqs_unique if seq not in cached_blocks]
+
+    # call mmseqs2 api (the result tarball is kept in memory)
+    TIME_ESTIMATE = 150 * len(seqs_unique)
+    with tqdm(total=TIME_ESTIMATE, bar_format=TQDM_BAR_FORMAT) as pbar:
+        while REDO:
+            pbar.set_description("SUBMIT")
+
+            # Resubmit job until it goes through
+            with PROFILER.phase("mmseqs2.submit", items=len(seqs_unique)):
                 out = submit(seqs_unique, mode, N)
                 while out["status"] in ["UNKNOWN", "RATELIMIT"]:
                     sleep_time = 5 + random.randint(0, 5)
@@ -209,91 +274,69 @@ def run_mmseqs2(  # noqa: PLR0912, D103, C901, PLR0915
                     time.sleep(sleep_time)
                     out = submit(seqs_unique, mode, N)
 
-                if out["status"] == "ERROR":
-                    msg = (
-                        "MMseqs2 API is giving errors. Please confirm your "
-                        " input is a valid protein sequence. If error persists, "
-                        "please try again an hour later."
-                    )
-                    raise Exception(msg)
-
-                if out["status"] == "MAINTENANCE":
-                    msg = (
-                        "MMseqs2 API is undergoing maintenance. "
-                        "Please try again in a few minutes."
-                    )
-                    raise Exception(msg)
+            if out["status"] == "ERROR":
+                msg = (
+                    "MMseqs2 API is giving errors. Please confirm your "
+                    " input is a valid protein sequence. If error persists, "
+                    "please try again an hour later."
+                )
+                raise Exception(msg)
 
-                # wait for job to finish
-                ID, TIME = out["id"], 0
-                logger.debug(f"MSA job submitted successfully with ID: {ID}")
-                pbar.set_description(out["status"])
-                while out["status"] in ["UNKNOWN", "RUNNING", "PENDING"]:
-                    t = 5 + random.randint(0, 5)
-                    logger.error(f"Sleeping for {t}s. Reason: {out['status']}")
+            if out["status"] == "MAINTENANCE":
+                msg = (
+                    "MMseqs2 API is undergoing maintenance. "
+                    "Please try again in a few minutes."
+                )
+                raise Exception(msg)
+
+            # wait for job to finish
+            ID, TIME = out["id"], 0
+            logger.debug(f"MSA job submitted successfully with ID: {ID}")
+            pbar.set_description(out["status"])
+            while out["status"] in ["UNKNOWN", "RUNNING", "PENDING"]:
+                t = 5 + random.randint(0, 5)
+                logger.error(f"Sleeping for {t}s. Reason: {out['status']}")
+                # Time waiting in the server queue and running the search is reported separately
+                with PROFILER.phase("mmseqs2.run" if out["status"] == "RUNNING" else "mmseqs2.queue"):
                     time.sleep(t)
                     out = status(ID)
-                    pbar.set_description(out["status"])
-                    if out["status"] == "RUNNING":
-                        TIME += t
-                        pbar.update(n=t)
-
-                if out["status"] == "COMPLETE":
-                    logger.debug(f"MSA job completed successfully for ID: {ID}")
-                    if TIME < TIME_ESTIMATE:
-                        pbar.update(n=(TIME_ESTIMATE - TIME))
-                    REDO = False
-
-                if out["status"] == "ERROR":
-                    REDO = False
-                    msg = (
-                        "MMseqs2 API is giving errors. Please confirm your "
-                        " input is a valid protein sequence. If error persists, "
-                        "please try again an hour later."
-                    )
-                    raise Exception(msg)
-
-            # Download results
-            download(ID, tar_gz_file)
-
-    # prep list of a3m files
-    if use_pairing:
-        a3m_files = [f"{path}/pair.a3m"]
-    else:
-        a3m_files = [f"{path}/uniref.a3m"]
-        if use_env:
-            a3m_files.append(f"{path}/bfd.mgnify30.metaeuk30.smag30.a3m")
-
-    # extract a3m files
-    if any(not os.path.isfile(a3m_file) for a3m_file in a3m_files):
-        with tarfile.open(tar_gz_file) as tar_gz:
-            tar_gz.extractall(path)
-
-    # gather a3m lines
-    a3m_lines = {}
-    for a3m_file in a3m_files:
-        update_M, M = True, None
-        for line in open(a3m_file, "r"):
-            if len(line) > 0:
-                if "\x00" in line:
-                    line = line.replace("\x00", "")
-                    update_M = True
-                if line.startswith(">") and update_M:
-                    M = int(line[1:].rstrip())
-                    update_M = False
-                    if M not in a3m_lines:
-                        a3m_lines[M] = []
-                a3m_lines[M].append(line)
-
-    a3m_lines = ["".join(a3m_lines[n]) for n in Ms]
-
+                pbar.set_description(out["status"])
+                if out["status"] == "RUNNING":
+                    TIME += t
+                    pbar.update(n=t)
+
+            if out["status"] == "COMPLETE":
+                logger.debug(f"MSA job completed successfully for ID: {ID}")
+                if TIME < TIME_ESTIMATE:
+                    pbar.update(n=(TIME_ESTIMATE - TIME))
+                REDO = False
+
+            if out["status"] == "ERROR":
+                REDO = False
+                msg = (
+                    "MMseqs2 API is giving errors. Please confirm your "
+                    " input is a valid protein sequence. If error persists, "
+                    "please try again an hour later."
+                )
+                raise Exception(msg)
 
+        # Download results
+        with PROFILER.phase("mmseqs2.download", items=len(seqs_unique)):
+            content = download(ID)
 
+    # gather a3m lines straight from the downloaded tarball
+    with PROFILER.phase("mmseqs2.parse", items=len(seqs_unique)):
+        a3m_lines = read_a3m_lines(content, use_env, use_pairing)
 
-    if os.path.exists(path):
-        shutil.rmtree(path)  
+    a3m_blocks = {seq: "".join(a3m_lines[N + i]) for i, seq in enumerate(seqs_unique)}
 
+    if cache is not None and not use_pairing:
+        for seq, block in a3m_blocks.items():
+            cache.put(MsaCache.make_key(seq, mode, use_env, use_filter, pairing_strategy, backend), block)
+        cache.evict()
+    a3m_blocks.update(cached_blocks)
 
+    a3m_lines = [a3m_blocks[seq] for seq in seqs]
 
     return a3m_lines
 
@@ -0,0 +1,292 @@
+# Asynchronous client for the ColabFold MMseqs2 server.
+# Keeps the ticket lifecycle of run_mmseqs2 (submit -> poll -> download, with the
+# same retry, RATELIMIT and MAINTENANCE handling) but drives many tickets at once
+# from a single event loop over a pooled, keep-alive requests.Session.
+
+import asyncio
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from mmseq2_boltz import get_mode, read_a3m_lines
+from msa_cache import MsaCache, server_backend
+from profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+
+class MMseqs2Client:
+    """
+    Submits, polls and downloads MMseqs2 tickets concurrently.
+    HTTP calls are blocking `requests` calls run in a thread pool, sharing one
+    session so connections to the server are reused across tickets.
+    """
+
+    def __init__(
+        self,
+        host_url: str = "https://api.colabfold.com",
+        use_env: bool = True,
+        use_filter: bool = True,
+        use_pairing: bool = False,
+        pairing_strategy: str = "greedy",
+        msa_server_username: Optional[str] = None,
+        msa_server_password: Optional[str] = None,
+        auth_headers: Optional[Dict[str, str]] = None,
+        cache: Optional[MsaCache] = None,
+        max_connections: int = 8,
+        poll_interval: tuple[float, float] = (5, 10),
+        max_retries: int = 5,
+    ):
+        """
+        Args:
+            host_url (str, optional): MMseqs2 server URL.
+            use_env (bool, optional): Search environmental databases.
+            use_filter (bool, optional): Enable server-side filtering.
+            use_pairing (bool, optional): Request paired MSAs.
+            pairing_strategy (str, optional): 'greedy' or 'complete'.
+            msa_server_username (str | None, optional): Basic auth username.
+            msa_server_password (str | None, optional): Basic auth password.
+            auth_headers (dict[str, str] | None, optional): Header/API key authentication.
+            cache (MsaCache | None, optional): Persistent MSA cache consulted before submitting.
+            max_connections (int, optional): Size of the connection pool and request thread pool.
+            poll_interval (tuple[float, float], optional): Min/max seconds between status polls.
+            max_retries (int, optional): Failed HTTP attempts tolerated per request.
+        """
+        has_basic_auth = msa_server_username and msa_server_password
+        if has_basic_auth and auth_headers is not None:
+            raise ValueError(
+                "Cannot use both basic authentication (username/password) and header/API key authentication. "
+                "Please use only one authentication method."
+            )
+
+        self.host_url = host_url.rstrip("/")
+        self.backend = server_backend(self.host_url)
+        self.use_env = use_env
+        self.use_filter = use_filter
+        self.use_pairing = use_pairing
+        self.pairing_strategy = pairing_strategy
+        self.mode = get_mode(use_env, use_filter, use_pairing, pairing_strategy)
+        self.submission_endpoint = "ticket/pair" if use_pairing else "ticket/msa"
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "boltz"
+        if has_basic_auth:
+            self.session.auth = HTTPBasicAuth(msa_server_username, msa_server_password)
+        elif auth_headers is not None:
+            self.session.headers.update(auth_headers)
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_connections)
+
+    def close(self) -> None:
+        """Release pooled connections and request threads."""
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    async def _request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """Run one HTTP request in the thread pool, retrying on connection errors."""
+        loop = asyncio.get_running_loop()
+        url = f"{self.host_url}/{endpoint}"
+        error_count = 0
+        while True:
+            try:
+                # "good practice to set connect timeouts to slightly larger than a multiple of 3"
+                call = partial(self.session.request, method, url, timeout=6.02, **kwargs)
+                res = await loop.run_in_executor(self._executor, call)
+                logger.debug(f"{method} {url} response status: {res.status_code}")
+                return res
+            except Exception as e:
+                error_count += 1
+                logger.warning(
+                    f"Error while fetching result from MSA server. Retrying... ({error_count}/{self.max_retries})"
+                )
+                logger.warning(f"Error: {e}")
+                if error_count > self.max_retries:
+                    raise Exception("Too many failed attempts for the MSA generation request.")
+                await asyncio.sleep(5)
+
+    @staticmethod
+    def _json(res: requests.Response) -> dict:
+        try:
+            return res.json()
+        except ValueError:
+            logger.error(f"Server didn't reply with json: {res.text}")
+            return {"status": "ERROR"}
+
+    async def submit(self, seqs: list[str], N: int = 101) -> dict:
+        """Submit a ticket for `seqs`, numbered from N. Returns the server JSON reply."""
+        query = "".join(f">{N + i}\n{seq}\n" for i, seq in enumerate(seqs))
+        res = await self._request("POST", self.submission_endpoint, data={"q": query, "mode": self.mode})
+        return self._json(res)
+
+    async def status(self, ID: str) -> dict:
+        """Return the server JSON status of ticket `ID`."""
+        return self._json(await self._request("GET", f"ticket/{ID}"))
+
+    async def download(self, ID: str) -> bytes:
+        """Return the result tarball of ticket `ID`."""
+        res = await self._request("GET", f"result/download/{ID}")
+        return res.content
+
+    async def _sleep(self, reason: str) -> None:
+        t = random.uniform(*self.poll_interval)
+        logger.debug(f"Sleeping for {t:.1f}s. Reason: {reason}")
+        await asyncio.sleep(t)
+
+    async def _run_ticket(self, seqs_unique: list[str], N: int = 101) -> bytes:
+        """Submit, wait for and download one ticket. Returns the result tarball."""
+        while True:
+            # Resubmit job until it goes through
+            with PROFILER.phase("mmseqs2.submit", items=len(seqs_unique)):
+                out = await self.submit(seqs_unique, N)
+                while out["status"] in ["UNKNOWN", "RATELIMIT"]:
+                    await self._sleep(out["status"])
+                    out = await self.submit(seqs_unique, N)
+
+            if out["status"] == "ERROR":
+                raise Exception(
+                    "MMseqs2 API is giving errors. Please confirm your "
+                    " input is a valid protein sequence. If error persists, "
+                    "please try again an hour later."
+                )
+
+            if out["status"] == "MAINTENANCE":
+                raise Exception(
+                    "MMseqs2 API is undergoing maintenance. "
+                    "Please try again in a few minutes."
+                )
+
+            # wait for job to finish
+            ID = out["id"]
+            logger.debug(f"MSA job submitted successfully with ID: {ID}")
+            while out["status"] in ["UNKNOWN", "RUNNING", "PENDING"]:
+                # Time waiting in the server queue and running the search is reported separately
+                with PROFILER.phase("mmseqs2.run" if out["status"] == "RUNNING" else "mmseqs2.queue"):
+                    await self._sleep(out["status"])
+                    out = await self.status(ID)
+
+            if out["status"] == "COMPLETE":
+                logger.debug(f"MSA job completed successfully for ID: {ID}")
+                with PROFILER.phase("mmseqs2.download", items=len(seqs_unique)):
+                    return await self.download(ID)
+
+            if out["status"] == "ERROR":
+                raise Exception(
+                    "MMseqs2 API is giving errors. Please confirm your "
+                    " input is a valid protein sequence. If error persists, "
+                    "please try again an hour later."
+                )
+            # Any other status (e.g. the ticket expired): submit again
+
+    def _cache_key(self, seq: str) -> str:
+        return MsaCache.make_key(seq, self.mode, self.use_env, self.use_filter, self.pairing_strategy, self.backend)
+
+    async def run(self, seqs: list[str]) -> list[str]:
+        """
+        Args:
+            seqs (list[str]): Sequences submitted together as one ticket.
+        Returns:
+            list[str]: One A3M block per input sequence, in input order.
+        """
+        N = 101
+        seqs_unique = list(dict.fromkeys(seqs))
+
+        # Paired MSAs depend on the whole query set, so they are never cached
+        use_cache = self.cache is not None and not self.use_pairing
+        a3m_blocks = {}
+        if use_cache:
+            for seq in seqs_unique:
+                block = self.cache.get(self._cache_key(seq))
+                if block is not None:
+                    a3m_blocks[seq] = block
+        seqs_query = [seq for seq in seqs_unique if seq not in a3m_blocks]
+
+        if seqs_query:
+            content = await self._run_ticket(seqs_query, N)
+            loop = asyncio.get_running_loop()
+            with PROFILER.phase("mmseqs2.parse", items=len(seqs_query)):
+                a3m_lines = await loop.run_in_executor(
+                    self._executor, read_a3m_lines, content, self.use_env, self.use_pairing
+                )
+            for i, seq in enumerate(seqs_query):
+                a3m_blocks[seq] = "".join(a3m_lines[N + i])
+                if use_cache:
+                    self.cache.put(self._cache_key(seq), a3m_blocks[seq])
+
+        return [a3m_blocks[seq] for seq in seqs]
+
+    async def run_many(
+        self,
+        batches: list[list[str]],
+        max_in_flight: Optional[int] = None,
+        on_result: Optional[Callable[[int, list[str]], None]] = None,
+    ) -> list[list[str]]:
+        """
+        Args:
+            batches (list[list[str]]): Sequence batches, one ticket each.
+            max_in_flight (int | None, optional): Maximum number of open tickets. Defaults to all batches.
+            on_result (Callable[[int, list[str]], None] | None, optional):
+                Called with (batch index, A3M blocks) as soon as each ticket is done.
+        Returns:
+            list[list[str]]: A3M blocks for every batch, in batch order.
+        """
+        semaphore = asyncio.Semaphore(max_in_flight or max(len(batches), 1))
+
+        async def run_indexed(index: int, seqs: list[str]) -> tuple[int, list[str]]:
+            async with semaphore:
+                return index, await self.run(seqs)
+
+        results: list[list[str]] = [[] for _ in batches]
+        tasks = [asyncio.create_task(run_indexed(i, seqs)) for i, seqs in enumerate(batches)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                index, blocks = await task
+                results[index] = blocks
+                if on_result is not None:
+                    on_result(index, blocks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if self.cache is not None:
+            self.cache.evict()
+            self.cache.flush()
+        return results
+
+
+def run_mmseqs2_batches(
+    batches: list[list[str]],
+    max_in_flight: Optional[int] = None,
+    on_result: Optional[Callable[[int, list[str]], None]] = None,
+    **kwargs,
+) -> list[list[str]]:
+    """
+    Synchronous wrapper around `MMseqs2Client.run_many`.
+
+    Args:
+        batches (list[list[str]]): Sequence batches, one ticket each.
+        max_in_flight (int | None, optional): Maximum number of open tickets.
+        on_result (Callable[[int, list[str]], None] | None, optional): Per-ticket completion callback.
+        **kwargs: Keyword arguments passed to MMseqs2Client.
+    Returns:
+        list[list[str]]: A3M blocks for every batch, in batch order.
+    """
+    async def main() -> list[list[str]]:
+        client = MMseqs2Client(**kwargs)
+        try:
+            return await client.run_many(batches, max_in_flight, on_result)
+        finally:
+            client.close()
+
+    return asyncio.run(main())
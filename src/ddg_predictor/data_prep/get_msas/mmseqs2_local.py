@@ -0,0 +1,283 @@
+# Local MMseqs2 backend with the same interface as run_mmseqs2.
+# Runs the ColabFold search workflow (search -> expandaln -> align ->
+# filterresult -> result2msa) with a local `mmseqs` binary against locally
+# mounted databases, all queries of a call in one search, so MSA generation
+# is bounded by local CPU cores rather than by the public server.
+#
+# Databases are looked up in `db_dir` by name:
+# - ColabFold profile databases (`<name>_seq`/`<name>_aln`, or `<name>.idx`)
+#   as set up by ColabFold's setup_databases.sh, run through the full workflow
+# - plain sequence databases (`mmseqs createdb` output, e.g. a small FASTA
+#   for tests, see `make_database`), searched and turned into MSAs directly
+
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional, Union, Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import stage_paths  # noqa: E402,F401 - puts every stage directory on sys.path
+
+from mmseq2_boltz import get_mode  # noqa: E402
+from msa_cache import MsaCache  # noqa: E402
+from profiling import PROFILER  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+UNIREF_DB = "uniref30_2302_db"
+ENV_DB = "colabfold_envdb_202108_db"
+
+# Parameters of ColabFold's mmseqs_search_monomer
+SEARCH_PARAM = ["--num-iterations", "3", "-a", "-e", "0.1", "--max-seqs", "10000"]
+EXPAND_PARAM = ["--expansion-mode", "0", "-e", "inf", "--expand-filtering-mode", "0", "--max-seq-id", "0.95"]
+ALIGN_PARAM = ["-e", "10", "--max-accept", "1000000", "--alt-ali", "10", "-a"]
+FILTER_RESULT_PARAM = ["--qid", "0", "--qsc", "-20.0", "--diff", "0", "--max-seq-id", "1.0",
+                       "--filter-min-enable", "100"]
+
+
+def msa_filter_param(use_filter: bool) -> list[str]:
+    return ["--filter-msa", "1" if use_filter else "0", "--filter-min-enable", "1000", "--diff", "3000",
+            "--qid", "0.0,0.2,0.4,0.6,0.8,1.0", "--qsc", "0", "--max-seq-id", "0.95"]
+
+
+class LocalMMseqs2:
+    """Runs mmseqs subcommands in a work directory."""
+
+    def __init__(self, db_dir: str, work_dir: str, threads: int | None = None,
+                 mmseqs_bin: str = "mmseqs", db_load_mode: int = 0):
+        """
+        Args:
+            db_dir (str): Directory with the MMseqs2 databases.
+            work_dir (str): Scratch directory for the query and result databases.
+            threads (int | None, optional): Threads per mmseqs call. Defaults to all cores.
+            mmseqs_bin (str, optional): mmseqs executable.
+            db_load_mode (int, optional): mmseqs --db-load-mode (2 for databases kept in page cache).
+        """
+        if shutil.which(mmseqs_bin) is None:
+            raise FileNotFoundError(f"mmseqs executable not found: {mmseqs_bin}")
+        self.db_dir = Path(db_dir)
+        self.work_dir = Path(work_dir)
+        self.threads = threads or os.cpu_count() or 1
+        self.mmseqs_bin = mmseqs_bin
+        self.db_load_mode = db_load_mode
+
+    def run(self, *args, threaded: bool = True, db_load: bool = True) -> None:
+        cmd = [self.mmseqs_bin, *map(str, args)]
+        if threaded:
+            cmd += ["--threads", str(self.threads)]
+        if db_load:
+            cmd += ["--db-load-mode", str(self.db_load_mode)]
+        logger.debug(" ".join(cmd))
+        with PROFILER.phase(f"mmseqs2.local.{args[0]}"):
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"mmseqs {args[0]} failed: {proc.stderr.strip()[-2000:]}")
+
+    def database(self, name: str) -> tuple[Path, str | None, str | None]:
+        """
+        Path of a database and the suffixes of its sequence and alignment
+        parts, (None, None) for a plain sequence database.
+        """
+        db = self.db_dir / name
+        if not Path(f"{db}.dbtype").is_file():
+            raise FileNotFoundError(f"MMseqs2 database not found: {db}")
+        if self.db_load_mode != 0 and Path(f"{db}.idx").is_file():
+            return db, ".idx", ".idx"
+        if Path(f"{db}_seq.dbtype").is_file():
+            return db, "_seq", "_aln"
+        return db, None, None
+
+    def search_msa(self, query_db: Path, profile_db: Path | None, name: str, out: str, use_filter: bool) -> Path:
+        """
+        Search one database and write the MSA database `out` (a3m, one entry per query).
+        `profile_db` replaces the query for the search when given (environmental search).
+        """
+        db, seq_suffix, aln_suffix = self.database(name)
+        work = self.work_dir
+        search_input = profile_db or query_db
+        res, tmp = work / f"{out}_res", work / f"{out}_tmp"
+
+        self.run("search", search_input, db, res, tmp, *SEARCH_PARAM)
+        if seq_suffix is None:
+            # Plain sequence database: the search result is already an alignment of sequences
+            self.run("result2msa", query_db, db, res, work / out, "--msa-format-mode", "6",
+                     *msa_filter_param(use_filter))
+            return tmp
+
+        seq_db, aln_db = f"{db}{seq_suffix}", f"{db}{aln_suffix}"
+        self.run("expandaln", search_input, seq_db, res, aln_db, work / f"{out}_exp", *EXPAND_PARAM)
+        # Realign the expanded hits against the profile of the last search iteration
+        self.run("align", tmp / "latest" / "profile_1", seq_db, work / f"{out}_exp", work / f"{out}_realign",
+                 *ALIGN_PARAM)
+        self.run("filterresult", query_db, seq_db, work / f"{out}_realign", work / f"{out}_filter",
+                 *FILTER_RESULT_PARAM)
+        self.run("result2msa", query_db, seq_db, work / f"{out}_filter", work / out, "--msa-format-mode", "6",
+                 *msa_filter_param(use_filter))
+        return tmp
+
+    def unpack(self, msa_db: str, n_queries: int) -> list[str]:
+        """Read the entries of an MSA database in query order, '' for queries without an entry."""
+        out_dir = self.work_dir / f"{msa_db}_unpacked"
+        out_dir.mkdir(exist_ok=True)
+        self.run("unpackdb", self.work_dir / msa_db, out_dir, "--unpack-name-mode", "0",
+                 "--unpack-suffix", ".a3m", db_load=False)
+        blocks = []
+        for key in range(n_queries):
+            path = out_dir / f"{key}.a3m"
+            block = path.read_text().replace("\x00", "") if path.is_file() else ""
+            blocks.append(block if block.strip() else "")
+        return blocks
+
+
+def query_only_block(query_id: int, seq: str) -> str:
+    """A3M block holding only the query, for a sequence without any hit."""
+    return f">{query_id}\n{seq}\n"
+
+
+def database_fingerprint(db_dir: str, names: list[str]) -> str:
+    """
+    SHA-256 over the directory and the name, size and modification time of
+    every file of the databases `names`, so updated or rebuilt databases get
+    new cache keys.
+    """
+    digest = hashlib.sha256(os.path.abspath(db_dir).encode("utf-8"))
+    for filename in sorted(os.listdir(db_dir)):
+        if filename.startswith(tuple(names)):
+            st = os.stat(os.path.join(db_dir, filename))
+            digest.update(f"\t{filename}\t{st.st_size}\t{st.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def local_backend(db_dir: str, uniref_db: str = UNIREF_DB, env_db: str = ENV_DB, use_env: bool = True) -> str:
+    """Backend identifier of a local search, for `MsaCache.make_key`."""
+    names = [uniref_db, env_db] if use_env else [uniref_db]
+    return f"local\t{'+'.join(names)}\t{database_fingerprint(db_dir, names)}"
+
+
+def make_database(fasta_path: str, db_dir: str, name: str = UNIREF_DB, mmseqs_bin: str = "mmseqs") -> str:
+    """
+    Build a plain sequence database from a FASTA file, e.g. a few sequences
+    to exercise the local backend without the full ColabFold databases.
+
+    Returns:
+        str: Path of the database.
+    """
+    os.makedirs(db_dir, exist_ok=True)
+    db = os.path.join(db_dir, name)
+    proc = subprocess.run([mmseqs_bin, "createdb", fasta_path, db], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"mmseqs createdb failed: {proc.stderr.strip()}")
+    return db
+
+
+def run_mmseqs2_local(
+    x: Union[str, list[str]],
+    prefix: str = "tmp",
+    use_env: bool = True,
+    use_filter: bool = True,
+    use_pairing: bool = False,
+    pairing_strategy: str = "greedy",
+    host_url: str = "https://api.colabfold.com",
+    msa_server_username: Optional[str] = None,
+    msa_server_password: Optional[str] = None,
+    auth_headers: Optional[Dict[str, str]] = None,
+    cache: Optional[MsaCache] = None,
+    db_dir: Optional[str] = None,
+    uniref_db: str = UNIREF_DB,
+    env_db: str = ENV_DB,
+    threads: Optional[int] = None,
+    mmseqs_bin: str = "mmseqs",
+    db_load_mode: int = 0,
+) -> list[str]:
+    """
+    Drop-in for run_mmseqs2 backed by a local mmseqs installation. The server
+    arguments (host_url, credentials) are accepted and ignored. Returns one
+    a3m block per input sequence, in input order, with the query named
+    '>101', '>102', ... like the server's. Cached MSAs are keyed by the local
+    databases and their fingerprint (see local_backend), never shared with
+    the server backend.
+
+    Args:
+        db_dir (str): Directory with `uniref_db` (and `env_db` if use_env).
+        threads (int | None, optional): Threads per mmseqs call. Defaults to all cores.
+        mmseqs_bin (str, optional): mmseqs executable.
+        db_load_mode (int, optional): mmseqs --db-load-mode.
+    """
+    if use_pairing:
+        raise NotImplementedError("Paired MSAs are only available from the MMseqs2 server")
+    if db_dir is None:
+        raise ValueError("db_dir is required for the local MMseqs2 backend")
+
+    seqs = [x] if isinstance(x, str) else x
+    mode = get_mode(use_env, use_filter, use_pairing, pairing_strategy)
+    backend = local_backend(db_dir, uniref_db, env_db, use_env)
+    seqs_unique = list(dict.fromkeys(seqs))
+
+    blocks = {}
+    if cache is not None:
+        for seq in seqs_unique:
+            block = cache.get(MsaCache.make_key(seq, mode, use_env, use_filter, pairing_strategy, backend))
+            if block is not None:
+                blocks[seq] = block
+        cache.flush()
+    todo = [seq for seq in seqs_unique if seq not in blocks]
+
+    if todo:
+        work_dir = tempfile.mkdtemp(prefix=f"{prefix}_mmseqs_")
+        try:
+            mmseqs = LocalMMseqs2(db_dir, work_dir, threads, mmseqs_bin, db_load_mode)
+            query_fasta = Path(work_dir) / "query.fas"
+            query_fasta.write_text("".join(f">{101 + i}\n{seq}\n" for i, seq in enumerate(todo)))
+
+            # One query database for all sequences, keys 0..n-1 in input order
+            query_db = Path(work_dir) / "qdb"
+            mmseqs.run("createdb", query_fasta, query_db, "--shuffle", "0", threaded=False, db_load=False)
+
+            tmp = mmseqs.search_msa(query_db, None, uniref_db, "uniref.a3m", use_filter)
+            found = mmseqs.unpack("uniref.a3m", len(todo))
+            # Never hand out (or cache) an empty MSA: without hits it is the query alone
+            for i, seq in enumerate(todo):
+                if not found[i]:
+                    logger.warning(f"No MSA entry from mmseqs for query {101 + i}, using the query alone")
+                    found[i] = query_only_block(101 + i, seq)
+
+            if use_env:
+                # ColabFold searches the environmental databases with the UniRef profiles
+                profile_db = tmp / "latest" / "profile_1"
+                if Path(f"{profile_db}.dbtype").is_file():
+                    if not Path(f"{profile_db}_h.dbtype").is_file():
+                        mmseqs.run("lndb", f"{query_db}_h", f"{profile_db}_h", threaded=False, db_load=False)
+                else:
+                    profile_db = None
+                mmseqs.search_msa(query_db, profile_db, env_db, "env.a3m", use_filter)
+                found = [uniref + env for uniref, env in zip(found, mmseqs.unpack("env.a3m", len(todo)))]
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        for seq, block in zip(todo, found):
+            blocks[seq] = block
+            if cache is not None:
+                cache.put(MsaCache.make_key(seq, mode, use_env, use_filter, pairing_strategy, backend), block)
+        if cache is not None:
+            cache.evict()
+
+    return [blocks[seq] for seq in seqs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a small plain MMseqs2 database for the local backend")
+    parser.add_argument("fasta", help="FASTA file with the database sequences")
+    parser.add_argument("db_dir", help="Output database directory")
+    parser.add_argument("--name", default=UNIREF_DB, help="Database name")
+    args = parser.parse_args()
+    print(f"Database written to {make_database(args.fasta, args.db_dir, args.name)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+def server_backend(host_url: str) -> str:
+    """Backend identifier of an MMseqs2 server, for `MsaCache.make_key`."""
+    return f"server\t{host_url.rstrip('/')}"
+
+
+class MsaCache:
+    """
+    Content-addressed on-disk cache of MMseqs2 A3M blocks.
+    Entries are keyed by a hash of the query sequence, the MMseqs2 search
+    parameters and the backend that ran the search (server URL, or local
+    databases and their fingerprint), so identical sequences are only ever
+    queried once, whatever dataset they come from, and MSAs searched against
+    other databases are never mixed up.
+
+    The entry files are the source of truth: an entry exists if and only if
+    its `.a3m` file does. A SQLite index next to them keeps the size and
+    timestamps of every entry for eviction. Rows are upserted one at a time,
+    so several processes can share a cache, and entry files without a row
+    (e.g. after the index was lost) are adopted when the index is rebuilt.
+
+    Layout:
+        <root>/index.sqlite
+        <root>/<key[:2]>/<key>.a3m
+    """
+
+    INDEX_FILENAME = "index.sqlite"
+    ENTRY_SUFFIX = ".a3m"
+
+    def __init__(self, root: str, max_size_mb: Optional[float] = None, max_age_days: Optional[float] = None):
+        """
+        Args:
+            root (str): Cache root directory. Created if missing.
+            max_size_mb (float | None, optional): Evict least recently used entries above this total size.
+            max_age_days (float | None, optional): Evict entries not accessed for longer than this.
+        """
+        self.root = root
+        self.max_size_bytes = None if max_size_mb is None else int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = None if max_age_days is None else max_age_days * 24 * 3600
+        self.index_path = os.path.join(root, self.INDEX_FILENAME)
+
+        # Several tickets may be in flight at once, so guard the connection and the pending accesses
+        self._lock = threading.Lock()
+        # Key -> (size, last access) of hits not yet written to the index (see flush)
+        self._accessed: dict[str, tuple[int, float]] = {}
+
+        os.makedirs(root, exist_ok=True)
+        self.index = self._open_index()
+
+    @staticmethod
+    def make_key(sequence: str, mode: str, use_env: bool, use_filter: bool, pairing_strategy: str,
+                 backend: str) -> str:
+        """
+        Args:
+            sequence (str): Query protein sequence.
+            mode (str): MMseqs2 server mode (e.g. 'env', 'all', 'pairgreedy-env').
+            use_env (bool): Whether environmental databases are searched.
+            use_filter (bool): Whether the server-side filter is enabled.
+            pairing_strategy (str): Pairing strategy ('greedy' or 'complete').
+            backend (str): Backend identifier, from `server_backend` or `mmseqs2_local.local_backend`.
+        Returns:
+            str: Hex SHA-256 digest identifying the cache entry.
+        """
+        payload = "\t".join([sequence.upper(), mode, str(use_env), str(use_filter), pairing_strategy, backend])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Args:
+            key (str): Entry key from `make_key`.
+        Returns:
+            str | None: Cached A3M block, or None on a miss.
+        """
+        try:
+            with open(self._entry_path(key), "r") as f:
+                block = f.read()
+                size = os.fstat(f.fileno()).st_size
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            self._accessed[key] = (size, time.time())
+        return block
+
+    def put(self, key: str, a3m_block: str) -> None:
+        """
+        Args:
+            key (str): Entry key from `make_key`.
+            a3m_block (str): A3M block returned by the MMseqs2 server for one query.
+        Returns:
+            None
+        """
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write through a temporary file so readers never see partial entries
+        tmp_path = f"{path}.part{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w") as f:
+            f.write(a3m_block)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock:
+            self._accessed.pop(key, None)
+            self._upsert([(key, os.path.getsize(path), now, now)])
+
+    def flush(self) -> None:
+        """Write the access times of cache hits to the index."""
+        with self._lock:
+            self._flush()
+
+    def evict(self) -> int:
+        """
+        Remove entries older than `max_age_days`, then least recently used
+        entries until the cache fits in `max_size_mb`.
+
+        Returns:
+            int: Number of evicted entries.
+        """
+        with self._lock:
+            self._flush()
+            if self.max_age_seconds is None and self.max_size_bytes is None:
+                return 0
+
+            to_remove = []
+            rows = self.index.execute("SELECT key, size, last_access FROM entries ORDER BY last_access").fetchall()
+            if self.max_age_seconds is not None:
+                cutoff = time.time() - self.max_age_seconds
+                to_remove = [key for key, _, last_access in rows if last_access < cutoff]
+                rows = [row for row in rows if row[2] >= cutoff]
+
+            if self.max_size_bytes is not None:
+                total = sum(size for _, size, _ in rows)
+                for key, size, _ in rows:
+                    if total <= self.max_size_bytes:
+                        break
+                    total -= size
+                    to_remove.append(key)
+
+            for key in to_remove:
+                try:
+                    os.remove(self._entry_path(key))
+                except FileNotFoundError:
+                    pass
+            self.index.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in to_remove])
+            self.index.commit()
+
+        return len(to_remove)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}{self.ENTRY_SUFFIX}")
+
+    def _flush(self) -> None:
+        # Skip entries evicted by another process since they were read
+        rows = [(key, size, last_access, last_access) for key, (size, last_access) in self._accessed.items()
+                if os.path.isfile(self._entry_path(key))]
+        self._accessed.clear()
+        if rows:
+            self._upsert(rows)
+
+    def _upsert(self, rows: list[tuple[str, int, float, float]]) -> None:
+        """Insert (key, size, created, last_access) rows, keeping the creation time of existing ones."""
+        self.index.executemany(
+            "INSERT INTO entries (key, size, created, last_access) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET size = excluded.size, "
+            "last_access = max(last_access, excluded.last_access)",
+            rows,
+        )
+        self.index.commit()
+
+    def _open_index(self) -> sqlite3.Connection:
+        """Open the SQLite index, rebuilding it from the entry files if it is missing or corrupt."""
+        rebuild = not os.path.isfile(self.index_path)
+        try:
+            index = self._connect()
+        except sqlite3.DatabaseError:
+            os.replace(self.index_path, f"{self.index_path}.corrupt")
+            index = self._connect()
+            rebuild = True
+        if rebuild:
+            self._adopt_entries(index)
+        return index
+
+    def _connect(self) -> sqlite3.Connection:
+        # Other processes may hold the write lock for a moment, wait rather than fail
+        index = sqlite3.connect(self.index_path, timeout=60, check_same_thread=False)
+        index.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        index.commit()
+        return index
+
+    def _adopt_entries(self, index: sqlite3.Connection) -> None:
+        """Add a row for every entry file on disk, timestamped with its modification time."""
+        rows = []
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for filename in os.listdir(prefix_dir):
+                if filename.endswith(self.ENTRY_SUFFIX):
+                    st = os.stat(os.path.join(prefix_dir, filename))
+                    rows.append((filename[:-len(self.ENTRY_SUFFIX)], st.st_size, st.st_mtime, st.st_mtime))
+        index.executemany("INSERT OR IGNORE INTO entries (key, size, created, last_access) VALUES (?, ?, ?, ?)", rows)
+        index.commit()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Delta-encoded storage for mutant MSAs.
+# Instead of a full copy of the wild-type A3M per mutation, each protein gets a
+# single `{seq_id}.a3m.deltas` JSON-lines file next to `{seq_id}.a3m`, with one
+# small record per mutant:
+#   {"name": "P12345_A23T", "mutation": "A23T", "query_header": ">P12345_A23T",
+#    "sites": [[22, "T"]], "sequence": "<ungapped mutant query>"}
+# `sites` are 0-based match columns (see A3mAlignment.column_index). The mutant A3M is rebuilt from the WT
+# alignment only when it is needed.
+# Boltz queries of these mutants point at `{msa_dir}/{name}.a3m` (mutant_msa_path),
+# which no preprocessing stage writes. The consumer of the queries owns
+# materialization: the inference scheduler resolves every missing `msa:` path
+# through DeltaMsaResolver right before a batch runs.
+
+import argparse
+import json
+import os
+import threading
+
+from a3m_alignment import A3mAlignment
+
+DELTA_SUFFIX = ".a3m.deltas"
+
+
+def mutant_msa_path(msa_dir: str, name: str) -> str:
+    """Path of the A3M of mutant `name` as referenced by its query, and materialized by default."""
+    return os.path.join(msa_dir, f"{name}.a3m")
+
+
+def write_deltas(path: str, records: list[dict]) -> None:
+    """
+    Args:
+        path (str): Output `.a3m.deltas` file.
+        records (list[dict]): Delta records, one per mutant.
+    Returns:
+        None
+    """
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def read_deltas(path: str) -> list[dict]:
+    """Read all delta records of one `.a3m.deltas` file."""
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class A3mDeltaReader:
+    """
+    Lazily materializes mutant A3M files from a directory holding WT
+    alignments and their `.a3m.deltas` files.
+    """
+
+    def __init__(self, msa_dir: str):
+        """
+        Args:
+            msa_dir (str): Directory with `{seq_id}.a3m` and `{seq_id}.a3m.deltas` files.
+        """
+        self.msa_dir = msa_dir
+
+        # Mutant name -> (WT sequence ID, delta record)
+        self.index: dict[str, tuple[str, dict]] = {}
+        for filename in sorted(os.listdir(msa_dir)):
+            if filename.endswith(DELTA_SUFFIX):
+                seq_id = filename[:-len(DELTA_SUFFIX)]
+                for record in read_deltas(os.path.join(msa_dir, filename)):
+                    self.index[record["name"]] = (seq_id, record)
+
+        # Keep the last WT alignment around: mutants are usually requested per protein
+        self._wt_id: str | None = None
+        self._wt_alignment: A3mAlignment | None = None
+        # Guards the WT alignment and its memoized patches, mutants can be loaded from several threads
+        self._lock = threading.Lock()
+
+    def list_mutants(self) -> list[str]:
+        """Names of all mutants that can be materialized."""
+        return list(self.index)
+
+    def _wt(self, seq_id: str) -> A3mAlignment:
+        if seq_id != self._wt_id:
+            self._wt_alignment = A3mAlignment.from_file(os.path.join(self.msa_dir, f"{seq_id}.a3m"))
+            self._wt_id = seq_id
+        return self._wt_alignment
+
+    def load(self, name: str) -> A3mAlignment:
+        """Rebuild the mutant alignment `name` in memory."""
+        if name not in self.index:
+            raise KeyError(f"No delta record for mutant {name}")
+        seq_id, record = self.index[name]
+        with self._lock:
+            wt = self._wt(seq_id)
+            patches = [wt.residue_patch(column, residue) for column, residue in record["sites"]]
+        return wt.with_patches(patches, record["query_header"])
+
+    def materialize(self, name: str, out_path: str | None = None) -> str:
+        """
+        Args:
+            name (str): Mutant name (e.g. 'P12345_A23T').
+            out_path (str | None, optional): Output A3M path. Defaults to `{msa_dir}/{name}.a3m`.
+        Returns:
+            str: Path of the written A3M file.
+        """
+        out_path = out_path or mutant_msa_path(self.msa_dir, name)
+        self.load(name).write(out_path)
+        return out_path
+
+    def stream_to_fifo(self, name: str, fifo_path: str) -> threading.Thread:
+        """
+        Create a named pipe at `fifo_path` and write the mutant A3M into it
+        from a background thread, so the consumer reads it without the file
+        ever being stored on disk.
+
+        Returns:
+            threading.Thread: The writer thread (finishes once the reader has consumed the pipe).
+        """
+        alignment = self.load(name)
+        if not os.path.exists(fifo_path):
+            os.mkfifo(fifo_path)
+
+        writer = threading.Thread(target=alignment.write, args=(fifo_path,), daemon=True)
+        writer.start()
+        return writer
+
+
+class DeltaMsaResolver:
+    """
+    Resolves the MSA paths referenced by Boltz queries. A path that does not
+    exist but is the mutant_msa_path of a delta record in its directory is
+    materialized into a given directory. Readers are built once per MSA
+    directory and shared, so one resolver can serve several threads.
+    """
+
+    def __init__(self):
+        self._readers: dict[str, A3mDeltaReader] = {}
+        self._lock = threading.Lock()
+
+    def reader(self, msa_dir: str) -> A3mDeltaReader:
+        with self._lock:
+            if msa_dir not in self._readers:
+                self._readers[msa_dir] = A3mDeltaReader(msa_dir)
+            return self._readers[msa_dir]
+
+    def resolve(self, msa_path: str, out_dir: str) -> str:
+        """
+        Args:
+            msa_path (str): MSA path of a query.
+            out_dir (str): Directory receiving the materialized A3M files.
+        Returns:
+            str: `msa_path` if it exists or is not a delta-encoded mutant, else the path
+                of the mutant A3M written to `out_dir`.
+        """
+        if os.path.isfile(msa_path) or not msa_path.endswith(".a3m"):
+            return msa_path
+        msa_dir, filename = os.path.split(os.path.abspath(msa_path))
+        if not os.path.isdir(msa_dir):
+            return msa_path
+        reader = self.reader(msa_dir)
+        name = filename[:-len(".a3m")]
+        if name not in reader.index:
+            return msa_path
+        os.makedirs(out_dir, exist_ok=True)
+        return reader.materialize(name, os.path.join(out_dir, filename))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize mutant A3M files from delta records")
+    parser.add_argument("msa_dir", help="Directory with WT .a3m and .a3m.deltas files")
+    parser.add_argument("names", nargs="*", help="Mutants to materialize (default: all)")
+    parser.add_argument("--out_dir", default=None, help="Output directory (default: msa_dir)")
+    args = parser.parse_args()
+
+    reader = A3mDeltaReader(args.msa_dir)
+    out_dir = args.out_dir or args.msa_dir
+    os.makedirs(out_dir, exist_ok=True)
+
+    names = args.names or reader.list_mutants()
+    for name in names:
+        reader.materialize(name, os.path.join(out_dir, f"{name}.a3m"))
+    print(f"Materialized {len(names)} mutant MSAs in {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# On-disk cache of WT MSA features, reused by all point mutants of a protein.
+# Features are computed once per (sequence_id, MSA content hash) and stored as
+# .npy files that are memory-mapped on load:
+#   msa.npy               (N, L) uint8   residue tokens of the match columns
+#   deletion_matrix.npy   (N, L) uint8   insertions preceding each match column (capped at 255)
+#   profile.npy           (L, 22) float32  token frequencies per column
+#   deletion_mean.npy     (L,) float32   mean insertions per column
+#   residue_one_hot.npy   (L, 22) float32  one-hot query residues
+# A mutant only differs from its WT in the mutated columns, so its features
+# are the WT arrays opened copy-on-write with those columns patched.
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import stage_paths  # noqa: E402,F401 - puts every stage directory on sys.path
+
+from a3m_alignment import A3mAlignment, GAP  # noqa: E402
+from mut_msa import MsaMutator  # noqa: E402
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+UNKNOWN_TOKEN = len(AMINO_ACIDS)
+GAP_TOKEN = UNKNOWN_TOKEN + 1
+NUM_TOKENS = GAP_TOKEN + 1
+
+# Byte -> token, upper and lower case alike
+TOKENS = np.full(256, UNKNOWN_TOKEN, dtype=np.uint8)
+for token, aa in enumerate(AMINO_ACIDS):
+    TOKENS[ord(aa)] = TOKENS[ord(aa.lower())] = token
+TOKENS[GAP] = GAP_TOKEN
+
+FEATURE_NAMES = ("msa", "deletion_matrix", "profile", "deletion_mean", "residue_one_hot")
+
+
+def msa_hash(path: str) -> str:
+    """SHA-256 of an MSA file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_features(alignment: A3mAlignment) -> dict[str, np.ndarray]:
+    """
+    Featurize an alignment in a few vectorized passes over its buffer.
+    Lowercase residues are insertions relative to the query: they are dropped
+    from the token matrix and counted in the deletion matrix of the following
+    match column.
+    """
+    # Same match columns as the mutator patches (A3mAlignment.column_index)
+    positions = alignment.match_positions()
+    n_rows = len(alignment)
+
+    # Everything between two match columns of a row is an insertion
+    deletions = np.diff(positions, axis=1, prepend=(alignment.seq_offsets - 1)[:, None]) - 1
+
+    msa = TOKENS[alignment.buffer[positions]]
+    profile = np.stack([np.bincount(column, minlength=NUM_TOKENS) for column in msa.T]).astype(np.float32) / n_rows
+
+    return {
+        "msa": msa,
+        "deletion_matrix": np.minimum(deletions, 255).astype(np.uint8),
+        "profile": profile,
+        "deletion_mean": deletions.mean(axis=0).astype(np.float32),
+        "residue_one_hot": np.eye(NUM_TOKENS, dtype=np.float32)[msa[0]],
+    }
+
+
+class FeatureCache:
+    """Directory of WT feature sets, `<root>/<sequence_id>/<msa hash>/<feature>.npy`."""
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root (str): Cache directory, created if missing.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # Absolute MSA path -> (size, mtime_ns, content hash), so the mutants of a
+        # protein do not each reread and hash the whole WT file
+        self._digests: dict[str, tuple[int, int, str]] = {}
+
+    def msa_digest(self, msa_path: str) -> str:
+        """Content hash of an MSA file, recomputed only when its size or mtime changes."""
+        path = os.path.abspath(msa_path)
+        st = os.stat(path)
+        cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2]
+        digest = msa_hash(path)
+        self._digests[path] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def _dir(self, sequence_id: str, digest: str) -> str:
+        return os.path.join(self.root, sequence_id, digest[:16])
+
+    def get_wt(self, sequence_id: str, msa_path: str, mode: str = "r") -> dict[str, np.ndarray]:
+        """
+        Memory-mapped WT features of an MSA, computed and stored on first use.
+        Feature sets of older versions of the same protein's MSA are removed.
+
+        Args:
+            sequence_id (str): WT sequence ID.
+            msa_path (str): WT A3M file.
+            mode (str, optional): np.load mmap mode; 'c' gives private copy-on-write arrays.
+        Returns:
+            dict[str, np.ndarray]: Features by name (see FEATURE_NAMES).
+        """
+        feature_dir = self._dir(sequence_id, self.msa_digest(msa_path))
+        if not os.path.isfile(os.path.join(feature_dir, f"{FEATURE_NAMES[-1]}.npy")):
+            self._store(sequence_id, feature_dir, compute_features(A3mAlignment.from_file(msa_path)))
+        return {name: np.load(os.path.join(feature_dir, f"{name}.npy"), mmap_mode=mode) for name in FEATURE_NAMES}
+
+    def _store(self, sequence_id: str, feature_dir: str, features: dict[str, np.ndarray]) -> None:
+        protein_dir = os.path.dirname(feature_dir)
+        if os.path.isdir(protein_dir):
+            shutil.rmtree(protein_dir)
+        tmp_dir = f"{feature_dir}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in FEATURE_NAMES:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), features[name])
+        # Publish the whole set at once, so readers never see a partial one
+        os.replace(tmp_dir, feature_dir)
+
+    def get_mutant(self, sequence_id: str, msa_path: str, mutation: str) -> dict[str, np.ndarray]:
+        """
+        Features of a mutant of `msa_path`: WT arrays opened copy-on-write with
+        the mutated columns patched, so only the touched pages are copied.
+        Query position p is match column p - 1, as in the mutator, so this
+        equals compute_features of the mutant A3M.
+
+        Args:
+            sequence_id (str): WT sequence ID.
+            msa_path (str): WT A3M file.
+            mutation (str): Variant like 'A23T' or 'A23T:G45V', positions 1-based on the query.
+        Returns:
+            dict[str, np.ndarray]: Features by name (see FEATURE_NAMES).
+        """
+        features = self.get_wt(sequence_id, msa_path, mode="c")
+        msa = features["msa"]
+        n_rows = msa.shape[0]
+
+        features["profile"] = np.array(features["profile"])
+        features["residue_one_hot"] = np.array(features["residue_one_hot"])
+        for orig_res, pos, new_res in MsaMutator.parse_variant(mutation):
+            col = pos - 1
+            if not 0 <= col < msa.shape[1]:
+                raise ValueError(f"Query position {pos} exceeds sequence length.")
+            if msa[0, col] != TOKENS[ord(orig_res)]:
+                raise ValueError(f"Original residue at position {pos} does not match {orig_res}.")
+
+            # Every non-gap residue aligned to the query position takes the new residue
+            column = msa[:, col]
+            column[column != GAP_TOKEN] = TOKENS[ord(new_res)]
+            features["profile"][col] = np.bincount(column, minlength=NUM_TOKENS) / n_rows
+            features["residue_one_hot"][col] = np.eye(NUM_TOKENS, dtype=np.float32)[TOKENS[ord(new_res)]]
+        return features
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the WT feature cache for a directory of A3M files")
+    parser.add_argument("msa_dir", help="Directory with WT {sequence_id}.a3m files")
+    parser.add_argument("cache_dir", help="Feature cache directory")
+    parser.add_argument("sequence_ids", nargs="*", help="Sequence IDs to featurize (default: every .a3m)")
+    args = parser.parse_args()
+
+    cache = FeatureCache(args.cache_dir)
+    sequence_ids = args.sequence_ids or sorted(f[:-len(".a3m")] for f in os.listdir(args.msa_dir) if f.endswith(".a3m"))
+    for sequence_id in sequence_ids:
+        features = cache.get_wt(sequence_id, os.path.join(args.msa_dir, f"{sequence_id}.a3m"))
+        print(f"{sequence_id}: {features['msa'].shape[0]} rows x {features['msa'].shape[1]} columns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# Depth reduction of WT MSAs before they are mutated and turned into queries.
+# The UniRef and environmental blocks returned by MMseqs2 are concatenated
+# verbatim, so an MSA can hold thousands of rows while Boltz only uses a
+# bounded number of them; every mutant copy would inherit the full depth.
+# Rows are reduced in vectorized passes over the match-column matrix:
+#   1. identical rows (on the match columns) are dropped
+#   2. rows below a query coverage or query identity are dropped (hhfilter -cov/-qid)
+#   3. optionally, rows too similar to an earlier kept row are dropped (hhfilter -id)
+#   4. above `max_depth` rows, rows are sampled evenly across query-identity
+#      strata, so distant homologs are kept rather than only the closest ones
+# The query (first row) is always kept and rows keep their original order.
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import stage_paths  # noqa: E402,F401 - puts every stage directory on sys.path
+
+from a3m_alignment import A3mAlignment, GAP  # noqa: E402
+from profiling import PROFILER  # noqa: E402
+
+
+class MsaFilter:
+    """Row filter for A3M alignments."""
+
+    def __init__(self, dedupe: bool = True, min_coverage: float = 0.0, min_query_identity: float = 0.0,
+                 max_seq_identity: float | None = None, max_depth: int | None = None,
+                 n_strata: int = 10, seed: int = 0):
+        """
+        Args:
+            dedupe (bool, optional): Drop rows identical to an earlier row on the match columns.
+            min_coverage (float, optional): Minimum fraction of query positions a row must align to.
+            min_query_identity (float, optional): Minimum identity to the query over the aligned positions.
+            max_seq_identity (float | None, optional): Drop rows more identical than this to an earlier
+                kept row. Quadratic in the depth, so disabled by default.
+            max_depth (int | None, optional): Maximum number of rows, query included.
+            n_strata (int, optional): Query-identity bins sampled evenly when capping the depth.
+            seed (int, optional): Seed of the depth subsampling.
+        """
+        if max_depth is not None and max_depth < 1:
+            raise ValueError(f"max_depth must be at least 1, got {max_depth}")
+        self.dedupe = dedupe
+        self.min_coverage = min_coverage
+        self.min_query_identity = min_query_identity
+        self.max_seq_identity = max_seq_identity
+        self.max_depth = max_depth
+        self.n_strata = n_strata
+        self.seed = seed
+
+    def signature(self) -> str:
+        """Settings as a string, for hashing the filtered outputs."""
+        return (f"dedupe={self.dedupe},cov={self.min_coverage},qid={self.min_query_identity},"
+                f"id={self.max_seq_identity},depth={self.max_depth},strata={self.n_strata},seed={self.seed}")
+
+    def select_rows(self, alignment: A3mAlignment) -> np.ndarray:
+        """
+        Indices of the rows kept, in increasing order, starting with the query (0).
+        """
+        msa = alignment.match_matrix()
+        n_rows, width = msa.shape
+        keep = np.ones(n_rows, dtype=bool)
+
+        if self.dedupe:
+            rows = np.ascontiguousarray(msa).view(np.dtype((np.void, max(width, 1)))).ravel()
+            _, first = np.unique(rows, return_index=True)
+            keep[:] = False
+            keep[first] = True
+
+        aligned = msa != GAP
+        n_aligned = aligned.sum(axis=1)
+        identity = ((msa == msa[0]) & aligned).sum(axis=1) / np.maximum(n_aligned, 1)
+        keep &= n_aligned >= self.min_coverage * width
+        keep &= identity >= self.min_query_identity
+        keep[0] = True
+        rows = np.flatnonzero(keep)
+
+        if self.max_seq_identity is not None:
+            rows = self._drop_redundant(msa, aligned, rows)
+        if self.max_depth is not None and len(rows) > self.max_depth:
+            rows = self._subsample(rows, identity[rows])
+        return rows
+
+    def _drop_redundant(self, msa: np.ndarray, aligned: np.ndarray, rows: np.ndarray,
+                        block_size: int = 64) -> np.ndarray:
+        """
+        Greedy hhfilter -id: keep a row unless it is more identical than
+        `max_seq_identity` to an earlier kept row. Candidates are compared to the
+        kept rows a block at a time, then to each other within the block.
+        """
+        n_kept = 1
+        kept_rows = np.empty(len(rows), dtype=np.int64)
+        kept_rows[0] = rows[0]
+
+        for start in range(1, len(rows), block_size):
+            block = rows[start:start + block_size]
+            redundant = self._max_identity(msa, aligned, block, kept_rows[:n_kept]) > self.max_seq_identity
+            block = block[~redundant]
+            if not len(block):
+                continue
+            within = self._identity(msa, aligned, block, block)
+            block_keep = np.ones(len(block), dtype=bool)
+            for i in range(1, len(block)):
+                block_keep[i] = not (within[i, :i][block_keep[:i]] > self.max_seq_identity).any()
+            block = block[block_keep]
+            kept_rows[n_kept:n_kept + len(block)] = block
+            n_kept += len(block)
+        return kept_rows[:n_kept]
+
+    def _max_identity(self, msa: np.ndarray, aligned: np.ndarray, rows: np.ndarray, others: np.ndarray,
+                      chunk_size: int = 1024) -> np.ndarray:
+        best = np.zeros(len(rows))
+        for start in range(0, len(others), chunk_size):
+            chunk = others[start:start + chunk_size]
+            best = np.maximum(best, self._identity(msa, aligned, rows, chunk).max(axis=1))
+        return best
+
+    @staticmethod
+    def _identity(msa: np.ndarray, aligned: np.ndarray, rows: np.ndarray, others: np.ndarray) -> np.ndarray:
+        """Pairwise identity over the positions aligned in both rows, shape (len(rows), len(others))."""
+        both = aligned[rows][:, None, :] & aligned[others][None, :, :]
+        same = (msa[rows][:, None, :] == msa[others][None, :, :]) & both
+        return same.sum(axis=2) / np.maximum(both.sum(axis=2), 1)
+
+    def _subsample(self, rows: np.ndarray, identity: np.ndarray) -> np.ndarray:
+        """
+        Keep the query and `max_depth - 1` other rows, spread as evenly as
+        possible across query-identity strata.
+        """
+        others, others_identity = rows[1:], identity[1:]
+        strata = np.minimum((others_identity * self.n_strata).astype(np.int64), self.n_strata - 1)
+        sizes = np.bincount(strata, minlength=self.n_strata)
+
+        # Water-filling: strata smaller than an even share give their surplus to the others
+        quota = np.zeros(self.n_strata, dtype=np.int64)
+        budget = self.max_depth - 1
+        open_strata = sizes > 0
+        while budget > 0 and open_strata.any():
+            share = max(budget // open_strata.sum(), 1)
+            for s in np.flatnonzero(open_strata):
+                take = min(share, sizes[s] - quota[s], budget)
+                quota[s] += take
+                budget -= take
+                if quota[s] == sizes[s]:
+                    open_strata[s] = False
+                if budget == 0:
+                    break
+
+        rng = np.random.default_rng(self.seed)
+        chosen = [
+            rng.choice(others[strata == s], size=quota[s], replace=False)
+            for s in np.flatnonzero(quota)
+        ]
+        return np.sort(np.concatenate([rows[:1], *chosen]))
+
+    def filter(self, alignment: A3mAlignment) -> A3mAlignment:
+        """Return the alignment reduced to the selected rows."""
+        return alignment.select(self.select_rows(alignment))
+
+    def filter_file(self, path: str, output_path: str | None = None) -> tuple[int, int]:
+        """
+        Filter an A3M file, in place unless `output_path` is given.
+
+        Returns:
+            tuple[int, int]: Number of rows before and after filtering.
+        """
+        alignment = A3mAlignment.from_file(path)
+        filtered = self.filter(alignment)
+        output_path = output_path or path
+        # Replace rather than rewrite: `alignment` may still be reading from a mapping of `path`
+        tmp_path = f"{output_path}.tmp"
+        filtered.write(tmp_path)
+        os.replace(tmp_path, output_path)
+        return len(alignment), len(filtered)
+
+    def filter_directory(self, msa_dir: str, sequence_ids: list[str]) -> dict[str, Exception]:
+        """
+        Filter the WT `{sequence_id}.a3m` files of a directory in place.
+
+        Returns:
+            dict[str, Exception]: Errors by sequence ID; those files are left unchanged.
+        """
+        failures = {}
+        total_before = total_after = 0
+        with PROFILER.stage("msa.filter") as stage:
+            for seq_id in sequence_ids:
+                try:
+                    before, after = self.filter_file(os.path.join(msa_dir, f"{seq_id}.a3m"))
+                except Exception as e:
+                    print(f"Error filtering MSA {seq_id}: {e}")
+                    failures[seq_id] = e
+                    continue
+                total_before += before
+                total_after += after
+                stage.add()
+        print(f"MSA filtering: {total_before} -> {total_after} rows over {len(sequence_ids) - len(failures)} MSAs")
+        return failures
+
+
+def add_filter_arguments(parser: argparse.ArgumentParser) -> None:
+    """MSA filter options shared by the pipeline CLIs."""
+    parser.add_argument('--msa_max_depth', type=int, default=None, help='Cap WT MSAs at this many rows')
+    parser.add_argument('--msa_min_coverage', type=float, default=0.0,
+                        help='Drop MSA rows aligned to less than this fraction of the query')
+    parser.add_argument('--msa_min_query_identity', type=float, default=0.0,
+                        help='Drop MSA rows less identical than this to the query')
+    parser.add_argument('--msa_max_seq_identity', type=float, default=None,
+                        help='Drop MSA rows more identical than this to an earlier kept row')
+    dedupe = parser.add_mutually_exclusive_group()
+    dedupe.add_argument('--msa_dedupe', action='store_true',
+                        help='Drop identical MSA rows (implied by the other filter options)')
+    dedupe.add_argument('--msa_keep_duplicates', action='store_true', help='Keep identical MSA rows')
+
+
+def filter_from_args(args: argparse.Namespace) -> MsaFilter | None:
+    """MsaFilter for the options of `add_filter_arguments`, None if none is set."""
+    dedupe = not args.msa_keep_duplicates
+    enabled = ((args.msa_dedupe and dedupe) or args.msa_max_depth is not None or args.msa_min_coverage > 0
+               or args.msa_min_query_identity > 0 or args.msa_max_seq_identity is not None)
+    if not enabled:
+        return None
+    return MsaFilter(dedupe=dedupe, min_coverage=args.msa_min_coverage,
+                     min_query_identity=args.msa_min_query_identity,
+                     max_seq_identity=args.msa_max_seq_identity, max_depth=args.msa_max_depth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter and subsample WT A3M files in place")
+    parser.add_argument("msa_dir", help="Directory with WT {sequence_id}.a3m files")
+    parser.add_argument("sequence_ids", nargs="*", help="Sequence IDs to filter (default: every .a3m)")
+    add_filter_arguments(parser)
+    # Run on its own, the filter at least drops identical rows
+    parser.set_defaults(msa_dedupe=True)
+    args = parser.parse_args()
+
+    msa_filter = filter_from_args(args)
+    if msa_filter is None:
+        print("No MSA filter option set, nothing to do")
+        return
+    sequence_ids = args.sequence_ids or sorted(f[:-len(".a3m")] for f in os.listdir(args.msa_dir) if f.endswith(".a3m"))
+    msa_filter.filter_directory(args.msa_dir, sequence_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
 import argparse
-import pandas as pd
 import os
+import sys
+from pathlib import Path
 
-from wt_msas import generate_msas_from_fasta
-from mut_msa import A3mMutator  
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import stage_paths  # noqa: E402,F401 - puts every stage directory on sys.path
+
+from wt_msas import generate_msas_from_fasta, get_sequences_from_fasta  # noqa: E402
+from msa_cache import MsaCache  # noqa: E402
+from mut_msa import A3mMutator  # noqa: E402
+from mutation_table import read_mutations  # noqa: E402
+from msa_filter import add_filter_arguments, filter_from_args  # noqa: E402
+from profiling import PROFILER  # noqa: E402
 
 def main() -> None:
     """
@@ -13,23 +21,70 @@ def main() -> None:
     parser = argparse.ArgumentParser(description='Generate MSAs from multifasta and apply mutations')
     parser.add_argument('--input_fasta', required=True, help='Input multifasta file path')
     parser.add_argument('--output_dir', required=True, help='Directory to save generated A3M files')
-    parser.add_argument('--mutations_csv', required=True, help='CSV file with mutations (sequence_id, mutation, ddg)')
+    parser.add_argument('--mutations_csv', required=True, help='CSV or Parquet file with mutations (sequence_id, mutation, ddg)')
+    parser.add_argument('--batch_size', type=int, default=1, help='Number of sequences submitted per MMseqs2 ticket')
+    parser.add_argument('--max_workers', type=int, default=1, help='Number of MMseqs2 tickets kept in flight at once')
+    parser.add_argument('--msa_storage', choices=['full', 'delta'], default='full',
+                        help="'full' writes one A3M per mutation, 'delta' one delta file per protein")
+    parser.add_argument('--mutation_workers', type=int, default=1, help='Worker processes used to apply mutations')
+    parser.add_argument('--max_worker_memory_mb', type=int, default=None, help='Memory limit per mutation worker')
+    parser.add_argument('--msa_cache_dir', default=None, help='Persistent MSA cache directory (disabled if not given)')
+    parser.add_argument('--msa_cache_max_size_mb', type=float, default=None, help='Evict cached MSAs above this total size')
+    parser.add_argument('--msa_cache_max_age_days', type=float, default=None, help='Evict cached MSAs unused for this many days')
+    parser.add_argument('--local_db_dir', default=None,
+                        help='Search local MMseqs2 databases in this directory instead of the MMseqs2 server')
+    parser.add_argument('--mmseqs_threads', type=int, default=None, help='Threads per local mmseqs call')
+    add_filter_arguments(parser)
+    parser.add_argument('--profile_report', default=None, help='Write a per-stage profiling report to this JSON file')
     
     args = parser.parse_args()
 
     msa_output_dir = os.path.join(args.output_dir, "msas")
     os.makedirs(msa_output_dir, exist_ok=True)
 
+    cache = None
+    if args.msa_cache_dir:
+        cache = MsaCache(args.msa_cache_dir, args.msa_cache_max_size_mb, args.msa_cache_max_age_days)
+
+    msa_kwargs = {}
+    if args.local_db_dir:
+        msa_kwargs = {'db_dir': args.local_db_dir, 'threads': args.mmseqs_threads}
+
     # Step 1: Generate MSAs from the input multifasta
-    generate_msas_from_fasta(args.input_fasta, msa_output_dir)
+    with PROFILER.stage("msa.generate"):
+        generate_msas_from_fasta(
+            args.input_fasta,
+            msa_output_dir,
+            batch_size=args.batch_size,
+            max_workers=args.max_workers,
+            cache=cache,
+            **msa_kwargs,
+        )
     print(f"MSA generation completed. Files saved in: {args.output_dir}")
 
-    # Step 2: Load mutations and apply to all MSAs in the directory
+    # Step 2: Reduce the WT MSAs before they are copied into every mutant
+    msa_filter = filter_from_args(args)
+    if msa_filter is not None:
+        ids, _ = get_sequences_from_fasta(args.input_fasta)
+        msa_filter.filter_directory(msa_output_dir, ids)
+
+    # Step 3: Load mutations and apply to all MSAs in the directory
     print("Applying mutations to generated MSAs...")
-    mutations_df = pd.read_csv(args.mutations_csv)
-    mutator = A3mMutator(msa_output_dir, mutations_df)
-    mutator.mutate_directory()
-    print("Mutation application completed.")
+    mutations_df = read_mutations(args.mutations_csv, columns=["sequence_id", "mutation"])
+    mutator = A3mMutator(msa_output_dir, mutations_df, storage=args.msa_storage)
+    failures = mutator.mutate_directory(
+        max_workers=args.mutation_workers,
+        max_worker_memory_mb=args.max_worker_memory_mb,
+    )
+    if failures:
+        print(f"Mutation application completed with {len(failures)} failed mutants:")
+        for name, error in failures.items():
+            print(f"  {name}: {error}")
+    else:
+        print("Mutation application completed.")
+
+    if args.profile_report:
+        PROFILER.write_report(args.profile_report)
 
 
 if __name__ == '__main__':
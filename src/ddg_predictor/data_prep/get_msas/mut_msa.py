@@ -1,9 +1,71 @@
+import json
 import os
 import re
+import resource
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable
 import pandas as pd
 from abc import ABC, abstractmethod
 
+from a3m_alignment import A3mAlignment
+from msa_delta import DELTA_SUFFIX, write_deltas
+from mutation_table import group_mutations
+from profiling import PROFILER
+
+# Query ID/sequence of every MSA written by the mutation stage, one JSON record
+# per line, so the YAML converter does not have to re-read the A3M files
+QUERY_INFO_FILE = "query_info.jsonl"
+
+
+def query_info_record(path: str, sequence: str) -> dict:
+    """Query info of an MSA file, with the size and mtime it is valid for."""
+    st = os.stat(path)
+    return {"file": os.path.basename(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sequence": sequence}
+
+
+def compact_query_info(msa_dir: str) -> int:
+    """
+    Rewrite the `QUERY_INFO_FILE` of a directory with only the latest record
+    of every file, dropping records of files that are gone or have changed.
+
+    Returns:
+        int: Number of records kept.
+    """
+    path = os.path.join(msa_dir, QUERY_INFO_FILE)
+    if not os.path.isfile(path):
+        return 0
+    latest = {}
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            latest[record["file"]] = record
+
+    valid = []
+    for filename, record in latest.items():
+        try:
+            st = os.stat(os.path.join(msa_dir, filename))
+        except FileNotFoundError:
+            continue
+        if (record["size"], record["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+            valid.append(record)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(json.dumps(record) + "\n" for record in valid)
+    os.replace(tmp_path, path)
+    return len(valid)
+
+
+def _limit_worker_memory(max_memory_mb: int | None) -> None:
+    """Process pool initializer capping the address space of each worker."""
+    if max_memory_mb is not None:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
 
 class MsaMutator(ABC):
     """
@@ -11,52 +73,177 @@ class MsaMutator(ABC):
     Subclasses must implement read_msa and save_msa for specific file formats.
     """
 
-    def __init__(self, msa_dir: str, mutations_df: pd.DataFrame):
+    def __init__(self, msa_dir: str, mutations_df: pd.DataFrame, storage: str = "full"):
         """
         Args:
             msa_dir (str): Directory containing MSA files.
             mutations_df (pd.DataFrame): DataFrame with columns ['sequence_id', 'mutation', 'ddg']
+            storage (str, optional): 'full' writes one complete MSA per mutation,
+                'delta' writes one small delta file per protein (see msa_delta.py).
         """
+        if storage not in ("full", "delta"):
+            raise ValueError(f"Unknown MSA storage mode: {storage}")
         self.msa_dir = msa_dir
+        self.storage = storage
         # Group mutations by sequence_id
-        self.mutations_by_id = mutations_df.groupby("sequence_id")["mutation"].apply(list).to_dict()
+        self.mutations_by_id = group_mutations(mutations_df)
+
 
+    def __getstate__(self):
+        # Pool workers receive each file's mutations as task arguments,
+        # so the full mutation table is not pickled with every task
+        state = self.__dict__.copy()
+        state["mutations_by_id"] = {}
+        return state
 
-    def mutate_directory(self):
+    def mutate_directory(self, max_workers: int = 1, max_worker_memory_mb: int | None = None,
+                         on_done: Callable[[str, list[str]], None] | None = None) -> dict[str, str]:
         """
         Iterate over all MSA files in the directory and apply mutations
         that correspond to the sequence ID (file stem).
+        A mutation that cannot be applied (e.g. its WT residue does not match)
+        is reported and skipped; the other mutants of its MSA are still written.
+        The query ID and sequence of every MSA written are recorded in
+        `QUERY_INFO_FILE`, which is compacted at the end of the run.
+
+        Args:
+            max_workers (int, optional): Number of worker processes. 1 runs serially. Defaults to 1.
+            max_worker_memory_mb (int | None, optional): Address-space limit per worker process.
+            on_done (Callable[[str, list[str]], None] | None, optional): Called with the sequence ID
+                of every MSA processed and the mutations whose mutants were written.
+        Returns:
+            dict[str, str]: Failed mutants ('{sequence_id}_{mutation}') mapped to their error message.
         """
+        jobs = []
+        for msa_filename in sorted(os.listdir(self.msa_dir)):
 
-        for msa_filename in os.listdir(self.msa_dir):
+            if not msa_filename.endswith(self.file_extension()):
+                continue
 
-            msa_path = os.path.join(self.msa_dir, msa_filename)
             seq_id = Path(msa_filename).stem
 
             if seq_id not in self.mutations_by_id:
                 continue  # Skip files with no listed mutations
 
-            msa_records = self.read_msa(msa_path)
+            jobs.append((seq_id, os.path.join(self.msa_dir, msa_filename)))
+
+        failures = {}
+        query_info_file = open(os.path.join(self.msa_dir, QUERY_INFO_FILE), "a")
+
+        def report(done: int, seq_id: str, result: tuple[list[dict], dict[str, str]] | None,
+                   error: Exception | None):
+            mutations = self.mutations_by_id[seq_id]
+            if error is not None:
+                failures.update({f"{seq_id}_{mutation}": str(error) for mutation in mutations})
+                print(f"[{done}/{len(jobs)}] {seq_id}: FAILED ({error})")
+                return
+
+            query_info, errors = result
+            written = [mutation for mutation in mutations if mutation not in errors]
+            failures.update({f"{seq_id}_{mutation}": message for mutation, message in errors.items()})
+            failed = f", {len(errors)} failed" if errors else ""
+            print(f"[{done}/{len(jobs)}] {seq_id}: {len(written)} mutants{failed}")
+            for mutation, message in errors.items():
+                print(f"    {seq_id}_{mutation}: FAILED ({message})")
+            stage.add(len(written))
+            query_info_file.writelines(json.dumps(record) + "\n" for record in query_info)
+            query_info_file.flush()
+            if on_done is not None:
+                on_done(seq_id, written)
+
+        with PROFILER.stage("mutate") as stage, query_info_file:
+            if max_workers <= 1:
+                for done, (seq_id, msa_path) in enumerate(jobs, start=1):
+                    try:
+                        result = self.mutate_file(seq_id, msa_path, self.mutations_by_id[seq_id])
+                    except Exception as e:
+                        report(done, seq_id, None, e)
+                    else:
+                        report(done, seq_id, result, None)
+            else:
+                self._mutate_parallel(jobs, report, max_workers, max_worker_memory_mb)
+
+        compact_query_info(self.msa_dir)
+        return failures
+
+    def _mutate_parallel(self, jobs: list[tuple[str, str]], report: Callable, max_workers: int,
+                         max_worker_memory_mb: int | None) -> None:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_limit_worker_memory,
+            initargs=(max_worker_memory_mb,),
+        ) as executor:
+            futures = {
+                executor.submit(self.mutate_file, seq_id, msa_path, self.mutations_by_id[seq_id]): (seq_id, msa_path)
+                for seq_id, msa_path in jobs
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                seq_id, _ = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    report(done, seq_id, None, e)
+                else:
+                    report(done, seq_id, result, None)
+
+    def mutate_file(self, seq_id: str, msa_path: str, mutations: list[str]) -> tuple[list[dict], dict[str, str]]:
+        """
+        Read one MSA once and write all of its mutants. Errors of individual
+        mutations are returned rather than raised.
+
+        Args:
+            seq_id (str): Sequence ID of the MSA (file stem).
+            msa_path (str): Path to the WT MSA file.
+            mutations (list[str]): Mutations to apply.
+        Returns:
+            tuple[list[dict], dict[str, str]]: Query info records (see query_info_record) of
+                the WT MSA and of every mutant MSA written, and the error message of every
+                mutation that could not be applied.
+        """
+        msa_records = self.read_msa(msa_path)
+        query_info = [query_info_record(msa_path, self.query_sequence(msa_records))]
 
-            for mutation in self.mutations_by_id[seq_id]:
-                mutation_dict = {seq_id: mutation}
-                mutated_records = self.apply_mutation(msa_records, mutation_dict)
-                output_path = os.path.join(self.msa_dir, f"{seq_id}_{mutation}{self.file_extension()}")
+        if self.storage == "delta":
+            # Delta records carry their mutant sequence already
+            return query_info, self.save_deltas(seq_id, msa_records, mutations)
 
-                self.save_msa(mutated_records, output_path)
+        errors = {}
+        for mutation in mutations:
+            try:
+                mutated_records = self.apply_mutation(msa_records, {seq_id: mutation})
+            except ValueError as e:
+                errors[mutation] = str(e)
+                continue
+            output_path = os.path.join(self.msa_dir, f"{seq_id}_{mutation}{self.file_extension()}")
+
+            self.save_msa(mutated_records, output_path)
+            query_info.append(query_info_record(output_path, self.query_sequence(mutated_records)))
+        return query_info, errors
 
 
     @abstractmethod
     def read_msa(self, path: str):
-        """Read an MSA file and return list of (header, sequence) tuples."""
+        """Read an MSA file and return its records (format-specific container)."""
         pass
 
 
     @abstractmethod
     def save_msa(self, records, path: str):
-        """Save list of (header, sequence) tuples to an MSA file."""
+        """Save records returned by read_msa/apply_mutation to an MSA file."""
+        pass
+
+    @abstractmethod
+    def query_sequence(self, records) -> str:
+        """Return the ungapped query sequence of records returned by read_msa/apply_mutation."""
         pass
 
+    def save_deltas(self, seq_id: str, records, mutations: list[str]) -> dict[str, str]:
+        """
+        Save all mutations of one MSA as delta records instead of full copies.
+        Returns the error message of every mutation that could not be applied.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support delta storage")
+
     @abstractmethod
     def file_extension(self):
         """Return the expected file extension for this MSA type (e.g., '.a3m')."""
@@ -72,6 +259,18 @@ class MsaMutator(ABC):
         orig_res, pos, new_res = match.groups()
         return orig_res, int(pos), new_res
 
+    @classmethod
+    def parse_variant(cls, mutation: str):
+        """
+        Parse a single or multi-site variant like 'A23T' or 'A23T:G45V' into a
+        list of (orig_residue, pos, new_residue), one per site.
+        """
+        sites = [cls.parse_mutation(site) for site in mutation.split(":")]
+        positions = [pos for _, pos, _ in sites]
+        if len(set(positions)) != len(positions):
+            raise ValueError(f"Repeated position in variant: {mutation}")
+        return sites
+
     @staticmethod
     def ungapped_sequence(seq_with_gaps: str):
         """Return sequence without gaps, keeping only uppercase letters (query)."""
@@ -100,66 +299,82 @@ class MsaMutator(ABC):
 class A3mMutator(MsaMutator):
     """
     Concrete implementation for A3M MSA files.
+    MSAs are memory-mapped into an A3mAlignment (flat uint8 buffer + record
+    offsets), so each mutation is a vectorized column write on a buffer copy
+    and the WT rows are never decoded into Python strings.
     """
 
-    def read_msa(self, path: str):
-        records = []
-        header = None
-        seq_parts = []
-
-        with open(path, "r") as f:
-            for line in f:
-                line = line.rstrip()
-                if line.startswith(">"):
-                    if header is not None:
-                        records.append((header, "".join(seq_parts)))
-                    header = line
-                    seq_parts = []
-                else:
-                    seq_parts.append(line.strip())
-            if header is not None:
-                records.append((header, "".join(seq_parts)))
-        return records
+    def read_msa(self, path: str) -> A3mAlignment:
+        return A3mAlignment.from_file(path)
 
-    def save_msa(self, records, path: str):
-        with open(path, "w") as f:
-            for header, seq in records:
-                f.write(f"{header}\n{seq}\n")
+    def save_msa(self, records: A3mAlignment, path: str):
+        records.write(path)
 
     def file_extension(self):
         return ".a3m"
+
+    def query_sequence(self, records: A3mAlignment) -> str:
+        return records.ungapped_query
     
-    def apply_mutation(self, records, mutation_dict: dict):
+    def resolve_mutation(self, records: A3mAlignment, mutation: str) -> list[tuple[int, int, str]]:
+        """
+        Validate every site of a (possibly multi-site) mutation against the
+        query and locate it in the alignment.
+
+        Returns:
+            list[tuple[int, int, str]]: (1-based query position, 0-based match column, new residue) per site.
+        """
+        sites = []
+        for orig_res, query_pos, new_res in self.parse_variant(mutation):
+            # Query position -> alignment column map is computed once per alignment
+            aligned_col = records.column_index(query_pos)
+            query_res = records.query_residue(query_pos)
+
+            if query_res.upper() != orig_res:
+                raise ValueError(
+                    f"Original residue at position {query_pos} does not match {orig_res}."
+                )
+            sites.append((query_pos, aligned_col, new_res))
+        return sites
+
+    @staticmethod
+    def mutant_header(records: A3mAlignment, mutation: str) -> str:
+        uniprot_id = Path(records.header(0).split()[0]).stem
+        return f"{uniprot_id}_{mutation}"
+
+    def apply_mutation(self, records: A3mAlignment, mutation_dict: dict) -> A3mAlignment:
         """
         Apply mutation(s) to MSA records, given a dict {sequence_id: mutation}.
-        Supports only one mutation per call.
+        Supports one variant per call; multi-site variants ('A23T:G45V') are
+        applied together on a single copy of the alignment.
         """
         sequence_id, mutation = list(mutation_dict.items())[0]
-        orig_res, query_pos, new_res = self.parse_mutation(mutation)
-
-        query_seq = records[0][1]
-        ungapped_query = self.ungapped_sequence(query_seq)
-
-        if ungapped_query[query_pos - 1].upper() != orig_res:
-            raise ValueError(
-                f"Original residue at position {query_pos} does not match {orig_res}."
-            )
-
-        aligned_pos = self.map_query_position_to_alignment(query_seq, query_pos)
-
-        mutated_records = []
-        uniprot_id = Path(records[0][0].split()[0]).stem
-        new_header = f"{uniprot_id}_{mutation}"
-
-        for i, (header, seq) in enumerate(records):
-            if aligned_pos - 1 < len(seq):
-                aa_at_pos = seq[aligned_pos - 1]
-                if aa_at_pos != "-":
-                    seq = (
-                        seq[:aligned_pos - 1]
-                        + (new_res.lower() if aa_at_pos.islower() else new_res.upper())
-                        + seq[aligned_pos:]
-                    )
-            mutated_records.append((new_header, seq) if i == 0 else (header, seq))
-
-        return mutated_records
+        sites = self.resolve_mutation(records, mutation)
+
+        # Every non-gap residue in each match column takes the new amino acid.
+        # Column patches are memoized on the alignment, so variants sharing sites reuse them.
+        patches = [records.residue_patch(aligned_col, new_res) for _, aligned_col, new_res in sites]
+        return records.with_patches(patches, self.mutant_header(records, mutation))
+
+    def save_deltas(self, seq_id: str, records: A3mAlignment, mutations: list[str]) -> dict[str, str]:
+        wt_query = records.ungapped_query
+        deltas = []
+        errors = {}
+        for mutation in mutations:
+            try:
+                sites = self.resolve_mutation(records, mutation)
+            except ValueError as e:
+                errors[mutation] = str(e)
+                continue
+            mutant_query = list(wt_query)
+            for query_pos, _, new_res in sites:
+                mutant_query[query_pos - 1] = new_res
+            deltas.append({
+                "name": f"{seq_id}_{mutation}",
+                "mutation": mutation,
+                "query_header": self.mutant_header(records, mutation),
+                "sites": [[aligned_col, new_res] for _, aligned_col, new_res in sites],
+                "sequence": "".join(mutant_query),
+            })
+        write_deltas(os.path.join(self.msa_dir, f"{seq_id}{DELTA_SUFFIX}"), deltas)
+        return errors
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# Readers for the processed mutation table (`mut_data.csv` or `mut_data.parquet`,
+# columns sequence_id, mutation, ddg). Parquet files are memory-mapped and only
+# the requested columns and proteins are materialized; pyarrow is only needed
+# for Parquet input.
+
+import numpy as np
+import pandas as pd
+
+
+def read_mutations(path: str, sequence_ids: list[str] | None = None,
+                   columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Args:
+        path (str): `.csv` or `.parquet` mutation table.
+        sequence_ids (list[str] | None, optional): Only return rows of these proteins. Defaults to all.
+        columns (list[str] | None, optional): Only return these columns. Defaults to all.
+    Returns:
+        pd.DataFrame: Mutation rows, `sequence_id` categorical when read from Parquet.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        filters = None
+        if sequence_ids is not None:
+            filters = [("sequence_id", "in", list(sequence_ids))]
+        table = pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+        return table.to_pandas()
+
+    df = pd.read_csv(path, usecols=columns)
+    if sequence_ids is not None:
+        df = df[df["sequence_id"].isin(sequence_ids)].reset_index(drop=True)
+    return df
+
+
+def group_mutations(mutations_df: pd.DataFrame) -> dict[str, list[str]]:
+    """
+    Map each sequence ID to its list of mutations, in table order.
+    Uses the group row indices directly instead of one apply() call per group.
+    """
+    mutations = mutations_df["mutation"].to_numpy()
+    groups = mutations_df.groupby("sequence_id", observed=True, sort=False).indices
+    return {seq_id: mutations[np.sort(rows)].tolist() for seq_id, rows in groups.items()}
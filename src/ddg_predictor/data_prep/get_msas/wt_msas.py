@@ -1,5 +1,9 @@
-from mmseq2_boltz import run_mmseqs2
+from mmseq2_boltz import run_mmseqs2, get_mode
+from mmseqs2_client import run_mmseqs2_batches
+from mmseqs2_local import ENV_DB, UNIREF_DB, local_backend, run_mmseqs2_local
+from msa_cache import MsaCache, server_backend
 from Bio import SeqIO
+from typing import Callable
 import os
 
 
@@ -24,25 +28,160 @@ def get_sequences_from_fasta(fasta_path: str) -> tuple[list[str], list[str]]:
     return ids, sequences
 
 
-def generate_msas_from_fasta(fasta_path: str, output_dir: str, **kwargs) -> None:
+def generate_msas_from_fasta(fasta_path: str, output_dir: str, batch_size: int = 1,
+                             max_workers: int = 1, cache: MsaCache | None = None, **kwargs) -> None:
     """
     Args:
         fasta_path (str): Path to the input FASTA file (can be multifasta).
         output_dir (str): Directory where the MSA results will be stored.
-        **kwargs: Extra keyword arguments passed to run_mmseqs2.
+        batch_size (int, optional): Number of sequences submitted per MMseqs2 ticket. Defaults to 1.
+        max_workers (int, optional): Number of tickets kept in flight at once. Defaults to 1.
+        cache (MsaCache | None, optional): Persistent MSA cache checked before submitting. Defaults to None.
+        **kwargs: Extra keyword arguments passed to generate_msas.
     Returns:
         None
     """
     # Read sequences from the FASTA file
     ids, seqs = get_sequences_from_fasta(fasta_path)
+    generate_msas(ids, seqs, output_dir, batch_size, max_workers, cache, **kwargs)
 
-    # Generate an MSA for each sequence
+
+def generate_msas(ids: list[str], seqs: list[str], output_dir: str, batch_size: int = 1,
+                  max_workers: int = 1, cache: MsaCache | None = None,
+                  on_written: Callable[[list[str]], None] | None = None, db_dir: str | None = None,
+                  **kwargs) -> None:
+    """
+    Args:
+        ids (list[str]): Sequence IDs, used as output file stems.
+        seqs (list[str]): Corresponding sequences.
+        output_dir (str): Directory where the MSA results will be stored.
+        batch_size (int, optional): Number of sequences submitted per MMseqs2 ticket. Defaults to 1.
+        max_workers (int, optional): Number of tickets kept in flight at once. Defaults to 1.
+        cache (MsaCache | None, optional): Persistent MSA cache checked before submitting. Defaults to None.
+        on_written (Callable[[list[str]], None] | None, optional): Called with the IDs of every batch
+            of .a3m files as soon as they are written.
+        db_dir (str | None, optional): Search local MMseqs2 databases in this directory instead of
+            the server (see mmseqs2_local.py). All sequences then go into a single search.
+        **kwargs: Extra keyword arguments passed to run_mmseqs2 (or run_mmseqs2_local).
+    Returns:
+        None
+    """
+    def write(batch_ids: list[str], a3m_lines: list[str]) -> None:
+        write_msas(batch_ids, a3m_lines, output_dir)
+        if on_written is not None:
+            on_written(batch_ids)
+
+    # Write cached MSAs straight away and only submit the rest
+    if cache is not None:
+        ids, seqs = write_cached_msas(ids, seqs, output_dir, cache, on_written=on_written, db_dir=db_dir, **kwargs)
+        kwargs["cache"] = cache
+
+    if db_dir is not None:
+        # A local search costs the same for one or many queries, so batch all of them
+        if ids:
+            write(ids, run_mmseqs2_local(x=seqs, db_dir=db_dir, **kwargs))
+        return
+
+    # Split the sequences into tickets of at most `batch_size` sequences
+    batches = [
+        (ids[start:start + batch_size], seqs[start:start + batch_size])
+        for start in range(0, len(ids), batch_size)
+    ]
+
+    if max_workers <= 1:
+        for batch_ids, batch_seqs in batches:
+            a3m_lines = run_mmseqs2(x=batch_seqs, **kwargs)  # Call external MMseqs2 wrapper
+            write(batch_ids, a3m_lines)
+        return
+
+    # Keep several tickets in flight over a shared connection pool,
+    # writing each batch as soon as its ticket completes
+    run_mmseqs2_batches(
+        [batch_seqs for _, batch_seqs in batches],
+        max_in_flight=max_workers,
+        on_result=lambda batch_index, a3m_lines: write(batches[batch_index][0], a3m_lines),
+        max_connections=max_workers,
+        **kwargs,
+    )
+
+
+def msa_search_settings(db_dir: str | None = None, **kwargs) -> dict:
+    """
+    Search settings the MSAs of generate_msas depend on: mode, database and
+    pairing options, and the backend with its database fingerprint.
+
+    Args:
+        db_dir (str | None, optional): Local MMseqs2 database directory, None for the server.
+        **kwargs: generate_msas keyword arguments, unrelated ones are ignored.
+    Returns:
+        dict: Keyword arguments of MsaCache.make_key, without the sequence.
+    """
+    use_env = kwargs.get("use_env", True)
+    use_filter = kwargs.get("use_filter", True)
+    use_pairing = kwargs.get("use_pairing", False)
+    pairing_strategy = kwargs.get("pairing_strategy", "greedy")
+    if db_dir is not None:
+        backend = local_backend(db_dir, kwargs.get("uniref_db", UNIREF_DB), kwargs.get("env_db", ENV_DB), use_env)
+    else:
+        backend = server_backend(kwargs.get("host_url", "https://api.colabfold.com"))
+    return {
+        "mode": get_mode(use_env, use_filter, use_pairing, pairing_strategy),
+        "use_env": use_env,
+        "use_filter": use_filter,
+        "pairing_strategy": pairing_strategy,
+        "backend": backend,
+    }
+
+
+def write_cached_msas(ids: list[str], seqs: list[str], output_dir: str, cache: MsaCache,
+                      on_written: Callable[[list[str]], None] | None = None, db_dir: str | None = None,
+                      **kwargs) -> tuple[list[str], list[str]]:
+    """
+    Args:
+        ids (list[str]): Sequence IDs.
+        seqs (list[str]): Corresponding sequences.
+        output_dir (str): Directory where the .a3m files will be written.
+        cache (MsaCache): Persistent MSA cache.
+        on_written (Callable[[list[str]], None] | None, optional): Called with the IDs served from the cache.
+        db_dir (str | None, optional): Local MMseqs2 database directory, None for the server.
+        **kwargs: run_mmseqs2 search options used to build the cache keys.
+    Returns:
+        tuple[list[str], list[str]]: IDs and sequences that were not found in the cache.
+    """
+    if kwargs.get("use_pairing", False):
+        return ids, seqs
+    settings = msa_search_settings(db_dir, **kwargs)
+
+    missing_ids, missing_seqs = [], []
+    hit_ids, hit_blocks = [], []
     for seq_id, sequence in zip(ids, seqs):
+        block = cache.get(MsaCache.make_key(sequence, **settings))
+        if block is None:
+            missing_ids.append(seq_id)
+            missing_seqs.append(sequence)
+        else:
+            hit_ids.append(seq_id)
+            hit_blocks.append(block)
 
-        a3m_lines = run_mmseqs2(x=sequence, prefix=f"tmp_{seq_id}", **kwargs)  # Call external MMseqs2 wrapper
-        
-        # Take the first MSA result and replace the header with the sequence ID
-        msa_content = a3m_lines[0]
+    write_msas(hit_ids, hit_blocks, output_dir)
+    if on_written is not None and hit_ids:
+        on_written(hit_ids)
+    cache.flush()
+    print(f"MSA cache: {len(hit_ids)} hits, {len(missing_ids)} sequences to submit")
+    return missing_ids, missing_seqs
+
+
+def write_msas(ids: list[str], a3m_lines: list[str], output_dir: str) -> None:
+    """
+    Args:
+        ids (list[str]): Sequence IDs, in the same order the sequences were submitted.
+        a3m_lines (list[str]): One A3M block per submitted sequence, as returned by run_mmseqs2.
+        output_dir (str): Directory where the .a3m files will be written.
+    Returns:
+        None
+    """
+    for seq_id, msa_content in zip(ids, a3m_lines):
+        # Replace the server-side query number (>101, >102, ...) with the sequence ID
         msa_content = replace_first_header(msa_content, seq_id)
 
         # Build output path and write to .a3m file
@@ -51,7 +190,6 @@ def generate_msas_from_fasta(fasta_path: str, output_dir: str, **kwargs) -> None
             f.write(msa_content)
 
 
-
 def replace_first_header(msa_content: str, new_id: str) -> str:
     """
     Args:
@@ -1,11 +1,17 @@
 import argparse
-from loaders import Loader1
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import stage_paths  # noqa: E402,F401 - puts every stage directory on sys.path
+
+from loaders import Loader1, Loader2  # noqa: E402
 
 
 def load_dataset(dataset_type: str, raw_path: str, output_dir: str | None = None, **kwargs) -> object:
     """
     Args:
-        dataset_type (str): Identifier for the dataset type to load (e.g., '1').
+        dataset_type (str): Identifier for the dataset type to load (e.g., '1', '2').
         raw_path (str): Path to the raw input file.
         output_dir (str | None, optional): Directory to save processed output. Defaults to None.
         **kwargs: Additional keyword arguments passed to the loader class.
@@ -15,6 +21,7 @@ def load_dataset(dataset_type: str, raw_path: str, output_dir: str | None = None
     # Map dataset type to the corresponding loader class
     loader_map = {
         '1': Loader1,
+        '2': Loader2,
     }
     
     if dataset_type not in loader_map:
@@ -24,22 +31,31 @@ def load_dataset(dataset_type: str, raw_path: str, output_dir: str | None = None
     return loader_class(raw_path, output_dir, **kwargs)
 
 
-def process_and_save(dataset_type: str, raw_path: str, output_dir: str | None = None, **kwargs) -> object:
+def process_and_save(dataset_type: str, raw_path: str, output_dir: str | None = None,
+                     chunksize: int | None = None, output_format: str = "csv", **kwargs) -> object:
     """
     Args:
         dataset_type (str): Identifier for the dataset type to load.
         raw_path (str): Path to the raw input file.
         output_dir (str | None, optional): Directory to save processed output. Defaults to None.
+        chunksize (int | None, optional): If given, stream the input in chunks of this many rows
+            instead of loading it whole. Defaults to None.
+        output_format (str, optional): 'csv' or 'parquet' mutation table. Defaults to 'csv'.
         **kwargs: Additional keyword arguments passed to the loader.
     Returns:
         object: Loader instance after processing and saving outputs.
     """
     # Load dataset using the appropriate loader
     loader = load_dataset(dataset_type, raw_path, output_dir, **kwargs)
+
+    if chunksize:
+        # Constant-memory path: rows and sequences are written as chunks are read
+        loader.stream_outputs(chunksize, output_format=output_format)
+        return loader
     
     # Process and save results
     loader.process()
-    loader.save_outputs()
+    loader.save_outputs(output_format=output_format)
     
     return loader
 
@@ -53,13 +69,24 @@ def main() -> None:
     parser.add_argument('--dataset_type', required=True, help='Dataset type identifier')
     parser.add_argument('--raw_path', required=True, help='Path to raw input file')
     parser.add_argument('--output_dir', required=False, help='Directory for saving processed output')
+    parser.add_argument('--sequence_cache', required=False, help='SQLite file caching fetched sequences')
+    parser.add_argument('--chunksize', type=int, required=False, help='Stream the input in chunks of this many rows')
+    parser.add_argument('--output_format', choices=['csv', 'parquet'], default='csv',
+                        help='Format of the processed mutation table')
     
     args = parser.parse_args()
+
+    loader_kwargs = {}
+    if args.sequence_cache:
+        loader_kwargs['sequence_cache'] = args.sequence_cache
     
     loader = process_and_save(
         dataset_type=args.dataset_type,
         raw_path=args.raw_path,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        chunksize=args.chunksize,
+        output_format=args.output_format,
+        **loader_kwargs
     )
     # At this point, `loader` contains the processed dataset instance
 
@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
+import hashlib
 import pandas as pd
 from Bio import SeqIO
 from Bio.Seq import Seq
@@ -6,6 +8,26 @@ import os
 from Bio.SeqRecord import SeqRecord
 
 from sequence_resolver import SequenceResolver
+from profiling import PROFILER
+
+# Output formats of the processed mutation table
+MUT_DATA_FORMATS = ("csv", "parquet")
+
+
+def to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast a standardized table to its Parquet column types (categorical sequence_id, float32 ddg)."""
+    return df.astype({"sequence_id": "category", "mutation": "string", "ddg": "float32"})
+
+
+def mut_data_schema():
+    """Arrow schema of the Parquet mutation table, shared by every row group."""
+    import pyarrow as pa
+
+    return pa.schema([
+        ("sequence_id", pa.dictionary(pa.int32(), pa.string())),
+        ("mutation", pa.string()),
+        ("ddg", pa.float32()),
+    ])
 
 
 class BaseLoader(ABC):
@@ -55,6 +77,98 @@ class BaseLoader(ABC):
         pass
 
 
+    def iter_raw_chunks(self, chunksize: int) -> Iterator[pd.DataFrame]:
+        """
+        Iterate over the raw dataset in chunks of at most `chunksize` rows.
+        Defaults to a single chunk; loaders for large inputs should override it.
+
+        Args:
+            chunksize (int): Maximum number of rows per chunk.
+        Returns:
+            Iterator[pd.DataFrame]: Raw dataset chunks.
+        """
+        yield self.load_raw()
+
+    def standardize_chunk(self, df_raw: pd.DataFrame) -> pd.DataFrame:
+        """
+        Convert a chunk of raw rows to the standard columns.
+        Needed for streaming; must be implemented by subclasses supporting it.
+
+        Args:
+            df_raw (pd.DataFrame): Raw dataset chunk.
+        Returns:
+            pd.DataFrame: Chunk with columns ["sequence_id", "mutation", "ddg"].
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming")
+
+    def chunk_sequences(self, df_raw: pd.DataFrame, sequence_ids: list[str]) -> dict[str, str]:
+        """
+        Resolve the sequences of IDs seen for the first time in a chunk.
+        Needed for streaming; must be implemented by subclasses supporting it.
+
+        Args:
+            df_raw (pd.DataFrame): Raw dataset chunk the IDs come from.
+            sequence_ids (list[str]): New sequence IDs.
+        Returns:
+            dict[str, str]: Mapping from sequence ID to sequence string.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming")
+
+    def stream_outputs(self, chunksize: int, df_filename: str | None = None,
+                       fasta_filename: str = "wt_sequences.fasta", output_format: str = "csv") -> None:
+        """
+        Process and save the dataset chunk by chunk, in memory bounded by
+        `chunksize` (plus the set of sequence IDs seen so far). Rows are appended
+        to the table as they come (one Parquet row group per chunk), and each new
+        sequence is appended to the FASTA the first time its ID appears.
+
+        Args:
+            chunksize (int): Maximum number of raw rows held in memory at once.
+            df_filename (str | None, optional): Name of the output table. Defaults to "mut_data.<output_format>".
+            fasta_filename (str, optional): Name of the output FASTA file. Defaults to "wt_sequences.fasta".
+            output_format (str, optional): 'csv' or 'parquet'. Defaults to 'csv'.
+        Returns:
+            None
+        """
+        if output_format not in MUT_DATA_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        os.makedirs(self.output_dir, exist_ok=True)
+        df_out = os.path.join(self.output_dir, df_filename or f"mut_data.{output_format}")
+        fasta_out = os.path.join(self.output_dir, fasta_filename)
+
+        if output_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = mut_data_schema()
+            df_f = pq.ParquetWriter(df_out, schema)
+        else:
+            df_f = open(df_out, "w", newline="")
+
+        seen_ids: set[str] = set()
+        n_rows = 0
+        with PROFILER.stage("load.stream") as stage, df_f, open(fasta_out, "w") as fasta_f:
+            for df_raw in self.iter_raw_chunks(chunksize):
+                df_chunk = self.standardize_chunk(df_raw)
+                if output_format == "parquet":
+                    df_f.write_table(pa.Table.from_pandas(to_columnar(df_chunk), schema=schema, preserve_index=False))
+                else:
+                    df_chunk.to_csv(df_f, index=False, header=(n_rows == 0))
+                n_rows += len(df_chunk)
+                stage.add(len(df_chunk))
+
+                new_ids = [i for i in df_chunk["sequence_id"].unique().tolist() if i not in seen_ids]
+                if new_ids:
+                    sequences = self.chunk_sequences(df_raw, new_ids)
+                    SeqIO.write(
+                        [SeqRecord(Seq(sequences[i]), id=i, description="") for i in new_ids],
+                        fasta_f,
+                        "fasta",
+                    )
+                    seen_ids.update(new_ids)
+
+        print(f"Streamed {n_rows} rows and {len(seen_ids)} sequences to {self.output_dir}")
+
     def write_fasta(self, sequences: dict[str, str], fasta_out: str) -> None:
         """
         Write sequences to a FASTA file.
@@ -71,25 +185,37 @@ class BaseLoader(ABC):
         ]
         SeqIO.write(records, fasta_out, "fasta")
 
-    def save_outputs(self, df_filename: str = "mut_data.csv", fasta_filename: str = "wt_sequences.fasta") -> None:
+    def save_outputs(self, df_filename: str | None = None, fasta_filename: str = "wt_sequences.fasta",
+                     output_format: str = "csv") -> None:
         """
-        Save processed dataset outputs to CSV and FASTA files.
+        Save processed dataset outputs to a CSV or Parquet table and a FASTA file.
 
         Args:
-            df_filename (str, optional): Name of the output CSV file. Defaults to "mut_data.csv".
+            df_filename (str | None, optional): Name of the output table. Defaults to "mut_data.<output_format>".
             fasta_filename (str, optional): Name of the output FASTA file. Defaults to "wt_sequences.fasta".
+            output_format (str, optional): 'csv' or 'parquet'. Defaults to 'csv'.
         Returns:
             None
         """
+        if output_format not in MUT_DATA_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
         os.makedirs(self.output_dir, exist_ok=True)
 
-        # Save standardized dataframe
-        df_out = os.path.join(self.output_dir, df_filename)
-        self.df_standard.to_csv(df_out, index=False)
+        with PROFILER.stage("load.save", items=len(self.df_standard)):
+            # Save standardized dataframe
+            df_out = os.path.join(self.output_dir, df_filename or f"mut_data.{output_format}")
+            if output_format == "parquet":
+                import pyarrow as pa
+                import pyarrow.parquet as pq
 
-        # Save sequences in FASTA format
-        fasta_out = os.path.join(self.output_dir, fasta_filename)
-        self.write_fasta(self.sequences, fasta_out)
+                table = pa.Table.from_pandas(to_columnar(self.df_standard), schema=mut_data_schema(), preserve_index=False)
+                pq.write_table(table, df_out)
+            else:
+                self.df_standard.to_csv(df_out, index=False)
+
+            # Save sequences in FASTA format
+            fasta_out = os.path.join(self.output_dir, fasta_filename)
+            self.write_fasta(self.sequences, fasta_out)
 
 
 
@@ -99,6 +225,20 @@ class Loader1(BaseLoader):
     Reads from Excel, standardizes columns, and fetches sequences from UniProt.
     """
 
+    def __init__(self, raw_path: str, output_dir: str | None,
+                 sequence_cache: str | None = None, resolver_workers: int = 8):
+        """
+        Args:
+            raw_path (str): Path to the raw dataset file.
+            output_dir (str | None): Directory where processed outputs will be saved.
+            sequence_cache (str | None, optional): SQLite file caching UniProt sequences across runs.
+            resolver_workers (int, optional): Concurrent UniProt requests. Defaults to 8.
+        """
+        super().__init__(raw_path, output_dir)
+        self.sequence_cache = sequence_cache
+        self.resolver_workers = resolver_workers
+        self._resolver: SequenceResolver | None = None
+
     def load_raw(self) -> pd.DataFrame:
         """
         Load raw dataset from an Excel file.
@@ -108,6 +248,41 @@ class Loader1(BaseLoader):
         """
         return pd.read_excel(self.raw_path)
 
+    def iter_raw_chunks(self, chunksize: int) -> Iterator[pd.DataFrame]:
+        """
+        Read the Excel file row by row (openpyxl read-only mode) and yield
+        chunks of at most `chunksize` rows.
+        """
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(self.raw_path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            columns = next(rows)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == chunksize:
+                    yield pd.DataFrame(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=columns)
+        finally:
+            workbook.close()
+
+    def standardize_chunk(self, df_raw: pd.DataFrame) -> pd.DataFrame:
+        """Rename columns to ["sequence_id", "mutation", "ddg"] and keep only those."""
+        df_standard = df_raw.rename(columns={
+            "uniprot": "sequence_id",
+            "mut": "mutation",
+            "ddg": "ddg"
+        })
+        return df_standard[self.order_df_standar]
+
+    def chunk_sequences(self, df_raw: pd.DataFrame, sequence_ids: list[str]) -> dict[str, str]:
+        """Fetch the sequences of newly seen IDs from UniProt."""
+        return self.fetch_sequences(sequence_ids)
+
     def process(self) -> None:
         """
         Process the raw dataset into standardized format:
@@ -118,30 +293,140 @@ class Loader1(BaseLoader):
         Returns:
             None
         """
-        df = self.load_raw()
+        with PROFILER.stage("load.process") as stage:
+            df = self.load_raw()
 
-        # Standardize column names
-        df_standard = df.rename(columns={
-            "uniprot": "sequence_id",
-            "mut": "mutation",
-            "ddg": "ddg"
-        })
-        df_standard = df_standard[self.order_df_standar]
-
-        self.df_standard = df_standard
-        self.sequences = self.fetch_sequences()
+            # Standardize column names
+            self.df_standard = self.standardize_chunk(df)
+            self.sequences = self.fetch_sequences()
+            stage.add(len(self.df_standard))
 
-    def fetch_sequences(self) -> dict[str, str]:
+    def fetch_sequences(self, sequence_ids: list[str] | None = None) -> dict[str, str]:
         """
-        Fetch protein sequences for all unique sequence IDs in the dataset.
+        Fetch protein sequences for the given IDs, or for all unique sequence IDs in the dataset.
 
+        Args:
+            sequence_ids (list[str] | None, optional): IDs to fetch. Defaults to all IDs in `df_standard`.
         Returns:
             dict[str, str]: Mapping of sequence IDs to their sequences.
         """
-        resolver = SequenceResolver(db_name='uniprot')
-        sequence_ids = self.df_standard["sequence_id"].unique().tolist()
+        if self._resolver is None:
+            self._resolver = SequenceResolver(
+                db_name='uniprot',
+                cache_path=self.sequence_cache,
+                max_workers=self.resolver_workers,
+            )
+        if sequence_ids is None:
+            sequence_ids = self.df_standard["sequence_id"].unique().tolist()
+        resolver = self._resolver
 
-        print('Fetching sequences (might take a while)...')
-        sequences = {seq_id: resolver.fetch_sequence(seq_id) for seq_id in sequence_ids}
+        print(f'Fetching {len(sequence_ids)} sequences...')
+        sequences = resolver.fetch_sequences(sequence_ids)
 
         return sequences
+
+
+class Loader2(BaseLoader):
+    """
+    Loader for dataset type '2' (e.g. data/raw/train.csv).
+    Reads a CSV that embeds the WT and mutant sequence of every row, so no
+    sequence needs to be resolved remotely. Rows are keyed by a hash index of
+    `wt_seq`: identical sequences share one ID (the first PDB code they appear
+    with) and one FASTA record.
+    """
+
+    def __init__(self, raw_path: str, output_dir: str | None, sequence_cache: str | None = None):
+        """
+        Args:
+            raw_path (str): Path to the raw dataset file.
+            output_dir (str | None): Directory where processed outputs will be saved.
+            sequence_cache (str | None, optional): Unused, sequences come with the dataset.
+                Accepted so every loader takes the same CLI options.
+        """
+        super().__init__(raw_path, output_dir)
+
+        # sha1(wt_seq) -> sequence ID, and the sequence of every ID assigned so far
+        self.wt_index: dict[bytes, str] = {}
+        self.id_sequences: dict[str, str] = {}
+
+    def load_raw(self) -> pd.DataFrame:
+        """
+        Load raw dataset from a CSV file.
+
+        Returns:
+            pd.DataFrame: Raw dataset loaded from the CSV file.
+        """
+        return pd.read_csv(self.raw_path)
+
+    def iter_raw_chunks(self, chunksize: int) -> Iterator[pd.DataFrame]:
+        """Read the CSV in chunks of at most `chunksize` rows."""
+        with pd.read_csv(self.raw_path, chunksize=chunksize) as reader:
+            yield from reader
+
+    def sequence_id(self, pdb: str, wt_seq: str) -> str:
+        """
+        ID of a WT sequence: the PDB code it was first seen with, suffixed
+        with a counter if that code already names a different sequence.
+        """
+        key = hashlib.sha1(wt_seq.encode("utf-8")).digest()
+        seq_id = self.wt_index.get(key)
+        if seq_id is None:
+            seq_id, n = pdb, 1
+            while seq_id in self.id_sequences:
+                n += 1
+                seq_id = f"{pdb}_{n}"
+            self.wt_index[key] = seq_id
+            self.id_sequences[seq_id] = wt_seq
+        return seq_id
+
+    def standardize_chunk(self, df_raw: pd.DataFrame) -> pd.DataFrame:
+        """
+        Build ["sequence_id", "mutation", "ddg"] rows from the embedded sequences.
+        `seq_index` is the 0-based position of the substitution in `wt_seq`;
+        rows whose `wildtype` residue or `mut_seq` disagree with it are dropped.
+        """
+        sequence_ids, mutations, keep = [], [], []
+        for pdb, wt_seq, mut_seq, index, wt_res, mut_res in zip(
+                df_raw["pdb"], df_raw["wt_seq"], df_raw["mut_seq"],
+                df_raw["seq_index"], df_raw["wildtype"], df_raw["mutation"]):
+            consistent = (
+                0 <= index < len(wt_seq)
+                and wt_seq[index] == wt_res
+                and len(mut_seq) == len(wt_seq)
+                and mut_seq[index] == mut_res
+                and mut_seq[:index] == wt_seq[:index]
+                and mut_seq[index + 1:] == wt_seq[index + 1:]
+            )
+            keep.append(consistent)
+            if consistent:
+                sequence_ids.append(self.sequence_id(pdb, wt_seq))
+                mutations.append(f"{wt_res}{index + 1}{mut_res}")
+
+        n_dropped = len(keep) - sum(keep)
+        if n_dropped:
+            print(f"Dropped {n_dropped} rows whose mut_seq does not match the mutation")
+
+        return pd.DataFrame({
+            "sequence_id": sequence_ids,
+            "mutation": mutations,
+            "ddg": df_raw["ddG"].to_numpy()[keep],
+        })
+
+    def chunk_sequences(self, df_raw: pd.DataFrame, sequence_ids: list[str]) -> dict[str, str]:
+        """Sequences of newly seen IDs, taken from the hash index."""
+        return {seq_id: self.id_sequences[seq_id] for seq_id in sequence_ids}
+
+    def process(self) -> None:
+        """
+        Process the raw dataset into standardized format:
+        - Derives ["sequence_id", "mutation", "ddg"] from the embedded sequences
+        - Collects the deduplicated WT sequences
+        Saves results into `self.df_standard` and `self.sequences`.
+
+        Returns:
+            None
+        """
+        with PROFILER.stage("load.process") as stage:
+            self.df_standard = self.standardize_chunk(self.load_raw())
+            self.sequences = dict(self.id_sequences)
+            stage.add(len(self.df_standard))
@@ -1,5 +1,13 @@
 from Bio import SeqIO
+from Bio.SeqRecord import SeqRecord
+from collections.abc import Mapping
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from profiling import PROFILER
 
 
 class SequenceResolver:
@@ -7,21 +15,59 @@ class SequenceResolver:
     Utility class to resolve biological sequences by ID.
     Supports fetching from:
     - Local FASTA files (if provided)
+    - A local SQLite cache of previously fetched sequences (if provided)
     - UniProt REST API (if db_name='uniprot')
     """
 
-    def __init__(self, db_name: str = 'uniprot', fasta_db_path: str | None = None):
+    def __init__(self, db_name: str = 'uniprot', fasta_db_path: str | None = None,
+                 fasta_index_path: str | None = None, cache_path: str | None = None, max_workers: int = 8,
+                 uniprot_url: str = 'https://rest.uniprot.org/uniprotkb',
+                 max_retries: int = 5, backoff_factor: float = 1.0):
         """
         Args:
             db_name (str, optional): Name of the sequence database (default: 'uniprot').
             fasta_db_path (str | None, optional): Path to a FASTA file used as a local database.
+            fasta_index_path (str | None, optional): Persistent offset index for `fasta_db_path`
+                (default: '<fasta_db_path>.idx'). Built on first use and reused afterwards.
+            cache_path (str | None, optional): SQLite file caching fetched sequences across runs.
+            max_workers (int, optional): Concurrent requests when resolving many IDs (default: 8).
+            uniprot_url (str, optional): Base URL of the UniProtKB REST endpoint.
+            max_retries (int, optional): Retries on connection errors, 429 and 5xx responses.
+            backoff_factor (float, optional): Exponential backoff factor between retries, in seconds.
         """
         self.db_name = db_name
-        self.fasta_index: dict[str, SeqIO.SeqRecord] = {}
+        self.fasta_index: Mapping[str, SeqRecord] = {}
+        self.max_workers = max_workers
+        self.uniprot_url = uniprot_url.rstrip('/')
 
-        # If a FASTA file is provided, build an index for fast lookups
+        # If a FASTA file is provided, look records up through an on-disk offset index
+        # (SQLite, built once), so memory and startup time don't grow with the database
         if fasta_db_path:
-            self.fasta_index = SeqIO.to_dict(SeqIO.parse(fasta_db_path, "fasta"))
+            self.fasta_index = SeqIO.index_db(fasta_index_path or f"{fasta_db_path}.idx", fasta_db_path, "fasta")
+
+        # Pooled session: connections are reused across IDs and threads,
+        # rate limiting (429) and server errors are retried with backoff
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.cache: sqlite3.Connection | None = None
+        if cache_path:
+            self.cache = sqlite3.connect(cache_path)
+            self.cache.execute(
+                "CREATE TABLE IF NOT EXISTS sequences ("
+                "db_name TEXT NOT NULL, sequence_id TEXT NOT NULL, sequence TEXT NOT NULL, "
+                "PRIMARY KEY (db_name, sequence_id))"
+            )
+            self.cache.commit()
 
     def fetch_sequence(self, sequence_id: str) -> str | None:
         """
@@ -33,15 +79,58 @@ class SequenceResolver:
         Returns:
             str | None: The sequence string if found, otherwise None.
         """
-        # Try to resolve from local FASTA index first
-        if sequence_id in self.fasta_index:
-            return str(self.fasta_index[sequence_id].seq)
+        return self.fetch_sequences([sequence_id])[sequence_id]
+
+    def fetch_sequences(self, sequence_ids: list[str]) -> dict[str, str | None]:
+        """
+        Fetch many sequences, consulting the local FASTA and cache first and
+        requesting the remaining IDs concurrently.
 
-        # If configured to use UniProt, fetch remotely
-        if self.db_name == 'uniprot':
-            return self.fetch_uniprot_sequence(sequence_id)
+        Args:
+            sequence_ids (list[str]): Identifiers of the sequences.
 
-        return None
+        Returns:
+            dict[str, str | None]: Mapping of each ID to its sequence (None if not found locally and db_name is not 'uniprot').
+        """
+        with PROFILER.stage("resolver.fetch", items=len(sequence_ids)):
+            sequences: dict[str, str | None] = {}
+            missing = []
+            cached = self._cache_lookup(sequence_ids)
+
+            for sequence_id in dict.fromkeys(sequence_ids):
+                # Try to resolve from local FASTA index first
+                if sequence_id in self.fasta_index:
+                    sequences[sequence_id] = str(self.fasta_index[sequence_id].seq)
+                elif sequence_id in cached:
+                    sequences[sequence_id] = cached[sequence_id]
+                else:
+                    missing.append(sequence_id)
+
+            # If configured to use UniProt, fetch remotely
+            if self.db_name != 'uniprot':
+                sequences.update({sequence_id: None for sequence_id in missing})
+                return sequences
+
+            with PROFILER.phase("resolver.remote", items=len(missing)):
+                fetched, errors = {}, {}
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = {sequence_id: executor.submit(self.fetch_uniprot_sequence, sequence_id) for sequence_id in missing}
+                    for sequence_id, future in futures.items():
+                        try:
+                            fetched[sequence_id] = future.result()
+                        except requests.RequestException as e:
+                            errors[sequence_id] = e
+
+            # Keep what was fetched even if some IDs failed, so a rerun only retries those
+            self._cache_store(fetched)
+            if errors:
+                sequence_id, error = next(iter(errors.items()))
+                raise RuntimeError(
+                    f"Failed to fetch {len(errors)} sequence(s) from UniProt, e.g. {sequence_id}: {error}"
+                ) from error
+
+            sequences.update(fetched)
+        return sequences
 
     def fetch_uniprot_sequence(self, uniprot_id: str) -> str:
         """
@@ -53,9 +142,34 @@ class SequenceResolver:
         Returns:
             str: Sequence string (without FASTA header).
         """
-        url = f"https://rest.uniprot.org/uniprotkb/{uniprot_id}.fasta"
-        r = requests.get(url)
-        r.raise_for_status()  # Raise error if request fails
+        url = f"{self.uniprot_url}/{uniprot_id}.fasta"
+        r = self.session.get(url, timeout=30)
+        r.raise_for_status()  # Raise error if request fails (after retries)
 
         fasta = r.text.splitlines()
         return "".join(fasta[1:])  # Skip the header line
+
+    def _cache_lookup(self, sequence_ids: list[str]) -> dict[str, str]:
+        if self.cache is None or not sequence_ids:
+            return {}
+        found = {}
+        ids = list(dict.fromkeys(sequence_ids))
+        # Stay below SQLite's limit on bound parameters per statement
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.cache.execute(
+                f"SELECT sequence_id, sequence FROM sequences WHERE db_name = ? AND sequence_id IN ({placeholders})",
+                [self.db_name, *chunk],
+            )
+            found.update(rows)
+        return found
+
+    def _cache_store(self, sequences: dict[str, str]) -> None:
+        if self.cache is None or not sequences:
+            return
+        self.cache.executemany(
+            "INSERT OR REPLACE INTO sequences (db_name, sequence_id, sequence) VALUES (?, ?, ?)",
+            [(self.db_name, sequence_id, seq) for sequence_id, seq in sequences.items()],
+        )
+        self.cache.commit()
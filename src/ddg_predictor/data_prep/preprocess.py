@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# Incremental, resumable preprocessing driver.
+# Runs load -> MSA -> mutate -> YAML in one process and records every completed
+# item, with a hash of its inputs, in `<output_dir>/manifest.jsonl`. Items whose
+# inputs are unchanged are skipped on the next run, so a crash or an added batch
+# of mutations only costs the work that is actually missing.
+
+import argparse
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# Stage scripts import their siblings directly, so put every stage directory on the path
+import stage_paths  # noqa: F401
+
+from load_dataset import process_and_save
+from wt_msas import generate_msas, get_sequences_from_fasta, msa_search_settings
+from msa_cache import MsaCache
+from msa_delta import DELTA_SUFFIX
+from mut_msa import A3mMutator
+from mutation_table import group_mutations, read_mutations
+from msa_features import FeatureCache
+from msa_filter import MsaFilter, add_filter_arguments, filter_from_args
+from m3a_to_yaml import A3MtoYAMLConverter
+from profiling import PROFILER
+
+
+def hash_text(*parts) -> str:
+    """SHA-256 of the tab-joined string form of `parts`."""
+    return hashlib.sha256("\t".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StageManifest:
+    """
+    Append-only JSON-lines log of completed pipeline items:
+        {"stage": "msa", "item": "P12345", "hash": "<input hash>"}
+    The last record of an item wins. Appending keeps every update O(1) and a
+    crash can at most lose the line being written.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Manifest file, created if missing.
+        """
+        self.path = path
+        self.done: dict[tuple[str, str], str] = {}
+
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Truncated last line after a crash
+                    self.done[(record["stage"], record["item"])] = record["hash"]
+
+        self._file = open(path, "a")
+
+    def is_done(self, stage: str, item: str, input_hash: str) -> bool:
+        return self.done.get((stage, item)) == input_hash
+
+    def mark_done(self, stage: str, item: str, input_hash: str) -> None:
+        self._file.write(json.dumps({"stage": stage, "item": item, "hash": input_hash}) + "\n")
+        self._file.flush()
+        self.done[(stage, item)] = input_hash
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class PreprocessPipeline:
+    """
+    Load -> MSA -> mutate -> YAML with per-item skipping.
+    Input hashes chain through the stages (an MSA depends on its sequence,
+    a mutant MSA on the WT MSA and the mutation, a query on its MSA and the
+    template), so changing one input only invalidates what depends on it.
+    """
+
+    def __init__(self, dataset_type: str, raw_path: str, output_dir: str, template_file: str,
+                 loader_kwargs: dict | None = None, chunksize: int | None = None, output_format: str = "csv",
+                 msa_kwargs: dict | None = None, msa_filter: MsaFilter | None = None,
+                 msa_storage: str = "full", mutation_workers: int = 1,
+                 max_worker_memory_mb: int | None = None, query_workers: int = 1,
+                 query_shard_size: int | None = None, feature_cache_dir: str | None = None):
+        """
+        Args:
+            dataset_type (str): Dataset type identifier (see load_dataset.py).
+            raw_path (str): Path to the raw dataset file.
+            output_dir (str): Directory for all processed outputs and the manifest.
+            template_file (str): Boltz query YAML template.
+            loader_kwargs (dict | None, optional): Extra keyword arguments for the dataset loader.
+            chunksize (int | None, optional): Stream the raw dataset in chunks of this many rows.
+            output_format (str, optional): 'csv' or 'parquet' mutation table.
+            msa_kwargs (dict | None, optional): Extra keyword arguments for wt_msas.generate_msas.
+            msa_filter (MsaFilter | None, optional): Depth filter applied to every WT MSA once
+                written (see get_msas/msa_filter.py). Disabled if not given.
+            msa_storage (str, optional): 'full' or 'delta' mutant MSA storage.
+            mutation_workers (int, optional): Worker processes for the mutation stage.
+            max_worker_memory_mb (int | None, optional): Memory limit per mutation worker.
+            query_workers (int, optional): Worker processes for the YAML stage.
+            query_shard_size (int | None, optional): Write queries to sharded manifests of this
+                many queries instead of one YAML file each.
+            feature_cache_dir (str | None, optional): Precompute WT MSA features into this
+                cache (see get_msas/msa_features.py). Disabled if not given.
+        """
+        self.dataset_type = dataset_type
+        self.raw_path = raw_path
+        self.output_dir = output_dir
+        self.template_file = template_file
+        self.loader_kwargs = loader_kwargs or {}
+        self.chunksize = chunksize
+        self.output_format = output_format
+        self.msa_kwargs = msa_kwargs or {}
+        self.msa_search = sorted(msa_search_settings(**self.msa_kwargs).items())
+        self.msa_filter = msa_filter
+        self.msa_storage = msa_storage
+        self.mutation_workers = mutation_workers
+        self.max_worker_memory_mb = max_worker_memory_mb
+        self.query_workers = query_workers
+        self.query_shard_size = query_shard_size
+        self.feature_cache = FeatureCache(feature_cache_dir) if feature_cache_dir else None
+
+        self.fasta_path = os.path.join(output_dir, "wt_sequences.fasta")
+        self.mut_data_path = os.path.join(output_dir, f"mut_data.{output_format}")
+        self.msa_dir = os.path.join(output_dir, "msas")
+        os.makedirs(self.msa_dir, exist_ok=True)
+
+        self.manifest = StageManifest(os.path.join(output_dir, "manifest.jsonl"))
+
+        # Input hash of every item completed by the MSA and mutation stages
+        self.msa_hashes: dict[str, str] = {}
+        self.mutant_hashes: dict[tuple[str, str], str] = {}
+
+    def run(self) -> None:
+        try:
+            with PROFILER.stage("pipeline.load"):
+                self.load()
+                ids, seqs = get_sequences_from_fasta(self.fasta_path)
+                mutations_df = read_mutations(self.mut_data_path, columns=["sequence_id", "mutation"])
+
+            with PROFILER.stage("pipeline.msa", items=len(ids)):
+                self.generate_msas(ids, seqs)
+            with PROFILER.stage("pipeline.features"):
+                self.featurize()
+            with PROFILER.stage("pipeline.mutate", items=len(mutations_df)):
+                self.mutate(mutations_df)
+            with PROFILER.stage("pipeline.yaml"):
+                self.write_queries(mutations_df)
+        finally:
+            self.manifest.close()
+
+    def load(self) -> None:
+        input_hash = hash_text(self.dataset_type, hash_file(self.raw_path), sorted(self.loader_kwargs.items()))
+        outputs_exist = os.path.isfile(self.fasta_path) and os.path.isfile(self.mut_data_path)
+        if outputs_exist and self.manifest.is_done("load", "dataset", input_hash):
+            print("Loading dataset: up to date")
+            return
+
+        print("Loading dataset...")
+        process_and_save(self.dataset_type, self.raw_path, self.output_dir,
+                         chunksize=self.chunksize, output_format=self.output_format, **self.loader_kwargs)
+        self.manifest.mark_done("load", "dataset", input_hash)
+
+    def msa_hash(self, sequence: str) -> str:
+        # Switching backend, databases or search options invalidates the stored MSAs
+        if self.msa_filter is None:
+            return hash_text(sequence, self.msa_search)
+        return hash_text(sequence, self.msa_search, self.msa_filter.signature())
+
+    def generate_msas(self, ids: list[str], seqs: list[str]) -> None:
+        pending_ids, pending_seqs = [], []
+        for seq_id, sequence in zip(ids, seqs):
+            input_hash = self.msa_hash(sequence)
+            msa_path = os.path.join(self.msa_dir, f"{seq_id}.a3m")
+            if self.manifest.is_done("msa", seq_id, input_hash) and os.path.isfile(msa_path):
+                self.msa_hashes[seq_id] = input_hash
+            else:
+                pending_ids.append(seq_id)
+                pending_seqs.append(sequence)
+
+        print(f"Generating MSAs: {len(pending_ids)} to do, {len(self.msa_hashes)} up to date")
+        try:
+            self._generate_pending_msas(pending_ids, pending_seqs)
+        finally:
+            # The MMseqs2 backends evict after their searches; a run served from the cache must too
+            cache = self.msa_kwargs.get("cache")
+            if cache is not None:
+                cache.evict()
+
+    def _generate_pending_msas(self, pending_ids: list[str], pending_seqs: list[str]) -> None:
+        if not pending_ids:
+            return
+
+        pending_hashes = {seq_id: self.msa_hash(sequence) for seq_id, sequence in zip(pending_ids, pending_seqs)}
+
+        def on_written(batch_ids: list[str]) -> None:
+            if self.msa_filter is not None:
+                # Filtering failures leave the MSA unmarked, so it is regenerated on the next run
+                failures = self.msa_filter.filter_directory(self.msa_dir, batch_ids)
+                batch_ids = [seq_id for seq_id in batch_ids if seq_id not in failures]
+            for seq_id in batch_ids:
+                self.manifest.mark_done("msa", seq_id, pending_hashes[seq_id])
+                self.msa_hashes[seq_id] = pending_hashes[seq_id]
+
+        generate_msas(pending_ids, pending_seqs, self.msa_dir, on_written=on_written, **self.msa_kwargs)
+
+    def featurize(self) -> None:
+        if self.feature_cache is None:
+            return
+        todo = [seq_id for seq_id, h in self.msa_hashes.items() if not self.manifest.is_done("features", seq_id, h)]
+        print(f"Featurizing WT MSAs: {len(todo)} to do, {len(self.msa_hashes) - len(todo)} up to date")
+        for seq_id in todo:
+            self.feature_cache.get_wt(seq_id, os.path.join(self.msa_dir, f"{seq_id}.a3m"))
+            self.manifest.mark_done("features", seq_id, self.msa_hashes[seq_id])
+
+    def mutate(self, mutations_df: pd.DataFrame) -> None:
+        pending = {}
+        n_up_to_date = 0
+        for seq_id, mutations in group_mutations(mutations_df).items():
+            if seq_id not in self.msa_hashes:
+                continue  # No WT MSA (its generation failed or is still missing)
+
+            hashes = {m: hash_text(self.msa_hashes[seq_id], m, self.msa_storage) for m in mutations}
+            todo = [m for m in mutations if not self.manifest.is_done("mutate", f"{seq_id}_{m}", hashes[m])]
+            for m in mutations:
+                if m not in todo:
+                    self.mutant_hashes[(seq_id, m)] = hashes[m]
+            n_up_to_date += len(mutations) - len(todo)
+
+            if todo:
+                # A delta file holds all mutants of a protein, so it is always rewritten whole
+                pending[seq_id] = (mutations if self.msa_storage == "delta" else todo, hashes)
+
+        n_todo = sum(len(mutations) for mutations, _ in pending.values())
+        print(f"Applying mutations: {n_todo} to do, {n_up_to_date} up to date")
+        if not pending:
+            return
+
+        pending_df = pd.DataFrame(
+            [(seq_id, m) for seq_id, (mutations, _) in pending.items() for m in mutations],
+            columns=["sequence_id", "mutation"],
+        )
+
+        def on_done(seq_id: str, written: list[str]) -> None:
+            _, hashes = pending[seq_id]
+            for m in written:
+                self.manifest.mark_done("mutate", f"{seq_id}_{m}", hashes[m])
+                self.mutant_hashes[(seq_id, m)] = hashes[m]
+
+        mutator = A3mMutator(self.msa_dir, pending_df, storage=self.msa_storage)
+        failures = mutator.mutate_directory(
+            max_workers=self.mutation_workers,
+            max_worker_memory_mb=self.max_worker_memory_mb,
+            on_done=on_done,
+        )
+        if failures:
+            print(f"{len(failures)} mutants failed and will be retried on the next run")
+
+    def write_queries(self, mutations_df: pd.DataFrame) -> None:
+        converter = A3MtoYAMLConverter(self.msa_dir, self.output_dir, self.template_file,
+                                       max_workers=self.query_workers, shard_size=self.query_shard_size)
+        # Switching between YAML files and shards rewrites every query
+        template_hash = hash_text(hash_file(self.template_file), "shards" if self.query_shard_size else "files")
+
+        # (query name, input hash, source): WT and full-storage mutants come from
+        # their own .a3m, delta-storage mutants from their protein's delta file
+        queries = [(seq_id, hash_text(h, template_hash), f"{seq_id}.a3m") for seq_id, h in self.msa_hashes.items()]
+        for (seq_id, mutation), h in self.mutant_hashes.items():
+            source = f"{seq_id}{DELTA_SUFFIX}" if self.msa_storage == "delta" else f"{seq_id}_{mutation}.a3m"
+            queries.append((f"{seq_id}_{mutation}", hash_text(h, template_hash), source))
+
+        todo = [q for q in queries if not self.manifest.is_done("yaml", q[0], q[1])]
+        print(f"Writing Boltz queries: {len(todo)} to do, {len(queries) - len(todo)} up to date")
+
+        a3m_items = []
+        delta_sources: dict[str, list[tuple[str, str]]] = {}
+        for name, input_hash, source in todo:
+            if source.endswith(DELTA_SUFFIX):
+                delta_sources.setdefault(source, []).append((name, input_hash))
+            else:
+                a3m_items.append((name, input_hash, source))
+
+        a3m_paths = [os.path.join(self.msa_dir, source) for _, _, source in a3m_items]
+        for (name, input_hash, _), names in zip(a3m_items, converter.convert_files(a3m_paths)):
+            if names:
+                self.manifest.mark_done("yaml", name, input_hash)
+
+        delta_paths = [os.path.join(self.msa_dir, source) for source in delta_sources]
+        for items, names in zip(delta_sources.values(), converter.convert_files(delta_paths)):
+            written = set(names)
+            for name, input_hash in items:
+                if name in written:
+                    self.manifest.mark_done("yaml", name, input_hash)
+        converter.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Incremental preprocessing pipeline (load -> MSA -> mutate -> YAML)')
+    parser.add_argument('--dataset_type', required=True, help='Dataset type identifier')
+    parser.add_argument('--raw_path', required=True, help='Path to raw input file')
+    parser.add_argument('--output_dir', required=True, help='Directory for processed outputs and the manifest')
+    parser.add_argument('--template', default='config/boltz_query_template.yaml', help='Boltz query YAML template')
+    parser.add_argument('--sequence_cache', default=None, help='SQLite file caching fetched sequences')
+    parser.add_argument('--chunksize', type=int, default=None, help='Stream the raw dataset in chunks of this many rows')
+    parser.add_argument('--output_format', choices=['csv', 'parquet'], default='csv',
+                        help='Format of the processed mutation table')
+    parser.add_argument('--batch_size', type=int, default=1, help='Number of sequences submitted per MMseqs2 ticket')
+    parser.add_argument('--max_workers', type=int, default=1, help='Number of MMseqs2 tickets kept in flight at once')
+    parser.add_argument('--msa_cache_dir', default=None, help='Persistent MSA cache directory (disabled if not given)')
+    parser.add_argument('--msa_cache_max_size_mb', type=float, default=None, help='Evict cached MSAs above this total size')
+    parser.add_argument('--msa_cache_max_age_days', type=float, default=None, help='Evict cached MSAs unused for this many days')
+    parser.add_argument('--local_db_dir', default=None,
+                        help='Search local MMseqs2 databases in this directory instead of the MMseqs2 server')
+    parser.add_argument('--mmseqs_threads', type=int, default=None, help='Threads per local mmseqs call')
+    parser.add_argument('--msa_storage', choices=['full', 'delta'], default='full',
+                        help="'full' writes one A3M per mutation, 'delta' one delta file per protein")
+    parser.add_argument('--mutation_workers', type=int, default=1, help='Worker processes used to apply mutations')
+    parser.add_argument('--max_worker_memory_mb', type=int, default=None, help='Memory limit per mutation worker')
+    parser.add_argument('--query_workers', type=int, default=1, help='Worker processes used to write Boltz queries')
+    parser.add_argument('--query_shard_size', type=int, default=None,
+                        help='Write Boltz queries to sharded manifests of this many queries instead of one YAML each')
+    parser.add_argument('--feature_cache_dir', default=None, help='Precompute WT MSA features into this cache')
+    add_filter_arguments(parser)
+    parser.add_argument('--profile_report', default=None,
+                        help='JSON file for the per-stage profiling report (default: <output_dir>/profile.json)')
+    parser.add_argument('--cprofile_dir', default=None, help='Write a cProfile dump per pipeline stage here')
+    args = parser.parse_args()
+
+    if args.cprofile_dir:
+        PROFILER.enable_cprofile(args.cprofile_dir)
+
+    loader_kwargs = {}
+    if args.sequence_cache:
+        loader_kwargs['sequence_cache'] = args.sequence_cache
+
+    msa_kwargs = {'batch_size': args.batch_size, 'max_workers': args.max_workers}
+    if args.msa_cache_dir:
+        msa_kwargs['cache'] = MsaCache(args.msa_cache_dir, args.msa_cache_max_size_mb, args.msa_cache_max_age_days)
+    if args.local_db_dir:
+        msa_kwargs['db_dir'] = args.local_db_dir
+        msa_kwargs['threads'] = args.mmseqs_threads
+
+    pipeline = PreprocessPipeline(
+        dataset_type=args.dataset_type,
+        raw_path=args.raw_path,
+        output_dir=args.output_dir,
+        template_file=args.template,
+        loader_kwargs=loader_kwargs,
+        chunksize=args.chunksize,
+        output_format=args.output_format,
+        msa_kwargs=msa_kwargs,
+        msa_filter=filter_from_args(args),
+        msa_storage=args.msa_storage,
+        mutation_workers=args.mutation_workers,
+        max_worker_memory_mb=args.max_worker_memory_mb,
+        query_workers=args.query_workers,
+        query_shard_size=args.query_shard_size,
+        feature_cache_dir=args.feature_cache_dir,
+    )
+    try:
+        pipeline.run()
+    finally:
+        profile_report = args.profile_report or os.path.join(args.output_dir, "profile.json")
+        PROFILER.write_report(profile_report)
+        print(f"Profiling report written to {profile_report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# Stage-level profiling for the preprocessing pipeline.
+# A stage records, per name and summed over its calls: wall time, bytes read
+# and written (from /proc/self/io on Linux; worker processes are not
+# included) and items processed. It also records the peak RSS of the process
+# while the stage ran: the kernel's high-water mark (VmHWM) is reset through
+# /proc/self/clear_refs when a stage starts and read when it ends. Where it
+# cannot be reset, the stage gets the process-lifetime maximum instead, as
+# `max_rss_so_far_mb`. The largest finished worker process is reported as
+# `max_child_rss_so_far_mb`, a lifetime maximum as well. Stages nest, so a
+# parent's figures include its children's.
+# A phase only records calls, wall time and items. Phases are meant for code
+# that runs concurrently, e.g. several MMseqs2 tickets in flight, where
+# process-wide I/O counters would be counted twice. Their wall time is summed
+# over the concurrent calls.
+# With a cProfile directory set, each outermost stage of the main thread runs
+# under cProfile and is dumped to `<cprofile_dir>/<stage>.prof` with the report.
+#
+# Instrumented modules share the process-wide PROFILER:
+#     with PROFILER.stage("mutate") as stage:
+#         ...
+#         stage.add(n_mutants)
+
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROC_IO = "/proc/self/io"
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+def read_io() -> dict[str, int]:
+    """I/O counters of the process, empty if /proc is not available."""
+    try:
+        with open(PROC_IO, "r") as f:
+            return {key: int(value) for key, value in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """
+    Peak resident set size in MiB (of this process, or of its largest finished
+    child) as reported by getrusage. For this process, reset_rss_high_water()
+    resets it too: use Profiler.max_rss_mb() for the lifetime peak.
+    """
+    maxrss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def rss_high_water_mb() -> float | None:
+    """Peak RSS of the process since the last reset_rss_high_water(), None if /proc is not available."""
+    try:
+        with open(PROC_STATUS, "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_rss_high_water() -> bool:
+    """Reset the peak RSS of the process to its current RSS. Returns False if the kernel does not allow it."""
+    try:
+        with open(PROC_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class StageRecord:
+    """Item counter handed to the body of a stage or phase."""
+
+    def __init__(self, items: int = 0):
+        self.items = items
+
+    def add(self, n: int = 1) -> None:
+        self.items += n
+
+
+class Profiler:
+    """Accumulates stage and phase metrics by name."""
+
+    def __init__(self):
+        self.stats: dict[str, dict] = {}
+        self.cprofile_dir: str | None = None
+        self._profiles: dict[str, cProfile.Profile] = {}
+        self._profiling = False
+        self._lock = threading.Lock()
+        # Peak RSS seen so far by each running stage, keyed by the stage's StageRecord.
+        # Resetting the high-water mark for a new stage would lose the peak of the
+        # running ones, so it is folded into theirs first.
+        self._rss_peaks: dict[int, float] = {}
+        self._rss_resettable = True
+        # Resets clear the lifetime peak reported by getrusage as well, so keep it here
+        self._max_rss_mb = 0.0
+        self.started = time.time()
+
+    def enable_cprofile(self, cprofile_dir: str) -> None:
+        """Run the outermost stages under cProfile, dumped to `cprofile_dir` by write_report."""
+        os.makedirs(cprofile_dir, exist_ok=True)
+        self.cprofile_dir = cprofile_dir
+
+    def _update(self, name: str, wall_s: float, items: int, **metrics) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(name, {"calls": 0, "wall_s": 0.0, "items": 0})
+            stats["calls"] += 1
+            stats["wall_s"] += wall_s
+            stats["items"] += items
+            for key, value in metrics.items():
+                if key.startswith(("peak_", "max_")):
+                    stats[key] = max(stats.get(key, 0.0), value)
+                else:
+                    stats[key] = stats.get(key, 0) + value
+
+    def _start_cprofile(self, name: str) -> cProfile.Profile | None:
+        if self.cprofile_dir is None or self._profiling or threading.current_thread() is not threading.main_thread():
+            return None
+        profile = self._profiles.setdefault(name, cProfile.Profile())
+        try:
+            profile.enable()
+        except ValueError:
+            return None  # Another profiler is active (e.g. the script runs under `python -m cProfile`)
+        self._profiling = True
+        return profile
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0):
+        """
+        Measure a block as stage `name`.
+
+        Args:
+            name (str): Stage name, e.g. 'pipeline.mutate'.
+            items (int, optional): Items processed, if known up front. More can be added
+                through the yielded StageRecord.
+        """
+        record = StageRecord(items)
+        io_before = read_io()
+        self._start_rss_peak(record)
+        profile = self._start_cprofile(name)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            wall_s = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            io_after = read_io()
+            io = {}
+            for key, metric in (("rchar", "read_bytes"), ("wchar", "write_bytes"),
+                                ("read_bytes", "disk_read_bytes"), ("write_bytes", "disk_write_bytes")):
+                if key in io_after and key in io_before:
+                    io[metric] = io_after[key] - io_before[key]
+            rss_peak = self._end_rss_peak(record)
+            if rss_peak is None:
+                io["max_rss_so_far_mb"] = peak_rss_mb()
+            else:
+                io["peak_rss_mb"] = rss_peak
+            self._update(name, wall_s, record.items, **io,
+                         max_child_rss_so_far_mb=peak_rss_mb(resource.RUSAGE_CHILDREN))
+
+    def _fold_rss_peak(self) -> float | None:
+        """Fold the current high-water mark into the peaks of the running stages. Call with the lock held."""
+        high_water = rss_high_water_mb()
+        if high_water is not None:
+            self._max_rss_mb = max(self._max_rss_mb, high_water)
+            for key, peak in self._rss_peaks.items():
+                self._rss_peaks[key] = max(peak, high_water)
+        return high_water
+
+    def max_rss_mb(self) -> float:
+        """Peak RSS of the process over its lifetime, in MiB."""
+        with self._lock:
+            self._fold_rss_peak()
+            return max(self._max_rss_mb, peak_rss_mb())
+
+    def _start_rss_peak(self, record: StageRecord) -> None:
+        with self._lock:
+            if not self._rss_resettable:
+                return
+            self._fold_rss_peak()
+            self._rss_resettable = reset_rss_high_water()
+            high_water = rss_high_water_mb()
+            if self._rss_resettable and high_water is not None:
+                self._rss_peaks[id(record)] = high_water
+
+    def _end_rss_peak(self, record: StageRecord) -> float | None:
+        """Peak RSS of the process during the stage, None if it could not be measured."""
+        with self._lock:
+            if id(record) not in self._rss_peaks:
+                return None
+            self._fold_rss_peak()
+            return self._rss_peaks.pop(id(record))
+
+    @contextmanager
+    def phase(self, name: str, items: int = 0):
+        """Measure a block as phase `name` (calls, wall time and items only)."""
+        record = StageRecord(items)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self._update(name, time.perf_counter() - start, record.items)
+
+    def report(self) -> dict:
+        with self._lock:
+            stages = {name: dict(stats) for name, stats in self.stats.items()}
+        for stats in stages.values():
+            if stats["items"] and stats["wall_s"] > 0:
+                stats["items_per_s"] = stats["items"] / stats["wall_s"]
+        return {
+            "started": self.started,
+            "wall_s": time.time() - self.started,
+            "peak_rss_mb": self.max_rss_mb(),
+            "peak_child_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+            "stages": stages,
+        }
+
+    def write_report(self, path: str) -> dict:
+        """
+        Write the JSON report to `path`, and the cProfile dumps if enabled.
+
+        Returns:
+            dict: The report.
+        """
+        report = self.report()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, path)
+
+        if self.cprofile_dir is not None:
+            for name, profile in self._profiles.items():
+                profile.dump_stats(os.path.join(self.cprofile_dir, f"{name}.prof"))
+        return report
+
+
+PROFILER = Profiler()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a profiling report or a cProfile dump")
+    parser.add_argument("path", help="JSON report or .prof file")
+    parser.add_argument("--top", type=int, default=30, help="Functions listed for a .prof file")
+    args = parser.parse_args()
+
+    if args.path.endswith(".prof"):
+        pstats.Stats(args.path).sort_stats("cumulative").print_stats(args.top)
+        return
+
+    with open(args.path, "r") as f:
+        report = json.load(f)
+    print(f"Total {report['wall_s']:.2f}s, peak RSS {report['peak_rss_mb']:.1f} MiB "
+          f"(workers {report['peak_child_rss_mb']:.1f} MiB)")
+    for name, stats in sorted(report["stages"].items(), key=lambda item: -item[1]["wall_s"]):
+        io = ""
+        if "read_bytes" in stats:
+            io = f" read {stats['read_bytes'] / 2 ** 20:.1f} MiB, written {stats['write_bytes'] / 2 ** 20:.1f} MiB"
+        print(f"{name:<32} {stats['wall_s']:>10.2f}s {stats['calls']:>7} calls {stats['items']:>9} items{io}")
+
+
+if __name__ == "__main__":
+    main()
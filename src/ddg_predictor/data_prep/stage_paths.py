@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# Import path setup for the preprocessing scripts.
+# Modules import each other by name across data_prep/ and its stage
+# directories (`from profiling import PROFILER`, `from a3m_alignment import
+# A3mAlignment`), so each entry point imports this module once, before any
+# other pipeline module, to put them all on sys.path:
+#     sys.path.insert(0, "<...>/data_prep")
+#     import stage_paths  # noqa: F401
+
+import sys
+from pathlib import Path
+
+DATA_PREP_DIR = Path(__file__).resolve().parent
+STAGE_DIRS = ("parse_dataset", "get_msas", "to_boltz_query")
+
+for path in (DATA_PREP_DIR, *(DATA_PREP_DIR / stage_dir for stage_dir in STAGE_DIRS)):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
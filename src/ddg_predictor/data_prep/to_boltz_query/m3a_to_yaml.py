@@ -1,9 +1,26 @@
 #!/usr/bin/env python3
 import os
-import re
+import sys
+import copy
+import json
+import mmap
 import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import yaml
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import stage_paths  # noqa: E402,F401 - puts every stage directory on sys.path
+
+from query_shards import QueryShardWriter, query_filename, write_query_yaml  # noqa: E402
+from msa_delta import DELTA_SUFFIX, mutant_msa_path  # noqa: E402
+from mut_msa import QUERY_INFO_FILE  # noqa: E402
+from profiling import PROFILER  # noqa: E402
+
+# A query record is one sequence; anything larger is not a valid A3M
+MAX_QUERY_RECORD_BYTES = 1 << 24
+NON_LETTERS = bytes(c for c in range(256) if not chr(c).isascii() or not chr(c).isalpha())
+
 class A3MtoYAMLConverter:
     """
     Converts .a3m MSA files into YAML files based on a template.
@@ -15,41 +32,97 @@ class A3MtoYAMLConverter:
           msa: ...
     """
 
-    def __init__(self, input_path, output_dir, template_file):
+    def __init__(self, input_path, output_dir, template_file, max_workers=1, shard_size=None):
+        """
+        With `shard_size`, queries are appended to sharded JSONL manifests in
+        `boltz_query_shards/` (see query_shards.py) instead of one YAML file
+        each in `boltz_queries/`.
+        """
         self.input_path = input_path
-        self.output_dir = os.path.join(output_dir, 'boltz_queries/')
+        self.max_workers = max_workers
+        self.shard_size = shard_size
 
         self.template_file = template_file
-        os.makedirs(self.output_dir, exist_ok=True)
+        self.shard_writer = None
+        if shard_size:
+            self.output_dir = os.path.join(output_dir, 'boltz_query_shards/')
+            self.shard_writer = QueryShardWriter(self.output_dir, shard_size)
+        else:
+            self.output_dir = os.path.join(output_dir, 'boltz_queries/')
+            os.makedirs(self.output_dir, exist_ok=True)
+
+        # Parsed once, every query fills in a deep copy
+        self.template = None
+        with open(self.template_file, 'r', encoding='utf-8') as tf:
+            try:
+                self.template = yaml.safe_load(tf) or {}
+            except Exception as e:
+                print(f"Error loading template {self.template_file}: {e}")
 
-    def extract_msa_query_info(self, a3m_file):
-        """Extracts query sequence ID and ungapped sequence from first record in A3M."""
-        with open(a3m_file, 'r', encoding='utf-8') as f:
-            raw_lines = f.readlines()
-
-        lines = [ln.rstrip('\n') for ln in raw_lines]
-
-        header = None
-        seq_lines = []
-        for i, line in enumerate(lines):
-            if line.startswith('>'):
-                header = line[1:].strip()
-                j = i + 1
-                while j < len(lines) and not lines[j].startswith('>'):
-                    seq_lines.append(lines[j].strip())
-                    j += 1
-                break
+        # MSA directory -> query info index (see query_info), loaded on first use
+        self._query_info = {}
 
-        if header is None:
+    def extract_msa_query_info(self, a3m_file):
+        """
+        Extracts query sequence ID and ungapped sequence from first record in A3M.
+        The file is memory-mapped and only the bytes up to the second header are
+        copied out, so the cost does not depend on the depth of the alignment.
+        """
+        with open(a3m_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"No query sequence found in {a3m_file}")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                end = mapped.find(b'\n>')
+                if end < 0:
+                    end = len(mapped)
+                if end > MAX_QUERY_RECORD_BYTES:
+                    raise ValueError(f"Query record of {a3m_file} exceeds {MAX_QUERY_RECORD_BYTES} bytes")
+                record = mapped[:end].lstrip()
+
+        if not record.startswith(b'>'):
             raise ValueError(f"No query sequence found in {a3m_file}")
 
-        raw_seq = ''.join(seq_lines)
-        seq = re.sub(r'[\.\-]', '', raw_seq)
-        seq = re.sub(r'[^A-Za-z]', '', seq).upper()
+        # Drop the header line, then keep only letters, uppercased
+        _, _, raw_seq = record.partition(b'\n')
+        seq = raw_seq.translate(None, NON_LETTERS).upper().decode('ascii')
 
         seq_id = os.path.splitext(os.path.basename(a3m_file))[0]
         return seq_id, seq
 
+    def query_info(self, a3m_file):
+        """
+        Query ID and ungapped sequence of an A3M file, taken from the query info
+        index written by the mutation stage when it is still valid for the file
+        (same size and mtime), otherwise read from the file itself.
+        """
+        msa_dir = os.path.dirname(os.path.abspath(a3m_file))
+        if msa_dir not in self._query_info:
+            self._query_info[msa_dir] = self._load_query_info(msa_dir)
+
+        cached = self._query_info[msa_dir].get(os.path.basename(a3m_file))
+        if cached is not None:
+            st = os.stat(a3m_file)
+            if (cached['size'], cached['mtime_ns']) == (st.st_size, st.st_mtime_ns):
+                return os.path.splitext(cached['file'])[0], cached['sequence']
+
+        return self.extract_msa_query_info(a3m_file)
+
+    @staticmethod
+    def _load_query_info(msa_dir):
+        """File name -> last query info record of `msa_dir`, empty if there is no index."""
+        index = {}
+        path = os.path.join(msa_dir, QUERY_INFO_FILE)
+        if not os.path.isfile(path):
+            return index
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                index[record['file']] = record
+        return index
+
     def _update_template_with_values(self, data, seq_id, sequence, msa_path):
         """
         Update the YAML template with sequence information.
@@ -82,46 +155,117 @@ class A3MtoYAMLConverter:
 
         return data
 
-    def convert_one(self, a3m_file):
-        """Convert a single .a3m file to YAML using the template."""
-        try:
-            seq_id, sequence = self.extract_msa_query_info(a3m_file)
-        except Exception as e:
-            print(f"Skipping {a3m_file}: {e}")
-            return
-
-        msa_path = a3m_file
+    def render_query(self, seq_id, sequence, msa_path):
+        """Fill a copy of the template for one query. Returns None if the template could not be loaded."""
+        if self.template is None:
+            return None
+        data = copy.deepcopy(self.template)
+        return self._update_template_with_values(data, seq_id, sequence, msa_path)
 
-        with open(self.template_file, 'r', encoding='utf-8') as tf:
+    def render_path(self, path):
+        """
+        Filled template of every query of one .a3m file (its own query) or
+        .a3m.deltas file (one per mutant), as (name, data) tuples.
+        For deltas, the MSA path is a reference: the mutant_msa_path next to the
+        WT file, which is only written when the consumer materializes it (the
+        inference scheduler does so per batch, see msa_delta.DeltaMsaResolver).
+        """
+        if path.endswith(DELTA_SUFFIX):
+            msa_dir = os.path.dirname(path)
+            queries = []
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    msa_path = mutant_msa_path(msa_dir, record['name'])
+                    queries.append((record['name'], self.render_query(record['name'], record['sequence'], msa_path)))
+        else:
             try:
-                data = yaml.safe_load(tf) or {}
+                seq_id, sequence = self.query_info(path)
             except Exception as e:
-                print(f"Error loading template {self.template_file}: {e}")
-                return
+                print(f"Skipping {path}: {e}")
+                return []
+            queries = [(seq_id, self.render_query(seq_id, sequence, path))]
 
-        new_data = self._update_template_with_values(data, seq_id, sequence, msa_path)
+        return [(name, data) for name, data in queries if data is not None]
 
-        safe_name = re.sub(r'[^\w\-\_\.]', '_', seq_id)
-        out_path = os.path.join(self.output_dir, f"{safe_name}.yaml")
+    def convert_one(self, a3m_file):
+        """Convert a single .a3m file to YAML using the template. Returns the YAML path, or None if skipped."""
+        for name, data in self.render_path(a3m_file):
+            return self._write_yaml(name, data)
+        return None
 
-        with open(out_path, 'w', encoding='utf-8') as out_f:
-            yaml.safe_dump(new_data, out_f, sort_keys=False, default_flow_style=False)
+    def _write_yaml(self, name, data):
+        out_path = os.path.join(self.output_dir, query_filename(name))
+        write_query_yaml(data, out_path)
+        return out_path
 
+    def convert_path(self, path):
+        """
+        Convert one .a3m or .a3m.deltas file. In file mode the YAML files are
+        written here and only the query names are returned; in shard mode the
+        rendered queries are returned for the parent to append to the shards.
+        """
+        queries = self.render_path(path)
+        if self.shard_size:
+            return queries
+        for name, data in queries:
+            self._write_yaml(name, data)
+        return [(name, None) for name, _ in queries]
+
+    def convert_files(self, paths):
+        """
+        Convert many .a3m/.a3m.deltas files, in a pool of `max_workers` processes
+        when it is greater than 1.
 
+        Returns:
+            list[list[str]]: Names of the queries written for each input, in order.
+        """
+        with PROFILER.stage("yaml.convert") as stage:
+            if self.max_workers <= 1 or len(paths) <= 1:
+                results = map(self.convert_path, paths)
+                return self._collect(results, stage)
+
+            # Hand files out in chunks so the converter is pickled once per chunk, not per file
+            chunksize = max(1, len(paths) // (self.max_workers * 4))
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                return self._collect(executor.map(self.convert_path, paths, chunksize=chunksize), stage)
+
+    def _collect(self, results, stage):
+        names = []
+        for queries in results:
+            stage.add(len(queries))
+            if self.shard_size:
+                for name, data in queries:
+                    self.shard_writer.add(name, data)
+            names.append([name for name, _ in queries])
+        if self.shard_size:
+            self.shard_writer.flush()
+        return names
+
+    def __getstate__(self):
+        # Pool workers only render queries, the shard files stay with the parent
+        state = self.__dict__.copy()
+        state['shard_writer'] = None
+        return state
 
     def batch_convert(self):
         """Convert all .a3m files in a directory (or a single file)."""
         if os.path.isfile(self.input_path):
-            if self.input_path.endswith('.a3m'):
-                self.convert_one(self.input_path)
-            return
-
-        for root, _, files in os.walk(self.input_path):
+            paths = [self.input_path] if self.input_path.endswith(('.a3m', DELTA_SUFFIX)) else []
+        else:
+            paths = []
+            for root, _, files in os.walk(self.input_path):
+                for f in files:
+                    if f.endswith(('.a3m', DELTA_SUFFIX)):
+                        paths.append(os.path.join(root, f))
+        self.convert_files(paths)
 
-            for f in files:
-                if f.endswith('.a3m'):
-                    a3m_path = os.path.join(root, f)
-                    self.convert_one(a3m_path)
+    def close(self):
+        """Close the current shard (shard mode only)."""
+        if self.shard_writer is not None:
+            self.shard_writer.close()
 
 
 def main():
@@ -129,14 +273,19 @@ def main():
     parser.add_argument("input_dir", help="Directory with .a3m files or a single .a3m file")
     parser.add_argument("output_dir", help="Directory where the YAML files will be saved")
     parser.add_argument("template", help="YAML template file")
+    parser.add_argument("--max_workers", type=int, default=1, help="Worker processes used for the conversion")
+    parser.add_argument("--shard_size", type=int, default=None,
+                        help="Write sharded JSONL manifests of this many queries instead of one YAML per query")
     args = parser.parse_args()
 
 
     print(args.input_dir)
     print(args.output_dir)
 
-    conv = A3MtoYAMLConverter(args.input_dir, args.output_dir, args.template)
+    conv = A3MtoYAMLConverter(args.input_dir, args.output_dir, args.template, max_workers=args.max_workers,
+                               shard_size=args.shard_size)
     conv.batch_convert()
+    conv.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Sharded Boltz query manifests.
+# Instead of one YAML file per query, queries are appended as JSON lines
+#   {"name": "P12345_A23T", "query": {<filled template>}}
+# to `queries-00000.jsonl`, `queries-00001.jsonl`, ... of at most `shard_size`
+# queries each. `index.json` lists the shards and the byte offset of every
+# query's latest record. Individual YAML files are only materialized for the
+# shard that is about to be run.
+
+import argparse
+import contextlib
+import json
+import os
+import re
+
+import yaml
+
+# LibYAML's C emitter when PyYAML was built with it
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+INDEX_FILE = 'index.json'
+
+
+def query_filename(name):
+    """File name of the YAML query `name`."""
+    return re.sub(r'[^\w\-\_\.]', '_', name) + '.yaml'
+
+
+def write_query_yaml(data, out_path):
+    """Dump one filled query template to `out_path`."""
+    with open(out_path, 'w', encoding='utf-8') as out_f:
+        yaml.dump(data, out_f, Dumper=YAML_DUMPER, sort_keys=False, default_flow_style=False)
+
+
+class QueryShardWriter:
+    """
+    Appends queries to the shards of a directory. An existing directory is
+    extended: new records go to fresh shards and supersede earlier records
+    of the same name in the index.
+    """
+
+    def __init__(self, shard_dir, shard_size=1000):
+        """
+        Args:
+            shard_dir (str): Directory holding the shards and `index.json`.
+            shard_size (int, optional): Maximum number of queries per shard.
+        """
+        self.shard_dir = shard_dir
+        self.shard_size = shard_size
+        os.makedirs(shard_dir, exist_ok=True)
+
+        self.shards = []
+        # Query name -> [shard number, byte offset of its record]
+        self.queries = {}
+        index_path = os.path.join(shard_dir, INDEX_FILE)
+        if os.path.isfile(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.shards = index['shards']
+            self.queries = index['queries']
+
+        self._file = None
+        self._count = 0
+
+    def add(self, name, data):
+        """Append one query to the current shard, starting a new shard when it is full."""
+        if self._file is None or self._count >= self.shard_size:
+            self._open_next_shard()
+        offset = self._file.tell()
+        self._file.write(json.dumps({'name': name, 'query': data}).encode('utf-8') + b'\n')
+        self.queries[name] = [len(self.shards) - 1, offset]
+        self._count += 1
+
+    def _open_next_shard(self):
+        if self._file is not None:
+            self._file.close()
+        filename = f"queries-{len(self.shards):05d}.jsonl"
+        self.shards.append(filename)
+        self._file = open(os.path.join(self.shard_dir, filename), 'wb')
+        self._count = 0
+
+    def flush(self):
+        """Flush the open shard and rewrite the index atomically."""
+        if self._file is not None:
+            self._file.flush()
+        index_path = os.path.join(self.shard_dir, INDEX_FILE)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'shard_size': self.shard_size, 'shards': self.shards, 'queries': self.queries}, f)
+        os.replace(tmp_path, index_path)
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class QueryShards:
+    """Read access to a sharded query directory, and lazy YAML expansion per shard."""
+
+    def __init__(self, shard_dir):
+        """
+        Args:
+            shard_dir (str): Directory written by QueryShardWriter.
+        """
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.shards = index['shards']
+        self.queries = {name: tuple(location) for name, location in index['queries'].items()}
+
+    def __len__(self):
+        return len(self.shards)
+
+    def iter_shard(self, shard):
+        """Yield the (name, query) tuples of one shard, skipping records superseded by a later shard."""
+        with open(os.path.join(self.shard_dir, self.shards[shard]), 'rb') as f:
+            offset = 0
+            for line in f:
+                record = json.loads(line)
+                if self.queries.get(record['name']) == (shard, offset):
+                    yield record['name'], record['query']
+                offset += len(line)
+
+    def load(self, name):
+        """Filled template of the query `name`."""
+        shard, offset = self.queries[name]
+        with open(os.path.join(self.shard_dir, self.shards[shard]), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())['query']
+
+    def expand(self, shard, out_dir):
+        """
+        Write the YAML file of every query of one shard.
+
+        Args:
+            shard (int): Shard number.
+            out_dir (str): Directory for the YAML files.
+        Returns:
+            list[str]: Paths of the written YAML files.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        for name, data in self.iter_shard(shard):
+            out_path = os.path.join(out_dir, query_filename(name))
+            write_query_yaml(data, out_path)
+            paths.append(out_path)
+        return paths
+
+    @contextlib.contextmanager
+    def expanded(self, shard, out_dir):
+        """Expand one shard for the duration of a `with` block and remove its YAML files afterwards."""
+        paths = self.expand(shard, out_dir)
+        try:
+            yield paths
+        finally:
+            for path in paths:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expand one shard of a sharded Boltz query directory into YAML files")
+    parser.add_argument("shard_dir", help="Directory with the query shards and index.json")
+    parser.add_argument("shard", type=int, nargs="?", help="Shard number to expand (omit to list shards)")
+    parser.add_argument("--out_dir", default=None, help="Output directory (default: <shard_dir>/shard-<n>)")
+    args = parser.parse_args()
+
+    shards = QueryShards(args.shard_dir)
+    if args.shard is None:
+        for i, filename in enumerate(shards.shards):
+            print(f"{i}\t{filename}")
+        return
+
+    out_dir = args.out_dir or os.path.join(args.shard_dir, f"shard-{args.shard:05d}")
+    paths = shards.expand(args.shard, out_dir)
+    print(f"Expanded {len(paths)} queries of shard {args.shard} in {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
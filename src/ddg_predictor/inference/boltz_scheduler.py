@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# Batch scheduler for Boltz inference on the generated queries.
+# Reads `boltz_queries/` (one YAML per query) or `boltz_query_shards/`
+# (see to_boltz_query/query_shards.py), keeps the WT and mutant queries of a
+# protein next to each other so they run back-to-back, packs them into
+# length-bounded batches and hands the batches to a runner (runners.py) from
+# a pool of workers. Every finished query is appended to
+# `<out_dir>/results.jsonl`; queries already predicted are skipped on rerun.
+# Mutant MSAs stored as deltas (see data_prep/get_msas/msa_delta.py) are
+# materialized next to each batch right before it runs and removed with it.
+
+import argparse
+import json
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+import yaml
+
+# Queries can come as shards, whose reader lives with the converter in data_prep/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_prep"))
+import stage_paths  # noqa: E402,F401
+
+from msa_delta import DeltaMsaResolver  # noqa: E402
+from query_shards import INDEX_FILE, QueryShards, query_filename, write_query_yaml  # noqa: E402
+from runners import BoltzRunner, FakeRunner  # noqa: E402
+
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Mutant queries are named '<sequence_id>_<mutation>', e.g. 'P12345_A23T' or 'P12345_A23T:G45V'
+# (':' becomes '_' in YAML file names)
+MUTATION_SUFFIX = re.compile(r"_[A-Z]\d+[A-Z](?:[:_][A-Z]\d+[A-Z])*$")
+
+RESULTS_FILE = "results.jsonl"
+
+
+@dataclass(frozen=True)
+class BoltzQuery:
+    name: str
+    sequence_id: str
+    length: int
+    # YAML file of the query, None when it is read from shards
+    path: str | None = None
+    # MSA paths referenced by the query's protein chains
+    msas: tuple[str, ...] = ()
+
+    @property
+    def stem(self) -> str:
+        """File stem of the query's YAML, which Boltz uses to name its outputs."""
+        return query_filename(self.name)[:-len(".yaml")]
+
+    @property
+    def is_wt(self) -> bool:
+        return self.name == self.sequence_id
+
+
+def sequence_id_of(name: str) -> str:
+    """WT sequence ID of a query name."""
+    return MUTATION_SUFFIX.sub("", name)
+
+
+def query_proteins(data: dict) -> list[dict]:
+    """Protein chains of a filled query template."""
+    return [
+        entry["protein"]
+        for entry in data.get("sequences", [])
+        if isinstance(entry, dict) and isinstance(entry.get("protein"), dict)
+    ]
+
+
+def query_length(data: dict) -> int:
+    """Total number of residues of the protein chains in a filled query template."""
+    return sum(len(protein.get("sequence", "")) for protein in query_proteins(data))
+
+
+def query_msas(data: dict) -> tuple[str, ...]:
+    """MSA paths of the protein chains in a filled query template."""
+    return tuple(protein["msa"] for protein in query_proteins(data) if isinstance(protein.get("msa"), str))
+
+
+def read_query(path: str) -> dict:
+    """Filled query template of a YAML query file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=YAML_LOADER) or {}
+
+
+def list_queries(query_dir: str) -> list[BoltzQuery]:
+    """All queries of a YAML query directory or a shard directory."""
+    if os.path.isfile(os.path.join(query_dir, INDEX_FILE)):
+        shards = QueryShards(query_dir)
+        return [
+            BoltzQuery(name, sequence_id_of(name), query_length(data), msas=query_msas(data))
+            for shard in range(len(shards))
+            for name, data in shards.iter_shard(shard)
+        ]
+
+    queries = []
+    for filename in sorted(os.listdir(query_dir)):
+        if not filename.endswith(".yaml"):
+            continue
+        path = os.path.join(query_dir, filename)
+        data = read_query(path)
+        name = filename[:-len(".yaml")]
+        queries.append(BoltzQuery(name, sequence_id_of(name), query_length(data), path, query_msas(data)))
+    return queries
+
+
+def plan_batches(queries: list[BoltzQuery], max_tokens: int,
+                 max_batch_size: int | None = None) -> list[list[BoltzQuery]]:
+    """
+    Group queries by sequence ID (WT first) and pack the groups, longest first,
+    into batches whose padded size (queries x longest query) stays within
+    `max_tokens`. The queries of a protein end up in one batch or in
+    consecutive ones. A single query longer than `max_tokens` gets its own batch.
+
+    Args:
+        queries (list[BoltzQuery]): Queries to schedule.
+        max_tokens (int): Budget of padded residues per batch.
+        max_batch_size (int | None, optional): Maximum number of queries per batch.
+    Returns:
+        list[list[BoltzQuery]]: Batches in dispatch order.
+    """
+    groups: dict[str, list[BoltzQuery]] = {}
+    for query in queries:
+        groups.setdefault(query.sequence_id, []).append(query)
+    ordered = sorted(groups.values(), key=lambda group: -max(query.length for query in group))
+
+    batches = []
+    batch, batch_max = [], 0
+    for group in ordered:
+        for query in sorted(group, key=lambda query: not query.is_wt):
+            new_max = max(batch_max, query.length)
+            full = max_batch_size is not None and len(batch) >= max_batch_size
+            if batch and (full or new_max * (len(batch) + 1) > max_tokens):
+                batches.append(batch)
+                batch, new_max = [], query.length
+            batch.append(query)
+            batch_max = new_max
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def chain_batches(batches: list[list[BoltzQuery]], max_chain: int | None = 4) -> list[list[int]]:
+    """
+    Merge the consecutive batches spanned by one split protein into one job
+    (a list of batch indices), so that protein is run by a single worker,
+    back-to-back. A job follows a single protein: a batch that continues
+    another protein than the one its job was chained for starts a new job, so
+    chains never grow across proteins.
+
+    Args:
+        batches (list[list[BoltzQuery]]): Batches from plan_batches.
+        max_chain (int | None, optional): Maximum number of batches per job. Defaults to 4.
+    Returns:
+        list[list[int]]: Jobs in dispatch order.
+    """
+    jobs: list[list[int]] = []
+    # Protein the last job is chained for, None while it holds a single batch
+    chained_id = None
+    for i, batch in enumerate(batches):
+        split_id = batches[i - 1][-1].sequence_id if i else None
+        if (split_id == batch[0].sequence_id and chained_id in (None, split_id)
+                and (max_chain is None or len(jobs[-1]) < max_chain)):
+            jobs[-1].append(i)
+            chained_id = split_id
+        else:
+            jobs.append([i])
+            chained_id = None
+    return jobs
+
+
+class BoltzScheduler:
+    """Dispatches planned batches to a runner from `workers` threads."""
+
+    def __init__(self, query_dir: str, out_dir: str, runner, workers: int = 1,
+                 devices: list[str] | None = None, max_tokens: int = 4096,
+                 max_batch_size: int | None = None, max_chain: int | None = 4):
+        """
+        Args:
+            query_dir (str): YAML query directory or shard directory.
+            out_dir (str): Directory for batch inputs and results.jsonl.
+            runner: Object with `run(batch_dir, batch, device) -> dict[name, result]` (see runners.py).
+            workers (int, optional): Batches run concurrently. Defaults to 1.
+            devices (list[str] | None, optional): GPU indices handed out to the workers, one batch per device at a time.
+            max_tokens (int, optional): Padded residues per batch (see plan_batches).
+            max_batch_size (int | None, optional): Maximum number of queries per batch.
+            max_chain (int | None, optional): Maximum batches of a split protein run as one job (see chain_batches).
+        """
+        if devices and len(devices) < workers:
+            raise ValueError(f"{workers} workers need at least as many devices, got {devices}")
+        self.query_dir = query_dir
+        self.out_dir = out_dir
+        self.runner = runner
+        self.workers = workers
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.max_chain = max_chain
+        self.resolver = DeltaMsaResolver()
+
+        self.devices: queue.Queue = queue.Queue()
+        for device in devices or [None] * workers:
+            self.devices.put(device)
+
+        self.shards = None
+        if os.path.isfile(os.path.join(query_dir, INDEX_FILE)):
+            self.shards = QueryShards(query_dir)
+
+        os.makedirs(out_dir, exist_ok=True)
+        self.results_path = os.path.join(out_dir, RESULTS_FILE)
+        self._results_lock = threading.Lock()
+
+    def completed(self) -> set[str]:
+        """Names of queries with a successful result from an earlier run."""
+        done = set()
+        if os.path.isfile(self.results_path):
+            with open(self.results_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record["status"] == "ok":
+                        done.add(record["name"])
+        return done
+
+    def run(self) -> dict[str, int]:
+        """
+        Plan and run all pending queries.
+
+        Returns:
+            dict[str, int]: Number of queries per result status.
+        """
+        done = self.completed()
+        pending = [query for query in list_queries(self.query_dir) if query.name not in done]
+        batches = plan_batches(pending, self.max_tokens, self.max_batch_size)
+        print(f"Scheduling {len(pending)} queries ({len(done)} done) in {len(batches)} batches")
+
+        counts: dict[str, int] = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self._run_job, [(i, batches[i]) for i in job])
+                for job in chain_batches(batches, self.max_chain)
+            ]
+            for future in as_completed(futures):
+                for status, n in future.result().items():
+                    counts[status] = counts.get(status, 0) + n
+
+        print(f"Finished: {counts}")
+        return counts
+
+    def _run_job(self, job: list[tuple[int, list[BoltzQuery]]]) -> dict[str, int]:
+        device = self.devices.get()
+        counts: dict[str, int] = {}
+        try:
+            for batch_index, batch in job:
+                batch_dir = self._batch_dir(batch_index)
+                try:
+                    self._materialize(batch_dir, batch)
+                    results = self.runner.run(batch_dir, batch, device)
+                except Exception as e:
+                    results = {query.name: {"status": "failed", "output": None, "error": str(e)} for query in batch}
+                finally:
+                    shutil.rmtree(batch_dir, ignore_errors=True)
+                    shutil.rmtree(self._msa_dir(batch_dir), ignore_errors=True)
+
+                self._record(batch_index, batch, results)
+                for result in results.values():
+                    counts[result["status"]] = counts.get(result["status"], 0) + 1
+                print(f"Batch {batch_index}: {len(batch)} queries, max length {max(q.length for q in batch)}")
+        finally:
+            self.devices.put(device)
+        return counts
+
+    def _batch_dir(self, batch_index: int) -> str:
+        return os.path.join(self.out_dir, "batches", f"batch-{batch_index:05d}")
+
+    @staticmethod
+    def _msa_dir(batch_dir: str) -> str:
+        # Next to the batch directory, not in it: Boltz rejects subdirectories among its inputs
+        return f"{batch_dir}.msas"
+
+    def _materialize(self, batch_dir: str, batch: list[BoltzQuery]) -> None:
+        """
+        Fill `batch_dir` with the YAML of every query of a batch: symlinks, or
+        files expanded from shards. MSAs of delta-encoded mutants are materialized in
+        the batch's MSA directory and the YAML written with those paths.
+        """
+        msa_dir = self._msa_dir(batch_dir)
+        os.makedirs(batch_dir, exist_ok=True)
+        for query in batch:
+            dest = os.path.join(batch_dir, query_filename(query.name))
+            resolved = {path: self.resolver.resolve(path, msa_dir) for path in query.msas}
+            moved = {path: os.path.abspath(new) for path, new in resolved.items() if new != path}
+            if query.path is not None and not moved:
+                os.symlink(os.path.abspath(query.path), dest)
+                continue
+
+            data = self.shards.load(query.name) if query.path is None else read_query(query.path)
+            for protein in query_proteins(data):
+                if protein.get("msa") in moved:
+                    protein["msa"] = moved[protein["msa"]]
+            write_query_yaml(data, dest)
+
+    def _record(self, batch_index: int, batch: list[BoltzQuery], results: dict[str, dict]) -> None:
+        lines = []
+        for query in batch:
+            result = results.get(query.name, {"status": "failed", "output": None, "error": "no result"})
+            lines.append(json.dumps({"name": query.name, "sequence_id": query.sequence_id,
+                                     "batch": batch_index, **result}) + "\n")
+        with self._results_lock, open(self.results_path, "a") as f:
+            f.writelines(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run Boltz on the generated queries in length-packed batches")
+    parser.add_argument("--query_dir", required=True, help="boltz_queries/ or boltz_query_shards/ directory")
+    parser.add_argument("--out_dir", required=True, help="Directory for predictions and results.jsonl")
+    parser.add_argument("--runner", choices=["boltz", "fake"], default="boltz",
+                        help="'boltz' runs `boltz predict`, 'fake' simulates it on CPU")
+    parser.add_argument("--workers", type=int, default=1, help="Batches run concurrently")
+    parser.add_argument("--devices", default=None, help="Comma-separated GPU indices assigned to the workers")
+    parser.add_argument("--max_tokens", type=int, default=4096, help="Padded residues per batch")
+    parser.add_argument("--max_batch_size", type=int, default=None, help="Maximum queries per batch")
+    parser.add_argument("--max_chain", type=int, default=4,
+                        help="Maximum batches of a protein split across batches run back-to-back by one worker")
+    parser.add_argument("--boltz_bin", default="boltz", help="Boltz executable")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds before a batch is killed")
+    args, boltz_args = parser.parse_known_args()
+
+    if args.runner == "fake":
+        runner = FakeRunner()
+    else:
+        runner = BoltzRunner(args.out_dir, args.boltz_bin, boltz_args, args.timeout)
+
+    devices = args.devices.split(",") if args.devices else None
+    scheduler = BoltzScheduler(args.query_dir, args.out_dir, runner, workers=args.workers, devices=devices,
+                               max_tokens=args.max_tokens, max_batch_size=args.max_batch_size,
+                               max_chain=args.max_chain)
+    scheduler.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Runners executing one batch of Boltz queries for boltz_scheduler.py.
+# A runner gets the directory holding the batch's YAML files and the queries
+# in it (BoltzQuery), and returns one result dict per query name:
+#   {"status": "ok" | "failed", "output": <prediction dir or None>, ...}
+
+import os
+import shutil
+import subprocess
+import time
+import zlib
+
+
+class BoltzRunner:
+    """Runs `boltz predict` on a batch directory in a subprocess."""
+
+    def __init__(self, out_dir: str, boltz_bin: str = "boltz", extra_args: list[str] | None = None,
+                 timeout: float | None = None):
+        """
+        Args:
+            out_dir (str): Directory under which Boltz writes its predictions.
+            boltz_bin (str, optional): Boltz executable. Defaults to 'boltz'.
+            extra_args (list[str] | None, optional): Extra `boltz predict` arguments (e.g. ['--recycling_steps', '3']).
+            timeout (float | None, optional): Seconds after which a batch is killed and reported as failed.
+        """
+        if shutil.which(boltz_bin) is None:
+            raise FileNotFoundError(f"Boltz executable not found: {boltz_bin}")
+        self.out_dir = out_dir
+        self.boltz_bin = boltz_bin
+        self.extra_args = extra_args or []
+        self.timeout = timeout
+
+    def run(self, batch_dir: str, batch: list, device: str | None = None) -> dict[str, dict]:
+        """
+        Args:
+            batch_dir (str): Directory with one YAML per query of the batch.
+            batch (list[BoltzQuery]): Queries of the batch.
+            device (str | None, optional): GPU index exposed to the subprocess through CUDA_VISIBLE_DEVICES.
+        Returns:
+            dict[str, dict]: Result per query name.
+        """
+        env = os.environ.copy()
+        if device is not None:
+            env["CUDA_VISIBLE_DEVICES"] = device
+
+        cmd = [self.boltz_bin, "predict", batch_dir, "--out_dir", self.out_dir, *self.extra_args]
+        try:
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=self.timeout)
+            error = proc.stderr.strip().splitlines()[-1:] if proc.returncode != 0 else []
+        except subprocess.TimeoutExpired:
+            error = [f"timed out after {self.timeout}s"]
+
+        # Boltz writes <out_dir>/boltz_results_<input dir name>/predictions/<YAML file stem>/
+        predictions_dir = os.path.join(self.out_dir, f"boltz_results_{os.path.basename(batch_dir.rstrip('/'))}",
+                                       "predictions")
+        results = {}
+        for query in batch:
+            output = os.path.join(predictions_dir, query.stem)
+            if os.path.isdir(output):
+                results[query.name] = {"status": "ok", "output": output}
+            else:
+                results[query.name] = {"status": "failed", "output": None,
+                                       "error": error[0] if error else "no prediction"}
+        return results
+
+
+class FakeRunner:
+    """
+    CPU stand-in for BoltzRunner: sleeps in proportion to the padded batch size
+    and returns a deterministic pseudo-score per query, so scheduling can be
+    exercised without a GPU or the model.
+    """
+
+    def __init__(self, seconds_per_token: float = 0.0, fail_names: set[str] | None = None):
+        """
+        Args:
+            seconds_per_token (float, optional): Simulated cost per padded token of a batch.
+            fail_names (set[str] | None, optional): Queries reported as failed.
+        """
+        self.seconds_per_token = seconds_per_token
+        self.fail_names = fail_names or set()
+        self.batches: list[list[str]] = []
+
+    def run(self, batch_dir: str, batch: list, device: str | None = None) -> dict[str, dict]:
+        self.batches.append([query.name for query in batch])
+        time.sleep(self.seconds_per_token * max(query.length for query in batch) * len(batch))
+
+        results = {}
+        for query in batch:
+            if query.name in self.fail_names:
+                results[query.name] = {"status": "failed", "output": None, "error": "fake failure"}
+            else:
+                score = zlib.crc32(query.name.encode("utf-8")) / 2 ** 32
+                results[query.name] = {"status": "ok", "output": None, "score": score, "device": device}
+        return results
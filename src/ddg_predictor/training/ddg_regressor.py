@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# ddG regressor trained on WT/mutant embedding differences.
+# For every mutation row, the per-residue embeddings of the WT and the mutant
+# are read (memory-mapped .npy files, or a CPU stub derived from the cached MSA
+# features), and the feature vector is [mutant - WT, WT] at the mutated
+# position(s), summed over the sites of multi-site variants. Mini-batches are
+# built by a background thread and streamed into the sufficient statistics of
+# a ridge regression (X^T X, X^T y), so memory stays at one batch plus a
+# D x D matrix regardless of the dataset size.
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Mutation tables and MSA features come from the data_prep stages
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_prep"))
+import stage_paths  # noqa: E402,F401
+
+from msa_features import FeatureCache  # noqa: E402
+from mut_msa import MsaMutator  # noqa: E402
+from mutation_table import read_mutations  # noqa: E402
+
+
+class EmbeddingStore:
+    """
+    Per-residue embeddings saved as `<root>/<name>.npy` arrays of shape (L, D),
+    `name` being the query name (`<sequence_id>` for the WT,
+    `<sequence_id>_<mutation>` for a mutant). Arrays are memory-mapped.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def wt(self, sequence_id: str) -> np.ndarray:
+        return np.load(os.path.join(self.root, f"{sequence_id}.npy"), mmap_mode="r")
+
+    def mutant(self, sequence_id: str, mutation: str) -> np.ndarray:
+        return np.load(os.path.join(self.root, f"{sequence_id}_{mutation}.npy"), mmap_mode="r")
+
+
+class MsaFeatureExtractor:
+    """
+    Stub embedding until model embeddings are available: per-residue
+    concatenation of the MSA profile, the one-hot residue and the mean
+    deletions, read from the WT feature cache (get_msas/msa_features.py).
+    """
+
+    def __init__(self, msa_dir: str, feature_cache_dir: str):
+        """
+        Args:
+            msa_dir (str): Directory with the WT `{sequence_id}.a3m` files.
+            feature_cache_dir (str): Feature cache directory.
+        """
+        self.msa_dir = msa_dir
+        self.cache = FeatureCache(feature_cache_dir)
+
+    @staticmethod
+    def _embed(features: dict[str, np.ndarray]) -> np.ndarray:
+        return np.concatenate(
+            (features["profile"], features["residue_one_hot"], features["deletion_mean"][:, None]), axis=1
+        )
+
+    def wt(self, sequence_id: str) -> np.ndarray:
+        return self._embed(self.cache.get_wt(sequence_id, os.path.join(self.msa_dir, f"{sequence_id}.a3m")))
+
+    def mutant(self, sequence_id: str, mutation: str) -> np.ndarray:
+        msa_path = os.path.join(self.msa_dir, f"{sequence_id}.a3m")
+        return self._embed(self.cache.get_mutant(sequence_id, msa_path, mutation))
+
+
+def difference_feature(wt: np.ndarray, mutant: np.ndarray, mutation: str) -> np.ndarray:
+    """[mutant - WT, WT] at the mutated position(s), summed over the sites of the variant."""
+    positions = [pos - 1 for _, pos, _ in MsaMutator.parse_variant(mutation)]
+    wt_sites = np.asarray(wt[positions], dtype=np.float64)
+    mutant_sites = np.asarray(mutant[positions], dtype=np.float64)
+    return np.concatenate(((mutant_sites - wt_sites).sum(axis=0), wt_sites.sum(axis=0)))
+
+
+def iter_batches(mutations_df: pd.DataFrame, extractor, batch_size: int = 256,
+                 prefetch: int = 4) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield (X, y) mini-batches, built by a background thread up to `prefetch`
+    batches ahead. Rows are visited protein by protein so each WT embedding is
+    read once. Rows whose embeddings fail are skipped with a message.
+
+    Args:
+        mutations_df (pd.DataFrame): Rows with sequence_id, mutation and ddg.
+        extractor: Object with `wt(sequence_id)` and `mutant(sequence_id, mutation)` returning (L, D) arrays.
+        batch_size (int, optional): Rows per batch.
+        prefetch (int, optional): Batches buffered ahead of the consumer.
+    """
+    batches: queue.Queue = queue.Queue(maxsize=prefetch)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            X, y = [], []
+            for sequence_id, group in mutations_df.groupby("sequence_id", observed=True, sort=False):
+                try:
+                    wt = extractor.wt(sequence_id)
+                except Exception as e:
+                    print(f"Skipping {sequence_id}: {e}")
+                    continue
+                for mutation, ddg in zip(group["mutation"], group["ddg"]):
+                    try:
+                        X.append(difference_feature(wt, extractor.mutant(sequence_id, mutation), mutation))
+                    except Exception as e:
+                        print(f"Skipping {sequence_id}_{mutation}: {e}")
+                        continue
+                    y.append(ddg)
+                    if len(X) == batch_size:
+                        batches.put((np.stack(X), np.asarray(y, dtype=np.float64)))
+                        X, y = [], []
+                        if stop.is_set():
+                            return
+            if X:
+                batches.put((np.stack(X), np.asarray(y, dtype=np.float64)))
+        except BaseException as e:
+            batches.put(e)
+        finally:
+            batches.put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while (item := batches.get()) is not done:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Unblock the producer if the consumer stops early
+        stop.set()
+        while producer.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class StreamingRidge:
+    """
+    Ridge regression fitted from streamed batches: only X^T X and X^T y
+    (with a bias column) are accumulated, then solved once.
+    """
+
+    def __init__(self, alpha: float = 1.0):
+        """
+        Args:
+            alpha (float, optional): L2 penalty on the weights (not on the bias).
+        """
+        self.alpha = alpha
+        self.xtx: np.ndarray | None = None
+        self.xty: np.ndarray | None = None
+        self.n_samples = 0
+        self.coef: np.ndarray | None = None
+        self.intercept = 0.0
+
+    @staticmethod
+    def _with_bias(X: np.ndarray) -> np.ndarray:
+        return np.hstack((X, np.ones((len(X), 1))))
+
+    def partial_fit(self, X: np.ndarray, y: np.ndarray) -> None:
+        Xb = self._with_bias(X)
+        if self.xtx is None:
+            self.xtx = np.zeros((Xb.shape[1], Xb.shape[1]))
+            self.xty = np.zeros(Xb.shape[1])
+        self.xtx += Xb.T @ Xb
+        self.xty += Xb.T @ y
+        self.n_samples += len(y)
+
+    def solve(self) -> None:
+        if self.xtx is None:
+            raise ValueError("No samples were accumulated")
+        penalty = self.alpha * np.eye(len(self.xtx))
+        penalty[-1, -1] = 0.0
+        weights = np.linalg.solve(self.xtx + penalty, self.xty)
+        self.coef, self.intercept = weights[:-1], float(weights[-1])
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return X @ self.coef + self.intercept
+
+    def save(self, path: str, **metadata) -> None:
+        np.savez(path, coef=self.coef, intercept=self.intercept, alpha=self.alpha,
+                 metadata=json.dumps(metadata))
+
+    @classmethod
+    def load(cls, path: str) -> "StreamingRidge":
+        data = np.load(path)
+        model = cls(float(data["alpha"]))
+        model.coef, model.intercept = data["coef"], float(data["intercept"])
+        return model
+
+
+def split_by_protein(mutations_df: pd.DataFrame, val_fraction: float) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Deterministic train/validation split by sequence ID, so no protein
+    contributes to both sides.
+    """
+    ids = mutations_df["sequence_id"].astype(str)
+    val = ids.map(lambda i: zlib.crc32(i.encode("utf-8")) / 2 ** 32 < val_fraction).to_numpy()
+    return mutations_df[~val], mutations_df[val]
+
+
+def evaluate(model: StreamingRidge, batches: Iterator[tuple[np.ndarray, np.ndarray]]) -> dict[str, float]:
+    """RMSE and Pearson correlation of the model over streamed batches."""
+    predictions, targets = [], []
+    for X, y in batches:
+        predictions.append(model.predict(X))
+        targets.append(y)
+    if not targets:
+        return {"n": 0}
+    pred, true = np.concatenate(predictions), np.concatenate(targets)
+    pearson = float(np.corrcoef(pred, true)[0, 1]) if len(true) > 1 else float("nan")
+    return {"n": len(true), "rmse": float(np.sqrt(np.mean((pred - true) ** 2))), "pearson": pearson}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train a ridge ddG regressor on WT/mutant embedding differences")
+    parser.add_argument('--mutations', required=True, help='Mutation table (mut_data.csv or mut_data.parquet)')
+    parser.add_argument('--embedding_dir', default=None, help='Directory with per-residue <name>.npy embeddings')
+    parser.add_argument('--msa_dir', default=None, help='WT A3M directory, for MSA feature embeddings')
+    parser.add_argument('--feature_cache_dir', default=None, help='Feature cache used with --msa_dir')
+    parser.add_argument('--model_out', required=True, help='Output .npz model file')
+    parser.add_argument('--alpha', type=float, default=1.0, help='L2 penalty')
+    parser.add_argument('--batch_size', type=int, default=256, help='Rows per streamed batch')
+    parser.add_argument('--prefetch', type=int, default=4, help='Batches prepared ahead of training')
+    parser.add_argument('--val_fraction', type=float, default=0.1, help='Fraction of proteins held out')
+    args = parser.parse_args()
+
+    if args.embedding_dir:
+        extractor = EmbeddingStore(args.embedding_dir)
+    elif args.msa_dir and args.feature_cache_dir:
+        extractor = MsaFeatureExtractor(args.msa_dir, args.feature_cache_dir)
+    else:
+        parser.error("Give --embedding_dir, or --msa_dir and --feature_cache_dir")
+
+    mutations_df = read_mutations(args.mutations).dropna(subset=["ddg"])
+    train_df, val_df = split_by_protein(mutations_df, args.val_fraction)
+    print(f"Training on {len(train_df)} mutations, validating on {len(val_df)}")
+
+    model = StreamingRidge(args.alpha)
+    for X, y in iter_batches(train_df, extractor, args.batch_size, args.prefetch):
+        model.partial_fit(X, y)
+    model.solve()
+
+    train_metrics = evaluate(model, iter_batches(train_df, extractor, args.batch_size, args.prefetch))
+    val_metrics = evaluate(model, iter_batches(val_df, extractor, args.batch_size, args.prefetch))
+    print(f"Train: {train_metrics}")
+    print(f"Validation: {val_metrics}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.model_out)), exist_ok=True)
+    model.save(args.model_out, train=train_metrics, validation=val_metrics, mutations=args.mutations)
+    print(f"Model saved to {args.model_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+# The pipeline modules are scripts that import their siblings by name, so the
+# tests set up the path like the entry points do (see data_prep/stage_paths.py).
+
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src" / "ddg_predictor"
+for module_dir in ("data_prep", "inference", "training"):
+    sys.path.insert(0, str(SRC_DIR / module_dir))
+
+import stage_paths  # noqa: E402,F401
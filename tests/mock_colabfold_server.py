@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# Local stand-in for the ColabFold MMseqs2 server, used by the tests and the
+# benchmarks to exercise run_mmseqs2 and MMseqs2Client offline. Mimics the `ticket/msa`, `ticket/pair`,
+# `ticket/{id}` and `result/download/{id}` endpoints and returns synthetic
+# alignments in the same tarball layout as the real server.
+
+import argparse
+import io
+import json
+import random
+import tarfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+class MockColabFoldServer:
+    """
+    Threaded HTTP server answering like the ColabFold MMseqs2 API.
+    Each ticket reports PENDING, then RUNNING for `polls_until_complete` status
+    checks before turning COMPLETE. The first `ratelimit_submissions`
+    submissions are answered with RATELIMIT. A ticket counts as in flight from
+    its submission until its result is downloaded; `max_in_flight` records
+    the most tickets in flight at once.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, polls_until_complete: int = 1,
+                 ratelimit_submissions: int = 0, hits_per_query: int = 4, seed: int = 0):
+        """
+        Args:
+            host (str, optional): Interface to bind.
+            port (int, optional): Port to bind, 0 picks a free one.
+            polls_until_complete (int, optional): Status checks answered RUNNING before COMPLETE.
+            ratelimit_submissions (int, optional): Number of initial submissions rejected with RATELIMIT.
+            hits_per_query (int, optional): Synthetic homologs returned per query and database.
+            seed (int, optional): Random seed for the synthetic homologs.
+        """
+        self.polls_until_complete = polls_until_complete
+        self.ratelimit_submissions = ratelimit_submissions
+        self.hits_per_query = hits_per_query
+        self.rng = random.Random(seed)
+
+        self.tickets: dict[str, dict] = {}
+        self.submissions = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockColabFoldServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockColabFoldServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _homolog(self, seq: str, lowercase: bool) -> str:
+        """Random point-substituted copy of `seq` with some gaps and insertions."""
+        out = []
+        for aa in seq:
+            r = self.rng.random()
+            if r < 0.1:
+                out.append("-")
+            elif r < 0.3:
+                out.append(self.rng.choice(AMINO_ACIDS))
+            else:
+                out.append(aa)
+            if lowercase and self.rng.random() < 0.05:
+                out.append(self.rng.choice(AMINO_ACIDS).lower())
+        return "".join(out)
+
+    def _a3m(self, queries: list[tuple[str, str]], db: str) -> str:
+        """Build one result a3m: NUL separated blocks, one per query."""
+        blocks = []
+        for name, seq in queries:
+            lines = [f">{name}\n{seq}\n"]
+            for i in range(self.hits_per_query):
+                lines.append(f">{db}_{name}_{i}\n{self._homolog(seq, lowercase=True)}\n")
+            blocks.append("".join(lines))
+        return "\x00".join(blocks) + "\x00"
+
+    def _tarball(self, ticket: dict) -> bytes:
+        mode = ticket["mode"]
+        if ticket["pair"]:
+            files = {"pair.a3m": self._a3m(ticket["queries"], "pair")}
+        else:
+            files = {"uniref.a3m": self._a3m(ticket["queries"], "uniref")}
+            if mode.startswith("env"):
+                files["bfd.mgnify30.metaeuk30.smag30.a3m"] = self._a3m(ticket["queries"], "bfd")
+
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+            for name, text in files.items():
+                data = text.encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return buf.getvalue()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body: bytes, content_type: str = "application/json") -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, payload: dict) -> None:
+                self._reply(json.dumps(payload).encode("utf-8"))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                with server._lock:
+                    server.requests += 1
+                    server.submissions += 1
+                    if server.submissions <= server.ratelimit_submissions:
+                        return self._json({"status": "RATELIMIT"})
+
+                if self.path.rstrip("/") not in ("/ticket/msa", "/ticket/pair"):
+                    self.send_error(404)
+                    return
+
+                lines = form.get("q", [""])[0].strip().splitlines()
+                queries = [(lines[i][1:], lines[i + 1]) for i in range(0, len(lines) - 1, 2)]
+                ticket_id = uuid.uuid4().hex
+                with server._lock:
+                    server.tickets[ticket_id] = {
+                        "queries": queries,
+                        "mode": form.get("mode", [""])[0],
+                        "pair": self.path.rstrip("/") == "/ticket/pair",
+                        "polls": 0,
+                        "downloaded": False,
+                    }
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                self._json({"id": ticket_id, "status": "PENDING"})
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                with server._lock:
+                    server.requests += 1
+                    ticket = server.tickets.get(parts[-1])
+                if ticket is None:
+                    return self._json({"status": "ERROR"})
+
+                if parts[:-1] == ["ticket"]:
+                    with server._lock:
+                        ticket["polls"] += 1
+                        done = ticket["polls"] > server.polls_until_complete
+                    return self._json({"id": parts[-1], "status": "COMPLETE" if done else "RUNNING"})
+
+                if parts[:-1] == ["result", "download"]:
+                    with server._lock:
+                        if not ticket["downloaded"]:
+                            ticket["downloaded"] = True
+                            server.in_flight -= 1
+                        tarball = server._tarball(ticket)
+                    return self._reply(tarball, "application/octet-stream")
+
+                self.send_error(404)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the ColabFold MMseqs2 server")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--polls_until_complete", type=int, default=1, help="RUNNING replies before COMPLETE")
+    parser.add_argument("--hits_per_query", type=int, default=4, help="Synthetic homologs per query")
+    args = parser.parse_args()
+
+    server = MockColabFoldServer(port=args.port, polls_until_complete=args.polls_until_complete,
+                                 hits_per_query=args.hits_per_query)
+    print(f"Serving mock MMseqs2 API at {server.url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import numpy as np
+
+from a3m_alignment import A3mAlignment
+
+# Rows with insertions (lowercase) before, between and after match columns
+A3M = (
+    ">P1\nACDEFG\n"
+    ">hit1\nAaaCDEFG\n"
+    ">hit2\nAC-EfFgG\n"
+    ">hit3\nkkA-DEF-\n"
+)
+
+
+def test_column_index_is_the_match_column():
+    alignment = A3mAlignment.from_bytes(A3M.encode())
+    assert [alignment.column_index(pos) for pos in range(1, 7)] == list(range(6))
+    assert alignment.match_matrix().tobytes().decode() == "ACDEFG" "ACDEFG" "AC-EFG" "A-DEF-"
+
+
+def test_patches_skip_insertions_before_the_site():
+    alignment = A3mAlignment.from_bytes(A3M.encode())
+    mutant = alignment.with_patches([alignment.residue_patch(1, "W"), alignment.residue_patch(4, "Y")], ">P1_C2W")
+    assert [seq for _, seq in mutant.records()] == ["AWDEYG", "AaaWDEYG", "AW-EfYgG", "kkA-DEY-"]
+    assert mutant.header(0) == ">P1_C2W"
+    # The WT buffer is left untouched
+    assert [seq for _, seq in alignment.records()] == ["ACDEFG", "AaaCDEFG", "AC-EfFgG", "kkA-DEF-"]
+    np.testing.assert_array_equal(mutant.seq_lengths, alignment.seq_lengths)
@@ -0,0 +1,113 @@
+import os
+
+import pandas as pd
+import pytest
+import yaml
+
+from boltz_scheduler import BoltzQuery, BoltzScheduler, chain_batches, plan_batches
+from m3a_to_yaml import A3MtoYAMLConverter
+from mut_msa import A3mMutator
+from runners import FakeRunner
+
+WT_A3M = (
+    ">P1\nMKTAYIAK\n"
+    ">hit1\nMKTaaAYIAK\n"
+    ">hit2\n-KTAY-AK\n"
+)
+MUTATIONS = ["K2R", "A4G", "Y5F:K8E"]
+TEMPLATE = "version: 1\nsequences:\n  - protein:\n      id: A\n      sequence: X\n      msa: none\n"
+
+
+def query(name, length):
+    return BoltzQuery(name, name.split("_")[0], length)
+
+
+def protein(seq_id, n_mutants, length=100):
+    return [query(seq_id, length)] + [query(f"{seq_id}_A{i + 1}G", length) for i in range(n_mutants)]
+
+
+def test_plan_batches_respects_budget_and_keeps_wt_first():
+    queries = protein("P1", 5, 100) + protein("P2", 2, 300) + protein("P3", 0, 50)
+    batches = plan_batches(queries, max_tokens=400, max_batch_size=3)
+
+    assert sorted(q.name for batch in batches for q in batch) == sorted(q.name for q in queries)
+    for batch in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or max(q.length for q in batch) * len(batch) <= 400
+    # Longest protein first, each WT ahead of its mutants
+    order = [q.name for batch in batches for q in batch]
+    assert order[0] == "P2"
+    assert order.index("P1") < min(order.index(q.name) for q in queries if q.sequence_id == "P1" and not q.is_wt)
+
+
+def test_plan_batches_gives_oversized_query_its_own_batch():
+    batches = plan_batches([query("P1", 5000), query("P2", 10)], max_tokens=4096)
+    assert [[q.name for q in batch] for batch in batches] == [["P1"], ["P2"]]
+
+
+def test_chain_batches_follows_one_split_protein():
+    p0, p1, p2 = protein("P0", 3), protein("P1", 3), protein("P2", 0)
+    # P0 spans batches 0-1 and P1 spans batches 1-2: only the P0 split is chained
+    batches = [p0[:3], p0[3:] + p1[:2], p1[2:], p2]
+    assert chain_batches(batches) == [[0, 1], [2], [3]]
+
+    queries = [q for i in range(6) for q in protein(f"P{i}", 4)]
+    batches = plan_batches(queries, max_tokens=300)
+    jobs = chain_batches(batches)
+    assert [i for job in jobs for i in job] == list(range(len(batches)))
+    for job in jobs:
+        split_ids = {batches[i - 1][-1].sequence_id for i in job[1:]}
+        assert len(split_ids) <= 1
+        assert all(batches[i][0].sequence_id in split_ids for i in job[1:])
+
+
+def test_chain_batches_caps_chain_length():
+    batches = plan_batches(protein("P1", 20), max_tokens=200)
+    assert [len(job) for job in chain_batches(batches, max_chain=4)] == [4, 4, 3]
+    assert [len(job) for job in chain_batches(batches, max_chain=None)] == [11]
+
+
+class MsaCheckingRunner(FakeRunner):
+    """Fails the test unless every MSA referenced by the batch's YAML files exists while it runs."""
+
+    def __init__(self):
+        super().__init__()
+        self.msas = []
+
+    def run(self, batch_dir, batch, device=None):
+        assert sorted(os.listdir(batch_dir)) == sorted(f"{q.stem}.yaml" for q in batch)
+        for filename in os.listdir(batch_dir):
+            with open(os.path.join(batch_dir, filename)) as f:
+                data = yaml.safe_load(f)
+            for entry in data["sequences"]:
+                assert os.path.isfile(entry["protein"]["msa"]), entry["protein"]["msa"]
+                self.msas.append(entry["protein"]["msa"])
+        return super().run(batch_dir, batch, device)
+
+
+@pytest.mark.parametrize("shard_size", [None, 2])
+def test_scheduler_materializes_delta_msas_per_batch(tmp_path, shard_size):
+    msa_dir = tmp_path / "msas"
+    msa_dir.mkdir()
+    (msa_dir / "P1.a3m").write_text(WT_A3M)
+    mutations = pd.DataFrame({"sequence_id": "P1", "mutation": MUTATIONS, "ddg": 0.0})
+    assert not A3mMutator(str(msa_dir), mutations, storage="delta").mutate_directory()
+    assert sorted(os.listdir(msa_dir)) == ["P1.a3m", "P1.a3m.deltas", "query_info.jsonl"]
+
+    template = tmp_path / "template.yaml"
+    template.write_text(TEMPLATE)
+    converter = A3MtoYAMLConverter(str(msa_dir), str(tmp_path), str(template), shard_size=shard_size)
+    converter.batch_convert()
+    converter.close()
+
+    runner = MsaCheckingRunner()
+    out_dir = tmp_path / "out"
+    scheduler = BoltzScheduler(converter.output_dir, str(out_dir), runner, max_tokens=16)
+    assert scheduler.run() == {"ok": 1 + len(MUTATIONS)}
+
+    assert len(runner.batches) == 2
+    assert len(runner.msas) == 1 + len(MUTATIONS)
+    assert sum(path.startswith(str(out_dir / "batches")) for path in runner.msas) == len(MUTATIONS)
+    # Materialized MSAs are removed with their batch, the MSA directory is left as it was
+    assert os.listdir(out_dir / "batches") == []
+    assert sorted(os.listdir(msa_dir)) == ["P1.a3m", "P1.a3m.deltas", "query_info.jsonl"]
@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ddg_regressor import StreamingRidge, difference_feature, iter_batches, split_by_protein
+
+
+def test_streaming_ridge_matches_closed_form(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(500, 6))
+    y = X @ rng.normal(size=6) + 3.0 + rng.normal(scale=0.1, size=500)
+
+    model = StreamingRidge(alpha=2.0)
+    for start in range(0, len(X), 64):
+        model.partial_fit(X[start:start + 64], y[start:start + 64])
+    model.solve()
+
+    # Closed form with an unpenalized bias column
+    Xb = np.hstack((X, np.ones((len(X), 1))))
+    penalty = np.diag([2.0] * 6 + [0.0])
+    expected = np.linalg.solve(Xb.T @ Xb + penalty, Xb.T @ y)
+    np.testing.assert_allclose(model.coef, expected[:-1])
+    assert model.intercept == pytest.approx(expected[-1])
+    assert model.n_samples == len(X)
+
+    model.save(str(tmp_path / "model.npz"))
+    loaded = StreamingRidge.load(str(tmp_path / "model.npz"))
+    np.testing.assert_allclose(loaded.predict(X), model.predict(X))
+
+
+def test_streaming_ridge_without_penalty_is_least_squares():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(200, 4))
+    y = rng.normal(size=200)
+    model = StreamingRidge(alpha=0.0)
+    model.partial_fit(X, y)
+    model.solve()
+    expected, *_ = np.linalg.lstsq(np.hstack((X, np.ones((200, 1)))), y, rcond=None)
+    np.testing.assert_allclose(np.append(model.coef, model.intercept), expected)
+
+
+class ArrayExtractor:
+    """In-memory embeddings; a mutant adds 1 to the WT row of the mutated position."""
+
+    def __init__(self, n_proteins=5, length=10, dim=3):
+        rng = np.random.default_rng(2)
+        self.embeddings = {f"P{i}": rng.normal(size=(length, dim)) for i in range(n_proteins)}
+        self.wt_reads = []
+        self.lock = threading.Lock()
+
+    def wt(self, sequence_id):
+        with self.lock:
+            self.wt_reads.append(sequence_id)
+        return self.embeddings[sequence_id]
+
+    def mutant(self, sequence_id, mutation):
+        if mutation == "BAD":
+            raise ValueError("unparsable mutation")
+        mutant = self.embeddings[sequence_id].copy()
+        mutant[int(mutation[1:-1]) - 1] += 1.0
+        return mutant
+
+
+def mutation_table(n_proteins=5, per_protein=7):
+    rows = [(f"P{i}", f"A{j + 1}G", float(i * 10 + j)) for i in range(n_proteins) for j in range(per_protein)]
+    return pd.DataFrame(rows, columns=["sequence_id", "mutation", "ddg"])
+
+
+def test_iter_batches_streams_every_row_once():
+    df = mutation_table()
+    df.loc[3, "mutation"] = "BAD"
+    extractor = ArrayExtractor()
+
+    batches = list(iter_batches(df, extractor, batch_size=4, prefetch=2))
+    assert [len(y) for _, y in batches[:-1]] == [4] * (len(batches) - 1)
+    y = np.concatenate([y for _, y in batches])
+    np.testing.assert_array_equal(y, df["ddg"].drop(index=3).to_numpy())
+    # Each WT embedding is read once, protein by protein
+    assert extractor.wt_reads == [f"P{i}" for i in range(5)]
+
+    X = np.concatenate([X for X, _ in batches])
+    wt = extractor.embeddings["P0"]
+    np.testing.assert_allclose(X[0], difference_feature(wt, extractor.mutant("P0", "A1G"), "A1G"))
+    np.testing.assert_allclose(X[0], np.concatenate((np.ones(3), wt[0])))
+
+
+def test_iter_batches_stops_producer_when_consumer_stops_early():
+    threads = threading.active_count()
+    batches = iter_batches(mutation_table(n_proteins=20), ArrayExtractor(n_proteins=20), batch_size=2, prefetch=1)
+    next(batches)
+    assert threading.active_count() == threads + 1
+    batches.close()
+    assert threading.active_count() == threads
+
+
+def test_iter_batches_reraises_producer_errors():
+    with pytest.raises(KeyError):
+        list(iter_batches(mutation_table().drop(columns="ddg"), ArrayExtractor()))
+
+
+def test_split_by_protein_keeps_each_protein_on_one_side():
+    df = pd.DataFrame({"sequence_id": [f"P{i % 40}" for i in range(400)], "mutation": "A1G", "ddg": 0.0})
+    train, val = split_by_protein(df, 0.25)
+    assert len(train) + len(val) == len(df)
+    assert set(train["sequence_id"]).isdisjoint(val["sequence_id"])
+    assert 0 < val["sequence_id"].nunique() < 40
+    pd.testing.assert_frame_equal(split_by_protein(df, 0.25)[1], val)
@@ -0,0 +1,28 @@
+import warnings
+
+import pytest
+
+from mmseq2_boltz import get_mode, run_mmseqs2
+from msa_cache import MsaCache, server_backend
+
+BLOCK = ">101\nACDE\n>hit\nAC-E\n"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = MsaCache(str(tmp_path))
+    key = MsaCache.make_key("ACDE", get_mode(True, True, False, "greedy"), True, True, "greedy",
+                            server_backend("https://api.colabfold.com"))
+    cache.put(key, BLOCK)
+    return cache
+
+
+def test_prefix_is_deprecated(cache):
+    with pytest.warns(DeprecationWarning, match="prefix"):
+        assert run_mmseqs2("ACDE", prefix="tmp_P1", cache=cache) == [BLOCK]
+
+
+def test_no_warning_without_prefix(cache):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert run_mmseqs2(["ACDE", "ACDE"], cache=cache) == [BLOCK, BLOCK]
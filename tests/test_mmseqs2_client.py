@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from mmseqs2_client import MMseqs2Client, run_mmseqs2_batches
+from mock_colabfold_server import MockColabFoldServer
+
+BATCHES = [
+    ["MKTAYIAKQR", "GSHMSLFDFF"],
+    ["ACDEFGHIKL"],
+    ["MNPQRSTVWY", "MKTAYIAKQR", "WWWWWWWWWW"],
+    ["LLLLLKKKKK"],
+]
+# Polls are instant against the mock
+FAST = {"poll_interval": (0.0, 0.01), "use_env": False}
+
+
+def assert_blocks_match(batches, results):
+    assert len(results) == len(batches)
+    for seqs, blocks in zip(batches, results):
+        assert len(blocks) == len(seqs)
+        for seq, block in zip(seqs, blocks):
+            assert block.splitlines()[1] == seq
+
+
+def test_run_many_returns_batches_in_order():
+    done = []
+    with MockColabFoldServer(polls_until_complete=2) as server:
+        results = run_mmseqs2_batches(BATCHES, host_url=server.url,
+                                      on_result=lambda index, blocks: done.append(index), **FAST)
+    assert_blocks_match(BATCHES, results)
+    assert sorted(done) == list(range(len(BATCHES)))
+
+
+def test_ratelimited_submissions_are_retried():
+    with MockColabFoldServer(ratelimit_submissions=3) as server:
+        results = run_mmseqs2_batches(BATCHES, host_url=server.url, **FAST)
+        assert server.submissions == len(BATCHES) + 3
+    assert_blocks_match(BATCHES, results)
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 2])
+def test_max_in_flight_bounds_open_tickets(max_in_flight):
+    batches = [[seq] for batch in BATCHES for seq in batch]
+    with MockColabFoldServer(polls_until_complete=3) as server:
+        results = run_mmseqs2_batches(batches, max_in_flight=max_in_flight, host_url=server.url, **FAST)
+        assert server.max_in_flight == max_in_flight
+        assert server.in_flight == 0
+    assert_blocks_match(batches, results)
+
+
+def test_duplicate_sequences_share_one_query():
+    async def run(url):
+        client = MMseqs2Client(host_url=url, **FAST)
+        try:
+            return await client.run(["MKTAYIAKQR", "ACDEFGHIKL", "MKTAYIAKQR"])
+        finally:
+            client.close()
+
+    with MockColabFoldServer() as server:
+        blocks = asyncio.run(run(server.url))
+        assert [len(ticket["queries"]) for ticket in server.tickets.values()] == [2]
+    assert blocks[0] == blocks[2]
+    assert blocks[1].splitlines()[1] == "ACDEFGHIKL"
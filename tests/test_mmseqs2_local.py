@@ -0,0 +1,70 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+import mmseqs2_local
+from mmseqs2_local import LocalMMseqs2, make_database, run_mmseqs2_local
+from msa_cache import MsaCache
+
+TINY_DB_FASTA = Path(__file__).parent / "data" / "tiny_db.fasta"
+QUERIES = ["MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQ", "GSHMSLFDFFKNKGSAATATDRLKLAGLKN"]
+
+
+def test_unpack_returns_entries_in_query_order(tmp_path):
+    mmseqs = LocalMMseqs2(str(tmp_path), str(tmp_path), mmseqs_bin=sys.executable)
+    calls = []
+
+    def run(*args, **kwargs):
+        calls.append(args[0])
+        out_dir = Path(args[2])
+        # unpackdb names entries by key, in no particular order, NUL-terminated
+        (out_dir / "2.a3m").write_text(">103\nCC\n\x00")
+        (out_dir / "0.a3m").write_text(">101\nAA\n>hit\nA-\n\x00")
+        (out_dir / "3.a3m").write_text("\x00")
+
+    mmseqs.run = run
+    assert mmseqs.unpack("uniref.a3m", 4) == [">101\nAA\n>hit\nA-\n", "", ">103\nCC\n", ""]
+    assert calls == ["unpackdb"]
+
+
+class StubMMseqs2:
+    """LocalMMseqs2 stand-in: no search, the UniRef database has no entry for the first query."""
+
+    def __init__(self, db_dir, work_dir, *args):
+        self.work_dir = Path(work_dir)
+
+    def run(self, *args, **kwargs):
+        pass
+
+    def search_msa(self, query_db, profile_db, name, out, use_filter):
+        return self.work_dir / f"{out}_tmp"
+
+    def unpack(self, msa_db, n_queries):
+        return [""] + [f">{101 + i}\nHIT\n>hom\nHIT\n" for i in range(1, n_queries)]
+
+
+def test_queries_without_hits_get_a_query_only_msa(tmp_path, monkeypatch):
+    monkeypatch.setattr(mmseqs2_local, "LocalMMseqs2", StubMMseqs2)
+    cache = MsaCache(str(tmp_path / "cache"))
+    seqs = [QUERIES[0], QUERIES[1], QUERIES[0]]
+
+    blocks = run_mmseqs2_local(seqs, db_dir=str(tmp_path), use_env=False, cache=cache)
+    assert blocks == [f">101\n{QUERIES[0]}\n", ">102\nHIT\n>hom\nHIT\n", f">101\n{QUERIES[0]}\n"]
+    # Served from the cache the second time, the query-only block included
+    assert run_mmseqs2_local(seqs, db_dir=str(tmp_path), use_env=False, cache=cache) == blocks
+
+
+@pytest.mark.skipif(shutil.which("mmseqs") is None, reason="mmseqs is not installed")
+def test_search_against_tiny_database(tmp_path):
+    db_dir = tmp_path / "db"
+    make_database(str(TINY_DB_FASTA), str(db_dir))
+
+    blocks = run_mmseqs2_local(QUERIES, db_dir=str(db_dir), use_env=False, threads=1)
+    assert len(blocks) == len(QUERIES)
+    for i, (query, block) in enumerate(zip(QUERIES, blocks)):
+        lines = block.splitlines()
+        assert lines[0] == f">{101 + i}"
+        assert lines[1].replace("-", "") == query
+        assert len(lines) > 2
@@ -0,0 +1,100 @@
+import os
+import time
+
+from mmseqs2_local import local_backend
+from msa_cache import MsaCache, server_backend
+from wt_msas import msa_search_settings
+
+BLOCK = ">101\nACDE\n>hit\nAC-E\n"
+SERVER = server_backend("https://api.colabfold.com")
+
+
+def key(sequence: str) -> str:
+    return MsaCache.make_key(sequence, "env", True, True, "greedy", SERVER)
+
+
+def test_get_put(tmp_path):
+    cache = MsaCache(str(tmp_path))
+    assert cache.get(key("ACDE")) is None
+    cache.put(key("ACDE"), BLOCK)
+    assert cache.get(key("ACDE")) == BLOCK
+    assert cache.get(key("ACDF")) is None
+
+
+def test_key_depends_on_search_parameters():
+    assert key("ACDE") == key("acde")
+    assert key("ACDE") != MsaCache.make_key("ACDE", "env", False, True, "greedy", SERVER)
+    assert key("ACDE") != MsaCache.make_key("ACDE", "env", True, False, "greedy", SERVER)
+
+
+def test_key_depends_on_backend_and_databases(tmp_path):
+    db_dir = tmp_path / "db"
+    db_dir.mkdir()
+    (db_dir / "uniref30_2302_db.dbtype").write_bytes(b"\0")
+    (db_dir / "colabfold_envdb_202108_db.dbtype").write_bytes(b"\0")
+
+    local = msa_search_settings(db_dir=str(db_dir))
+    assert local["backend"] == local_backend(str(db_dir))
+    assert key("ACDE") == MsaCache.make_key("ACDE", **msa_search_settings())
+    assert key("ACDE") != MsaCache.make_key("ACDE", **local)
+    assert local != msa_search_settings(db_dir=str(db_dir), use_env=False)
+
+    # Rebuilding a database changes its fingerprint
+    (db_dir / "uniref30_2302_db.dbtype").write_bytes(b"\0\0")
+    assert MsaCache.make_key("ACDE", **local) != MsaCache.make_key("ACDE", **msa_search_settings(db_dir=str(db_dir)))
+
+
+def test_instances_sharing_a_root_see_each_others_entries(tmp_path):
+    first, second = MsaCache(str(tmp_path)), MsaCache(str(tmp_path))
+    first.put(key("AAAA"), BLOCK)
+    second.put(key("CCCC"), BLOCK)
+    fresh = MsaCache(str(tmp_path))
+    assert fresh.get(key("AAAA")) == BLOCK
+    assert fresh.get(key("CCCC")) == BLOCK
+
+
+def test_entry_files_are_authoritative(tmp_path):
+    cache = MsaCache(str(tmp_path))
+    cache.put(key("AAAA"), BLOCK)
+    os.remove(cache.index_path)
+    rebuilt = MsaCache(str(tmp_path))
+    assert rebuilt.get(key("AAAA")) == BLOCK
+    assert rebuilt.index.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 1
+
+    os.remove(cache._entry_path(key("AAAA")))
+    assert rebuilt.get(key("AAAA")) is None
+
+
+def test_corrupt_index_is_rebuilt(tmp_path):
+    MsaCache(str(tmp_path)).put(key("AAAA"), BLOCK)
+    with open(os.path.join(tmp_path, MsaCache.INDEX_FILENAME), "wb") as f:
+        f.write(b"not a database" * 100)
+    cache = MsaCache(str(tmp_path), max_size_mb=0)
+    assert cache.get(key("AAAA")) == BLOCK
+    assert cache.evict() == 1
+
+
+def test_evict_least_recently_used(tmp_path):
+    size_mb = len(BLOCK) / (1024 * 1024)
+    cache = MsaCache(str(tmp_path), max_size_mb=2.5 * size_mb)
+    for sequence in ("AAAA", "CCCC", "DDDD"):
+        cache.put(key(sequence), BLOCK)
+        time.sleep(0.01)
+    cache.get(key("AAAA"))
+
+    assert cache.evict() == 1
+    assert cache.get(key("CCCC")) is None
+    assert cache.get(key("AAAA")) == BLOCK
+    assert cache.get(key("DDDD")) == BLOCK
+
+
+def test_evict_by_age(tmp_path):
+    cache = MsaCache(str(tmp_path), max_age_days=1)
+    cache.put(key("AAAA"), BLOCK)
+    cache.put(key("CCCC"), BLOCK)
+    cache.index.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time() - 2 * 86400, key("AAAA")))
+    cache.index.commit()
+
+    assert cache.evict() == 1
+    assert cache.get(key("AAAA")) is None
+    assert cache.get(key("CCCC")) == BLOCK
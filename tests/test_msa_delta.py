@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import pandas as pd
+
+from msa_delta import DELTA_SUFFIX, A3mDeltaReader, DeltaMsaResolver, mutant_msa_path, read_deltas
+from mut_msa import A3mMutator
+
+WT_A3M = (
+    ">P1\nMKTAYIAK\n"
+    ">hit1\nMKTaaAYIAK\n"
+    ">hit2\n-KTAY-AK\n"
+    ">hit3\nMRTAYIAKgg\n"
+)
+MUTATIONS = ["K2R", "A4G", "Y5F:K8E"]
+
+
+def write_msa_dir(path, storage):
+    os.makedirs(path)
+    with open(os.path.join(path, "P1.a3m"), "w") as f:
+        f.write(WT_A3M)
+    mutations = pd.DataFrame({"sequence_id": "P1", "mutation": MUTATIONS, "ddg": 0.0})
+    failures = A3mMutator(str(path), mutations, storage=storage).mutate_directory()
+    assert not failures
+    return path
+
+
+def test_delta_round_trip_matches_full_storage(tmp_path):
+    full_dir = write_msa_dir(tmp_path / "full", "full")
+    delta_dir = write_msa_dir(tmp_path / "delta", "delta")
+
+    records = read_deltas(os.path.join(delta_dir, f"P1{DELTA_SUFFIX}"))
+    assert [record["name"] for record in records] == [f"P1_{m}" for m in MUTATIONS]
+    assert not any(os.path.exists(mutant_msa_path(delta_dir, record["name"])) for record in records)
+
+    reader = A3mDeltaReader(str(delta_dir))
+    for name in reader.list_mutants():
+        out_path = reader.materialize(name, str(tmp_path / f"{name}.a3m"))
+        with open(out_path) as materialized, open(mutant_msa_path(full_dir, name)) as full:
+            assert materialized.read() == full.read()
+
+
+def test_resolver_materializes_only_missing_delta_mutants(tmp_path):
+    delta_dir = write_msa_dir(tmp_path / "delta", "delta")
+    out_dir = str(tmp_path / "resolved")
+    resolver = DeltaMsaResolver()
+
+    wt_path = os.path.join(delta_dir, "P1.a3m")
+    assert resolver.resolve(wt_path, out_dir) == wt_path
+
+    unknown = mutant_msa_path(str(delta_dir), "P1_W3A")
+    assert resolver.resolve(unknown, out_dir) == unknown
+
+    resolved = resolver.resolve(mutant_msa_path(str(delta_dir), "P1_K2R"), out_dir)
+    assert resolved == os.path.join(out_dir, "P1_K2R.a3m")
+    with open(resolved) as f:
+        assert f.read().startswith(">P1_K2R\nMRTAYIAK\n")
+    shutil.rmtree(out_dir)
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from a3m_alignment import A3mAlignment
+from msa_delta import mutant_msa_path
+import msa_features
+from msa_features import FEATURE_NAMES, FeatureCache, compute_features, msa_hash
+from mut_msa import A3mMutator
+
+# Rows with insertions (lowercase) before, between and after match columns
+WT_A3M = (
+    ">P1\nACDEFG\n"
+    ">hit1\nAaaCDEFG\n"
+    ">hit2\nAC-EfFgG\n"
+    ">hit3\nkkA-DEF-\n"
+)
+MUTATIONS = ["C2W", "E4K:G6P", "A1S"]
+
+
+def test_mutant_features_match_mutant_msa(tmp_path):
+    msa_dir = tmp_path / "msas"
+    msa_dir.mkdir()
+    (msa_dir / "P1.a3m").write_text(WT_A3M)
+    mutations = pd.DataFrame({"sequence_id": "P1", "mutation": MUTATIONS, "ddg": 0.0})
+    assert not A3mMutator(str(msa_dir), mutations, storage="full").mutate_directory()
+
+    cache = FeatureCache(str(tmp_path / "features"))
+    wt_path = os.path.join(msa_dir, "P1.a3m")
+    for mutation in MUTATIONS:
+        expected = compute_features(A3mAlignment.from_file(mutant_msa_path(str(msa_dir), f"P1_{mutation}")))
+        features = cache.get_mutant("P1", wt_path, mutation)
+        for name in FEATURE_NAMES:
+            np.testing.assert_allclose(features[name], expected[name], err_msg=f"{mutation} {name}")
+
+    # Patching a mutant must leave the cached WT arrays untouched
+    wt = cache.get_wt("P1", wt_path)
+    np.testing.assert_array_equal(wt["msa"], compute_features(A3mAlignment.from_file(wt_path))["msa"])
+
+
+def test_deletion_matrix_counts_insertions_before_each_match_column():
+    features = compute_features(A3mAlignment.from_bytes(WT_A3M.encode()))
+    assert features["deletion_matrix"].tolist() == [
+        [0, 0, 0, 0, 0, 0],
+        [0, 2, 0, 0, 0, 0],
+        [0, 0, 0, 0, 1, 1],
+        [2, 0, 0, 0, 0, 0],
+    ]
+
+
+def test_mutants_hash_the_wt_msa_once(tmp_path, monkeypatch):
+    wt_path = tmp_path / "P1.a3m"
+    wt_path.write_text(WT_A3M)
+    calls = []
+    monkeypatch.setattr(msa_features, "msa_hash", lambda path: calls.append(path) or msa_hash(path))
+
+    cache = FeatureCache(str(tmp_path / "features"))
+    for mutation in MUTATIONS * 3:
+        cache.get_mutant("P1", str(wt_path), mutation)
+    assert len(calls) == 1
+
+    # A changed WT file is hashed again and gets a fresh feature set
+    wt_path.write_text(WT_A3M.replace("hit3\nkkA-DEF-", "hit3\nkkkA-DEFG"))
+    features = cache.get_mutant("P1", str(wt_path), "C2W")
+    assert len(calls) == 2
+    assert features["msa"][3, 5] == features["msa"][0, 5]
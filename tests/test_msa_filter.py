@@ -0,0 +1,120 @@
+import argparse
+
+import numpy as np
+import pytest
+
+from a3m_alignment import A3mAlignment
+from msa_filter import MsaFilter, add_filter_arguments, filter_from_args
+
+AMINO_ACIDS = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY", dtype=np.uint8)
+
+
+def random_alignment(n_rows=300, length=40, seed=0):
+    """Query plus homologs at varying identity and coverage, with insertions and duplicate rows."""
+    rng = np.random.default_rng(seed)
+    query = rng.choice(AMINO_ACIDS, length)
+    records = [(">query", query.tobytes().decode())]
+    for i in range(1, n_rows):
+        if i % 10 == 0:
+            records.append((f">dup{i}", records[-1][1]))
+            continue
+        row = np.where(rng.random(length) < rng.random(), rng.choice(AMINO_ACIDS, length), query)
+        row[rng.random(length) < rng.random() * 0.5] = ord("-")
+        residues = [chr(c) for c in row]
+        insert_at = rng.integers(0, length)
+        residues[insert_at] += "".join(rng.choice(list("acdefg"), rng.integers(0, 3)))
+        records.append((f">hit{i}", "".join(residues)))
+    return A3mAlignment.from_records(records)
+
+
+def kept_matrix(alignment, rows):
+    return alignment.match_matrix()[rows]
+
+
+@pytest.mark.parametrize("msa_filter", [
+    MsaFilter(),
+    MsaFilter(min_coverage=0.6, min_query_identity=0.3),
+    MsaFilter(max_seq_identity=0.8),
+    MsaFilter(max_depth=25, n_strata=5, seed=3),
+    MsaFilter(dedupe=False, max_depth=1),
+])
+def test_rows_start_with_query_and_keep_order(msa_filter):
+    alignment = random_alignment()
+    rows = msa_filter.select_rows(alignment)
+    assert rows[0] == 0
+    assert (np.diff(rows) > 0).all()
+    if msa_filter.max_depth is not None:
+        assert len(rows) <= msa_filter.max_depth
+
+
+def test_dedupe_drops_identical_match_rows():
+    alignment = random_alignment()
+    rows = MsaFilter().select_rows(alignment)
+    kept = kept_matrix(alignment, rows)
+    assert len({row.tobytes() for row in kept}) == len(rows)
+    assert len(rows) < len(alignment)
+
+
+def test_coverage_and_identity_thresholds_hold_for_kept_rows():
+    alignment = random_alignment()
+    msa_filter = MsaFilter(min_coverage=0.6, min_query_identity=0.3)
+    kept = kept_matrix(alignment, msa_filter.select_rows(alignment))[1:]
+    aligned = kept != ord("-")
+    assert (aligned.sum(axis=1) >= 0.6 * kept.shape[1]).all()
+    identity = ((kept == kept_matrix(alignment, [0])) & aligned).sum(axis=1) / aligned.sum(axis=1)
+    assert (identity >= 0.3).all()
+
+
+def test_kept_rows_are_not_redundant():
+    alignment = random_alignment()
+    msa_filter = MsaFilter(max_seq_identity=0.8)
+    rows = msa_filter.select_rows(alignment)
+    msa = alignment.match_matrix()
+    aligned = msa != ord("-")
+    identity = MsaFilter._identity(msa, aligned, rows, rows)
+    np.fill_diagonal(identity, 0)
+    assert (identity <= 0.8).all()
+
+
+def test_subsampling_is_seeded_and_covers_every_stratum():
+    alignment = random_alignment()
+    msa_filter = MsaFilter(max_depth=25, n_strata=5, seed=3)
+    rows = msa_filter.select_rows(alignment)
+    assert len(rows) == 25
+    np.testing.assert_array_equal(rows, MsaFilter(max_depth=25, n_strata=5, seed=3).select_rows(alignment))
+
+    msa = alignment.match_matrix()
+    aligned = msa != ord("-")
+    identity = ((msa == msa[0]) & aligned).sum(axis=1) / np.maximum(aligned.sum(axis=1), 1)
+    strata = np.minimum((identity * 5).astype(int), 4)
+    candidates = MsaFilter().select_rows(alignment)[1:]
+    assert set(strata[rows[1:]]) == set(strata[candidates])
+
+
+def test_filter_file_keeps_selected_records_verbatim(tmp_path):
+    alignment = random_alignment()
+    path = tmp_path / "P1.a3m"
+    alignment.write(str(path))
+    msa_filter = MsaFilter(max_depth=25, n_strata=5)
+
+    before, after = msa_filter.filter_file(str(path))
+    assert (before, after) == (len(alignment), 25)
+    filtered = list(A3mAlignment.from_file(str(path)).records())
+    assert filtered == [alignment[i] for i in msa_filter.select_rows(alignment)]
+
+
+def parse_filter_args(*argv, **defaults):
+    parser = argparse.ArgumentParser()
+    add_filter_arguments(parser)
+    parser.set_defaults(**defaults)
+    return filter_from_args(parser.parse_args(argv))
+
+
+def test_filter_from_args():
+    assert parse_filter_args() is None
+    assert parse_filter_args("--msa_keep_duplicates") is None
+    assert parse_filter_args("--msa_dedupe").signature() == MsaFilter().signature()
+    assert parse_filter_args(msa_dedupe=True).dedupe
+    assert parse_filter_args("--msa_keep_duplicates", msa_dedupe=True) is None
+    assert not parse_filter_args("--msa_keep_duplicates", "--msa_max_depth", "10").dedupe
+    assert parse_filter_args("--msa_max_depth", "10").dedupe
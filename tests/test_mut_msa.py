@@ -0,0 +1,52 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from msa_delta import DELTA_SUFFIX, read_deltas
+from mut_msa import QUERY_INFO_FILE, A3mMutator
+
+WT_A3M = ">P1\nMKTAYIAK\n>hit1\nMKTaaAYIAK\n>hit2\n-KTAY-AK\n"
+# W3A does not match the WT residue (T), 'bogus' is not a mutation
+MUTATIONS = ["K2R", "W3A", "A4G", "bogus"]
+
+
+def mutate(tmp_path, storage="full", max_workers=1):
+    with open(tmp_path / "P1.a3m", "w") as f:
+        f.write(WT_A3M)
+    mutations = pd.DataFrame({"sequence_id": "P1", "mutation": MUTATIONS, "ddg": 0.0})
+    done = {}
+    failures = A3mMutator(str(tmp_path), mutations, storage=storage).mutate_directory(
+        max_workers=max_workers, on_done=lambda seq_id, written: done.update({seq_id: written}))
+    return failures, done
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_invalid_mutations_fail_alone(tmp_path, max_workers):
+    failures, done = mutate(tmp_path, max_workers=max_workers)
+    assert set(failures) == {"P1_W3A", "P1_bogus"}
+    assert "does not match" in failures["P1_W3A"]
+    assert done == {"P1": ["K2R", "A4G"]}
+    assert (tmp_path / "P1_K2R.a3m").is_file() and (tmp_path / "P1_A4G.a3m").is_file()
+    assert not (tmp_path / "P1_W3A.a3m").exists()
+
+
+def test_invalid_mutations_fail_alone_in_delta_storage(tmp_path):
+    failures, done = mutate(tmp_path, storage="delta")
+    assert set(failures) == {"P1_W3A", "P1_bogus"}
+    assert done == {"P1": ["K2R", "A4G"]}
+    assert [record["mutation"] for record in read_deltas(tmp_path / f"P1{DELTA_SUFFIX}")] == ["K2R", "A4G"]
+
+
+def test_query_info_is_compacted(tmp_path):
+    mutate(tmp_path)
+    mutate(tmp_path)
+    with open(tmp_path / QUERY_INFO_FILE) as f:
+        records = [json.loads(line) for line in f]
+    assert sorted(record["file"] for record in records) == ["P1.a3m", "P1_A4G.a3m", "P1_K2R.a3m"]
+
+    os.remove(tmp_path / "P1_A4G.a3m")
+    mutate(tmp_path, storage="delta")
+    with open(tmp_path / QUERY_INFO_FILE) as f:
+        assert [json.loads(line)["file"] for line in f] == ["P1.a3m", "P1_K2R.a3m"]
@@ -0,0 +1,21 @@
+from preprocess import PreprocessPipeline
+
+
+def msa_hash(tmp_path, name, **msa_kwargs):
+    pipeline = PreprocessPipeline("dataset", "raw.csv", str(tmp_path / name), "template.yaml", msa_kwargs=msa_kwargs)
+    try:
+        return pipeline.msa_hash("ACDE")
+    finally:
+        pipeline.manifest.close()
+
+
+def test_msa_hash_depends_on_search_settings(tmp_path):
+    db_dir = tmp_path / "db"
+    db_dir.mkdir()
+    (db_dir / "uniref30_2302_db.dbtype").write_bytes(b"\0")
+
+    server = msa_hash(tmp_path, "server", batch_size=4)
+    assert server == msa_hash(tmp_path, "server_again", batch_size=8, max_workers=2)
+    assert server != msa_hash(tmp_path, "no_env", use_env=False)
+    assert server != msa_hash(tmp_path, "no_filter", use_filter=False)
+    assert server != msa_hash(tmp_path, "local", db_dir=str(db_dir))
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from profiling import Profiler, reset_rss_high_water
+
+pytestmark = pytest.mark.skipif(not reset_rss_high_water(), reason="the RSS high-water mark cannot be reset here")
+
+
+def allocate(mb: int) -> None:
+    np.ones(mb * 1024 * 1024, dtype=np.uint8)
+
+
+def test_stage_peak_rss_is_per_stage():
+    profiler = Profiler()
+    with profiler.stage("heavy"):
+        allocate(200)
+    with profiler.stage("light"):
+        allocate(1)
+
+    stats = profiler.report()["stages"]
+    assert stats["heavy"]["peak_rss_mb"] - stats["light"]["peak_rss_mb"] > 150
+    assert "max_rss_so_far_mb" not in stats["light"]
+
+
+def test_nested_stage_keeps_parent_peak():
+    profiler = Profiler()
+    with profiler.stage("outer"):
+        allocate(200)
+        with profiler.stage("inner"):
+            allocate(1)
+
+    stats = profiler.report()["stages"]
+    assert stats["outer"]["peak_rss_mb"] - stats["inner"]["peak_rss_mb"] > 150
+    assert profiler.max_rss_mb() >= stats["outer"]["peak_rss_mb"]
@@ -0,0 +1,55 @@
+import json
+import os
+
+import yaml
+
+from query_shards import INDEX_FILE, QueryShards, QueryShardWriter
+
+
+def query(name, sequence="ACDE"):
+    return {"version": 1, "sequences": [{"protein": {"id": "A", "sequence": sequence, "msa": f"{name}.a3m"}}]}
+
+
+def test_index_offsets_point_at_each_record(tmp_path):
+    writer = QueryShardWriter(str(tmp_path), shard_size=2)
+    for i in range(5):
+        writer.add(f"P{i}", query(f"P{i}"))
+    writer.close()
+
+    with open(tmp_path / INDEX_FILE) as f:
+        index = json.load(f)
+    assert index["shards"] == ["queries-00000.jsonl", "queries-00001.jsonl", "queries-00002.jsonl"]
+    for name, (shard, offset) in index["queries"].items():
+        with open(tmp_path / index["shards"][shard], "rb") as f:
+            f.seek(offset)
+            assert json.loads(f.readline()) == {"name": name, "query": query(name)}
+
+
+def test_reopened_writer_supersedes_earlier_records(tmp_path):
+    writer = QueryShardWriter(str(tmp_path), shard_size=2)
+    for name in ("P0", "P1", "P2"):
+        writer.add(name, query(name))
+    writer.close()
+
+    writer = QueryShardWriter(str(tmp_path), shard_size=2)
+    writer.add("P1", query("P1", "WWWW"))
+    writer.close()
+
+    shards = QueryShards(str(tmp_path))
+    assert len(shards) == 3
+    assert shards.load("P1") == query("P1", "WWWW")
+    assert [name for shard in range(len(shards)) for name, _ in shards.iter_shard(shard)] == ["P0", "P2", "P1"]
+
+
+def test_expanded_writes_and_removes_yaml(tmp_path):
+    writer = QueryShardWriter(str(tmp_path / "shards"), shard_size=10)
+    for name in ("P0", "P0_A1G:C2W"):
+        writer.add(name, query(name))
+    writer.close()
+
+    out_dir = tmp_path / "expanded"
+    with QueryShards(str(tmp_path / "shards")).expanded(0, str(out_dir)) as paths:
+        assert sorted(os.listdir(out_dir)) == ["P0.yaml", "P0_A1G_C2W.yaml"]
+        with open(paths[1]) as f:
+            assert yaml.safe_load(f) == query("P0_A1G:C2W")
+    assert os.listdir(out_dir) == []
@@ -0,0 +1,81 @@
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from sequence_resolver import SequenceResolver
+
+SEQUENCES = {"P1": "MKTAYIAK", "P2": "GSHMSLFD", "P3": "ACDEFGHIK"}
+# Responses sent before the sequence, per ID
+FAILURES = {"P2": [429], "P3": [503, 500]}
+
+
+class StubUniProt(BaseHTTPRequestHandler):
+    """Serves `/<id>.fasta` like the UniProtKB REST endpoint."""
+
+    requests: Counter = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        sequence_id = self.path.strip("/").removesuffix(".fasta")
+        with self.lock:
+            attempt = self.requests[sequence_id]
+            self.requests[sequence_id] += 1
+        failures = FAILURES.get(sequence_id, [])
+        if attempt < len(failures):
+            self.send_response(failures[attempt])
+            self.end_headers()
+            return
+        if sequence_id not in SEQUENCES:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = f">sp|{sequence_id}|TEST\n{SEQUENCES[sequence_id]}\n".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def uniprot_url():
+    StubUniProt.requests = Counter()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubUniProt)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def resolver(url, tmp_path):
+    return SequenceResolver(cache_path=str(tmp_path / "sequences.sqlite"), uniprot_url=url,
+                            max_workers=3, backoff_factor=0)
+
+
+def test_fetches_batch_with_retries(uniprot_url, tmp_path):
+    ids = ["P1", "P2", "P3", "P1"]
+    assert resolver(uniprot_url, tmp_path).fetch_sequences(ids) == SEQUENCES
+    # Duplicates are requested once, 429 and 5xx responses are retried
+    assert StubUniProt.requests == {"P1": 1, "P2": 2, "P3": 3}
+
+
+def test_second_run_is_served_from_cache(uniprot_url, tmp_path):
+    resolver(uniprot_url, tmp_path).fetch_sequences(list(SEQUENCES))
+    StubUniProt.requests.clear()
+
+    assert resolver(uniprot_url, tmp_path).fetch_sequences(list(SEQUENCES)) == SEQUENCES
+    assert not StubUniProt.requests
+
+
+def test_failed_ids_do_not_discard_fetched_ones(uniprot_url, tmp_path):
+    with pytest.raises(RuntimeError, match="1 sequence"):
+        resolver(uniprot_url, tmp_path).fetch_sequences(["P1", "MISSING"])
+    StubUniProt.requests.clear()
+
+    assert resolver(uniprot_url, tmp_path).fetch_sequence("P1") == SEQUENCES["P1"]
+    assert not StubUniProt.requests